@@ -0,0 +1,58 @@
+"""Auction of the pile once the deck and the public cards run out.
+
+The cards of the pile are auctioned one at a time, players bidding in turn
+order. A player can bid up to the value of the gold in their hand, and at
+least 1, so the opening bid is always possible; the first bid on a card
+is never less than 1. Once there is a bidder the players who cannot go
+higher are skipped, and the card goes to the highest bidder when the turn
+comes back to them. Game.resolve_auction() plays a whole round of sealed
+bids in one call.
+"""
+
+
+# the lowest bid, which every player can make
+MIN_BID = 1
+
+
+def gold(player):
+    """Returns the gold ``player`` can bid with."""
+    return player.score_type('gold').value
+
+
+def bid_limit(gold):
+    """Returns the highest bid of a player holding ``gold``."""
+    return max(gold, MIN_BID)
+
+
+def max_bid(player):
+    return bid_limit(gold(player))
+
+
+def can_outbid(game, player):
+    """Tells if ``player`` can bid higher on the card up for auction."""
+    bidder = game.auction_bidder
+    if game.auction_card is None or bidder is None:
+        return True
+    return player is not bidder and max_bid(player) > game.auction_gold
+
+
+def must_pass(game, player):
+    """Tells if the turn of ``player`` would be a forced pass."""
+    return (player is not game.auction_bidder and
+            not can_outbid(game, player))
+
+
+def bidders(game):
+    """Returns the seats that can still bid on the card up for auction."""
+    return [seat for seat, player in enumerate(game.players)
+            if can_outbid(game, player)]
+
+
+def place_bid(game, player, bid_gold):
+    """Records a bid and tells if it is the new highest one."""
+    if game.auction_bidder is None:
+        bid_gold = max(bid_gold or 0, MIN_BID)
+    if bid_gold > game.auction_gold and player is not game.auction_bidder:
+        game.auction_bidder, game.auction_gold = player, bid_gold
+        return True
+    return False
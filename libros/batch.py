@@ -0,0 +1,358 @@
+"""Many games with the same number of players stepped in lockstep.
+
+Every zone of every game lives in a NumPy array of card indices (see
+``libros.game.CARDS``) so one step plays a turn in all games at once and
+``winner()`` scores the whole batch in a single pass. Results match the
+scalar ``Game`` played with the same seeds and actions.
+"""
+import numpy as np
+
+from libros.auction import MIN_BID
+from libros.game import (
+    Card, Game, Player, CARDS, CARDS_BY_KEY, COLORS, TIEBREAK_COLORS, TYPES,
+    VALID_ACTION_MASKS, TAKE_KEY, PILE_KEY, SHOW_KEY, CHANGE_KEY, BID_KEY,
+    PUBLIC_CHANGE_KEY, ACTIONS, ACTION_TAKE_CARD, ACTION_PILE_CARD,
+    ACTION_SHOW_CARD, ACTION_DISCARD_CARD, ACTION_USE_CARD, ACTION_BID_CARD,
+)
+
+
+STATES = ('turn', 'public', 'auction', 'end')
+TURN, PUBLIC, AUCTION, END = range(len(STATES))
+
+GOLD, CHANGE = TYPES.index('gold'), TYPES.index('change')
+
+NO_CARD = -1
+
+CARD_TYPES = np.array([TYPES.index(card.type) for card in CARDS], np.int8)
+CARD_VALUES = np.array([card.value for card in CARDS], np.int16)
+CARD_LETTERS = np.array([ord(card.letter) - ord('A') if card.letter else 0
+                         for card in CARDS], np.int16)
+
+# cards with the same type, value and letter share a key, NO_CARD has none
+CARD_KEYS = np.array([CARDS_BY_KEY[card.key].index for card in CARDS] + [-1],
+                     np.int16)
+
+# value of each card counted in the total of its type
+TYPE_VALUES = np.array([[card.value * (CARD_TYPES[card.index] == kind)
+                         for kind in xrange(len(TYPES))]
+                        for card in CARDS], np.int32)
+
+# gold each card adds to what a player can bid, see libros.auction
+GOLD_VALUES = np.where(CARD_TYPES == GOLD, CARD_VALUES, 0).astype(np.int32)
+
+ACTION_MASKS = np.array(VALID_ACTION_MASKS, np.uint8)
+
+
+def _indices(cards):
+    return [Card.from_dict(card).index for card in cards]
+
+
+class BatchGame(object):
+    """Arrays holding the state of ``games``, all started with the same
+    number of players, that are then stepped together."""
+
+    def __init__(self, games):
+        games = list(games)
+        size = self.size = len(games)
+        players = self.player_count = games[0].player_count
+        cards = len(CARDS)
+
+        self.state = np.zeros(size, np.int8)
+        self.seat = np.zeros(size, np.int8)
+        self.turns_left = np.zeros(size, np.int16)
+        self.actions_taken = np.zeros((size, len(ACTIONS)), np.int16)
+        self.dice = np.zeros((size, len(COLORS)), np.int16)
+        self.deck = np.full((size, cards), NO_CARD, np.int16)
+        self.deck_count = np.zeros(size, np.int16)
+        self.pile = np.full((size, cards), NO_CARD, np.int16)
+        self.pile_count = np.zeros(size, np.int16)
+        self.public = np.full((size, players), NO_CARD, np.int16)
+        self.public_count = np.zeros(size, np.int16)
+        self.discarded = np.full((size, cards), NO_CARD, np.int16)
+        self.discarded_count = np.zeros(size, np.int16)
+        self.hands = np.zeros((size, players, cards), np.uint8)
+        self.auction_card = np.full(size, NO_CARD, np.int16)
+        self.auction_bidder = np.full(size, -1, np.int8)
+        self.auction_gold = np.zeros(size, np.int16)
+        self.auction_won = np.zeros(size, np.bool_)
+
+        for row, game in enumerate(games):
+            assert game.player_count == players
+            self._load(row, game.snapshot())
+
+    @classmethod
+    def new(cls, seeds, players=2, compact=True):
+        """Starts one game per seed, like ``Game(seed=seed).start()``."""
+        return cls(Game.new([Player() for _ in xrange(players)],
+                            compact=compact, seed=seed) for seed in seeds)
+
+    def _load(self, row, snapshot):
+        self.state[row] = STATES.index(snapshot.state)
+        self.seat[row] = snapshot.seat
+        self.turns_left[row] = snapshot.turns_left
+        self.actions_taken[row] = snapshot.actions_taken
+        self.dice[row] = snapshot.dice
+        for name in ('deck', 'pile', 'public', 'discarded'):
+            cards = _indices(getattr(snapshot, name))
+            getattr(self, name)[row, :len(cards)] = cards
+            getattr(self, name + '_count')[row] = len(cards)
+        for seat, cards in enumerate(snapshot.hands):
+            np.add.at(self.hands[row, seat], _indices(cards), 1)
+        card, bidder, gold, won = snapshot.auction
+        if card is not None:
+            self.auction_card[row] = Card.from_dict(card).index
+        if bidder is not None:
+            self.auction_bidder[row] = bidder
+        self.auction_gold[row] = gold
+        self.auction_won[row] = won
+
+    def game_state(self, row):
+        """Returns the state of one game in the layout of a Snapshot, with
+        hands as sorted card indices."""
+        def cards(name):
+            count = getattr(self, name + '_count')[row]
+            return [int(card) for card in getattr(self, name)[row, :count]]
+
+        return {
+            'state': STATES[self.state[row]],
+            'seat': int(self.seat[row]),
+            'turns_left': int(self.turns_left[row]),
+            'deck': cards('deck'),
+            'pile': cards('pile'),
+            'public': cards('public'),
+            'discarded': cards('discarded'),
+            'dice': tuple(int(value) for value in self.dice[row]),
+            'actions_taken': tuple(int(n) for n in self.actions_taken[row]),
+            'hands': [sorted(np.repeat(np.arange(len(CARDS)), hand).tolist())
+                      for hand in self.hands[row]],
+        }
+
+    @property
+    def done(self):
+        return self.state == END
+
+    def pending_cards(self, public_choice=None):
+        """Returns the card each active player would get from turn()."""
+        rows = np.arange(self.size)
+        choice = self._choice(public_choice)
+        cards = np.full(self.size, NO_CARD, np.int16)
+
+        turn = self.state == TURN
+        cards[turn] = self.deck[rows[turn], self.deck_count[turn] - 1]
+        public = self.state == PUBLIC
+        cards[public] = self.public[rows[public], choice[public]]
+        auction = self.state == AUCTION
+        fresh = auction & (self.auction_card == NO_CARD)
+        cards[auction] = self.auction_card[auction]
+        cards[fresh] = self.pile[rows[fresh], self.pile_count[fresh] - 1]
+        return cards
+
+    def action_masks(self, public_choice=None):
+        """Returns the valid action bitmask of every game's next turn."""
+        cards = self.pending_cards(public_choice)
+        change = CARD_TYPES[cards] == CHANGE
+        taken = self.actions_taken
+        bidder = np.where(self.auction_card == NO_CARD, -1,
+                          self.auction_bidder)
+
+        keys = np.where(taken[:, ACTION_TAKE_CARD] == 0,
+                        np.where(change, TAKE_KEY | CHANGE_KEY, TAKE_KEY), 0)
+        keys |= np.where(taken[:, ACTION_PILE_CARD] == 0, PILE_KEY, 0)
+        keys |= np.where(
+            taken[:, ACTION_SHOW_CARD] != self.player_count - 1, SHOW_KEY, 0)
+        keys = np.where(
+            self.state == AUCTION,
+            np.where(bidder != self.seat, BID_KEY,
+                     np.where(change, TAKE_KEY | CHANGE_KEY, TAKE_KEY)),
+            keys)
+        keys = np.where(self.state == PUBLIC,
+                        np.where(change, PUBLIC_CHANGE_KEY, TAKE_KEY), keys)
+
+        masks = ACTION_MASKS[keys]
+        masks[self.state == END] = 0
+        return masks
+
+    def _choice(self, public_choice):
+        if public_choice is None:
+            # like Player.choose_public_card
+            return np.zeros(self.size, np.intp)
+        return np.asarray(public_choice, np.intp)
+
+    def step(self, actions, public_choice=None, change_colors=None,
+             change_signs=None, bid_gold=None):
+        """Plays one turn in every unfinished game and returns its cards.
+
+        ``actions`` has one action per game. ``public_choice`` is the index
+        of the public card to pick, ``change_colors`` two color indices per
+        game (-1 when unused) and ``change_signs`` the +1/-1 applied by a
+        plus-or-minus card. Without ``bid_gold`` bids are made like
+        ``Player.act`` does.
+        """
+        rows = np.arange(self.size)
+        actions = np.asarray(actions, np.int8)
+        choice = self._choice(public_choice)
+        state = self.state
+        live = state != END
+        turn = state == TURN
+        public = state == PUBLIC
+        auction = state == AUCTION
+        seat = self.seat
+        cards = np.full(self.size, NO_CARD, np.int16)
+
+        # turn()
+        idx = rows[turn]
+        self.deck_count[idx] -= 1
+        cards[idx] = self.deck[idx, self.deck_count[idx]]
+        self.deck[idx, self.deck_count[idx]] = NO_CARD
+        self.turns_left[idx] -= 1
+
+        idx = rows[public]
+        cards[idx] = self.public[idx, choice[idx]]
+
+        idx = rows[auction & (self.auction_card == NO_CARD)]
+        self.pile_count[idx] -= 1
+        self.auction_card[idx] = self.pile[idx, self.pile_count[idx]]
+        self.pile[idx, self.pile_count[idx]] = NO_CARD
+        self.auction_bidder[idx] = -1
+        self.auction_gold[idx] = 0
+        self.auction_won[idx] = False
+        cards[auction] = self.auction_card[auction]
+
+        # Player.act()
+        bid = auction & (actions == ACTION_BID_CARD)
+        if bid_gold is None:
+            bid_gold = np.where(bid & (self.auction_bidder != seat), 1, 0)
+        bid_gold = np.asarray(bid_gold, np.int16)
+
+        idx = rows[live & (actions == ACTION_TAKE_CARD)]
+        self.hands[idx, seat[idx], cards[idx]] += 1
+
+        # turn_action()
+        idx = rows[public]
+        count = self.public_count[idx]
+        # like list.remove, drop the first card equal to the chosen one
+        same = CARD_KEYS[self.public[idx]] == CARD_KEYS[cards[idx], None]
+        position = same.argmax(axis=1)
+        for column in xrange(self.player_count - 1):
+            shift = idx[(column >= position) & (column < count - 1)]
+            self.public[shift, column] = self.public[shift, column + 1]
+        self.public[idx, count - 1] = NO_CARD
+        self.public_count[idx] -= 1
+
+        self._push(self.pile, self.pile_count,
+                   rows[live & (actions == ACTION_PILE_CARD)], cards)
+        self._push(self.public, self.public_count,
+                   rows[live & (actions == ACTION_SHOW_CARD)], cards)
+        self._use_change_cards(
+            rows[live & (actions == ACTION_USE_CARD)], cards,
+            change_colors, change_signs)
+
+        idx = rows[live]
+        self.actions_taken[idx, actions[idx]] += 1
+
+        # the opening bid is at least 1
+        opening = self.auction_bidder == -1
+        bid_gold = np.where(opening, np.maximum(bid_gold, 1), bid_gold)
+        outbid = (bid & (bid_gold > self.auction_gold) &
+                  (seat != self.auction_bidder))
+        self.auction_bidder[outbid] = seat[outbid]
+        self.auction_gold[outbid] = bid_gold[outbid]
+        self.auction_won[bid & (bid_gold == 0) &
+                         (seat == self.auction_bidder)] = True
+        self.auction_card[auction & (actions != ACTION_BID_CARD)] = NO_CARD
+
+        gone = live & ((actions == ACTION_DISCARD_CARD) |
+                       (actions == ACTION_USE_CARD))
+        self.actions_taken[gone, ACTION_TAKE_CARD] += 1
+        self._push(self.discarded, self.discarded_count, rows[gone], cards)
+
+        self._turn_complete(live)
+        return cards
+
+    def _push(self, zone, counts, idx, cards):
+        zone[idx, counts[idx]] = cards[idx]
+        counts[idx] += 1
+
+    def _use_change_cards(self, idx, cards, change_colors, change_signs):
+        if change_colors is None or not len(idx):
+            return
+        colors = np.asarray(change_colors, np.intp)[idx]
+        values = CARD_VALUES[cards[idx]]
+        if change_signs is None:
+            signs = np.ones(len(idx), np.int16)
+        else:
+            signs = np.asarray(change_signs, np.int16)[idx]
+        deltas = np.where(values == 0, signs, np.where(values < 0, -1, 1))
+        for column in xrange(colors.shape[1]):
+            use = ((colors[:, column] >= 0) &
+                   (column < np.maximum(np.abs(values), 1)))
+            self.dice[idx[use], colors[use, column]] += deltas[use]
+
+    def _next_seat(self, mask):
+        self.seat[mask] = (self.seat[mask] + 1) % self.player_count
+
+    def _turn_complete(self, live):
+        to_public = live & (self.turns_left == 0) & (self.public_count > 0)
+        self.state[to_public] = PUBLIC
+        self._next_seat(to_public)
+
+        to_auction = live & (self.deck_count == 0) & (self.public_count == 0)
+        self.state[to_auction] = AUCTION
+        # if the player won the card he still needs to use it
+        advance = to_auction & ~self.auction_won
+        self.actions_taken[advance] = 0
+        self._next_seat(advance)
+        # skip the players who cannot outbid the current bidder
+        for _ in xrange(self.player_count - 1):
+            skip = advance & self._must_pass()
+            if not skip.any():
+                break
+            self._next_seat(skip)
+
+        self.state[live & (self.state == AUCTION) & (self.pile_count == 0) &
+                   (self.auction_card == NO_CARD)] = END
+
+        next_turn = live & (self.state == PUBLIC) & (self.public_count == 0)
+        self.state[next_turn] = TURN
+        self.actions_taken[next_turn] = 0
+        self.turns_left[next_turn] = self.player_count + 1
+        self._next_seat(next_turn)
+
+    def _must_pass(self):
+        rows = np.arange(self.size)
+        gold = np.dot(self.hands[rows, self.seat].astype(np.int32),
+                      GOLD_VALUES)
+        return ((self.auction_card != NO_CARD) & (self.auction_bidder != -1) &
+                (self.seat != self.auction_bidder) &
+                # libros.auction.bid_limit() of every game at once
+                (np.maximum(gold, MIN_BID) <= self.auction_gold))
+
+    def scores(self):
+        """Returns the points of every player as a (games, players) array
+        and the colors each player holds the majority of."""
+        rows = np.arange(self.size)
+        hands = self.hands.astype(np.int32)
+        totals = np.dot(hands, TYPE_VALUES)
+        points = np.zeros((self.size, self.player_count), np.int32)
+        won = np.zeros((self.size, self.player_count, len(COLORS)), np.bool_)
+        for color in xrange(len(COLORS)):
+            held = (hands > 0) & (CARD_TYPES == color)
+            lowest = np.where(held, CARD_LETTERS, 99).min(axis=2)
+            # same order as comparing ValueLetter tuples
+            keys = np.where(held.any(axis=2),
+                            totals[..., color] * 16 + lowest, -1)
+            holder = keys.argmax(axis=1)
+            has = keys.max(axis=1) > 0
+            points[rows[has], holder[has]] += self.dice[has, color]
+            won[rows[has], holder[has], color] = True
+        return points, won, totals[..., GOLD]
+
+    def winner(self):
+        """Returns the winning seat of every game, like Game.winner()."""
+        points, won, gold = self.scores()
+        rank = (points.astype(np.int64) + 1024) * 1024 + gold
+        for color in TIEBREAK_COLORS:
+            rank = rank * 2 + won[..., COLORS.index(color)]
+        seats = np.arange(self.player_count)
+        rank = rank * 8 + (self.player_count - 1 - seats)
+        return rank.argmax(axis=1)
@@ -0,0 +1,153 @@
+"""Benchmarks of the game engine hot paths.
+
+    python -m libros.bench --output bench.json --baseline baseline.json
+
+Results are saved as JSON; with a baseline every benchmark that got worse
+by more than ``--tolerance`` is reported and the exit status is 1.
+"""
+import argparse
+import json
+import sys
+import time
+import types
+
+from libros.game import Game, Player, CARDS, Deck, deal
+
+
+def _rate(func, min_time, repeat=3):
+    """Returns the best calls per second of ``func`` over a few rounds."""
+    best = 0.0
+    for _ in xrange(repeat):
+        calls = 0
+        started = time.time()
+        elapsed = 0.0
+        while elapsed < min_time:
+            func()
+            calls += 1
+            elapsed = time.time() - started
+        best = max(best, calls / elapsed)
+    return best
+
+
+def _deep_sizeof(obj, seen):
+    """Returns the bytes held by ``obj`` and everything only it refers to."""
+    if id(obj) in seen or isinstance(obj, (type, types.ModuleType)):
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(_deep_sizeof(key, seen) + _deep_sizeof(value, seen)
+                    for key, value in obj.iteritems())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        # namedtuples build a new __dict__ on access, so stop here
+        size += sum(_deep_sizeof(item, seen) for item in obj)
+    elif hasattr(obj, '__dict__'):
+        size += _deep_sizeof(obj.__dict__, seen)
+    return size
+
+
+def _game(players, seed=0):
+    return Game.new([Player() for _ in xrange(players)], compact=True,
+                    seed=seed)
+
+
+def _play_game(players):
+    def run():
+        run.seed += 1
+        _game(players, run.seed).play()
+    run.seed = 0
+    return run
+
+
+def game_memory(players):
+    """Returns the bytes used by a game in the middle of the turn phase,
+    not counting the cards shared by every game."""
+    game = _game(players)
+    for _ in xrange(game.deck_count // 2):
+        game.play_turn()
+    return _deep_sizeof(game, {id(card) for card in CARDS})
+
+
+def run_benchmarks(min_time=0.2):
+    """Runs every benchmark and returns ``{name: {value, unit, higher}}``."""
+    results = {}
+
+    def record(name, value, unit, higher=True):
+        results[name] = {'value': value, 'unit': unit, 'higher': higher}
+
+    for players in (2, 3, 4):
+        record('deal_%dp' % players,
+               _rate(lambda: deal(players), min_time), 'calls/s')
+        record('deal_compact_%dp' % players,
+               _rate(lambda: deal(players, compact=True), min_time),
+               'calls/s')
+        record('deck_%dp' % players,
+               _rate(lambda: Deck.deal(players, compact=True), min_time),
+               'calls/s')
+        record('game_%dp' % players,
+               _rate(_play_game(players), min_time), 'games/s')
+        record('game_memory_%dp' % players,
+               game_memory(players), 'bytes', higher=False)
+
+    game = _game(3)
+    for _ in xrange(2):
+        game.play_turn()
+    player, card, _ = game.turn()
+    record('valid_actions', _rate(
+        lambda: game.valid_actions(player, card), min_time), 'calls/s')
+
+    game = _game(3)
+    game.play()
+    player = game.players[0]
+    record('score_type', 1e6 / _rate(
+        lambda: player.score_type('blue'), min_time), 'us', higher=False)
+    record('winner', 1e6 / _rate(game.winner, min_time), 'us', higher=False)
+    return results
+
+
+def compare(results, baseline, tolerance=0.1):
+    """Returns ``(name, baseline, result, change)`` for every benchmark that
+    is worse than the baseline by more than ``tolerance``."""
+    regressions = []
+    for name, result in sorted(results.iteritems()):
+        if name not in baseline:
+            continue
+        old, new = baseline[name]['value'], result['value']
+        if not old:
+            continue
+        change = (new - old) / float(old)
+        if (-change if result['higher'] else change) > tolerance:
+            regressions.append((name, old, new, change))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Libros engine benchmarks.')
+    parser.add_argument('-o', '--output', help='file to save results to')
+    parser.add_argument('-b', '--baseline', help='results to compare with')
+    parser.add_argument('-t', '--tolerance', type=float, default=0.1)
+    parser.add_argument('--min-time', type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.min_time)
+    for name, result in sorted(results.iteritems()):
+        print('%-20s %14.1f %s' % (name, result['value'], result['unit']))
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            regressions = compare(results, json.load(baseline),
+                                  args.tolerance)
+        for name, old, new, change in regressions:
+            print('REGRESSION %s: %.1f -> %.1f (%+.0f%%)' % (
+                name, old, new, change * 100))
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
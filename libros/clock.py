@@ -0,0 +1,164 @@
+"""Turn deadlines for every hosted table on one hierarchical timer wheel.
+
+A TimerWheel keeps timers in buckets by the tick they are due: the first
+level has a bucket per tick for the next ``slots`` ticks, each further
+level a bucket per ``slots`` ticks of the level below. When a level comes
+round its next bucket is poured into the level below, so every timer is
+moved at most ``levels`` times and scheduling or cancelling one is a set
+operation however many there are.
+
+A TurnClock gives the active seat of every table ``timeout`` seconds to
+move (``bid_timeout`` on auction bids). Tables restart their deadline
+after every move; one that runs out makes the table play a default move
+for the seat, see Table.timeout().
+
+    clock = TurnClock(timeout=30)
+    server = GameServer(clock=clock)
+    clock.start()
+"""
+import time
+
+import gevent
+
+
+class Timer(object):
+    __slots__ = ('tick', 'callback', 'args', 'bucket')
+
+    def __init__(self, tick, callback, args):
+        self.tick = tick
+        self.callback = callback
+        self.args = args
+        self.bucket = None
+
+
+class TimerWheel(object):
+    """Timers rounded up to ``tick`` seconds, on ``levels`` wheels of
+    ``slots`` buckets.
+
+    Timers further away than the wheels reach wait in the last bucket of
+    the top level. Timers due in the same tick fire in no given order.
+    """
+
+    def __init__(self, tick=0.1, slots=256, levels=3, now=None):
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        self.wheels = [[set() for _ in xrange(slots)]
+                       for _ in xrange(levels)]
+        self.current = int((time.time() if now is None else now) / tick)
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def schedule(self, deadline, callback, *args):
+        """Calls ``callback(*args)`` once the wheel is advanced past
+        ``deadline``. Returns the Timer to cancel it."""
+        tick = -int(-deadline // self.tick)
+        timer = Timer(max(tick, self.current + 1), callback, args)
+        self._insert(timer)
+        self.count += 1
+        return timer
+
+    def cancel(self, timer):
+        """Cancels ``timer`` unless it fired already."""
+        if timer.bucket is not None:
+            timer.bucket.discard(timer)
+            timer.bucket = None
+            self.count -= 1
+
+    def _insert(self, timer):
+        ticks = timer.tick - self.current
+        span = 1
+        for level, wheel in enumerate(self.wheels):
+            if ticks < span * self.slots or level == self.levels - 1:
+                break
+            span *= self.slots
+        tick = min(timer.tick, self.current + span * self.slots - 1)
+        timer.bucket = wheel[tick // span % self.slots]
+        timer.bucket.add(timer)
+
+    def advance(self, now=None):
+        """Fires the timers due up to ``now``, returns how many fired."""
+        target = int((time.time() if now is None else now) / self.tick)
+        fired = 0
+        while self.current < target:
+            if not self.count:
+                self.current = target
+                break
+            self.current += 1
+            # pour the buckets coming round into the levels below
+            tick, level = self.current, 1
+            while level < self.levels and tick % self.slots == 0:
+                tick //= self.slots
+                bucket = self.wheels[level][tick % self.slots]
+                self.wheels[level][tick % self.slots] = set()
+                for timer in bucket:
+                    self._insert(timer)
+                level += 1
+
+            wheel = self.wheels[0]
+            bucket = wheel[self.current % self.slots]
+            wheel[self.current % self.slots] = set()
+            for timer in bucket:
+                if timer.tick > self.current:
+                    # beyond the reach of a single level wheel, wait on
+                    self._insert(timer)
+                    continue
+                timer.bucket = None
+                self.count -= 1
+                fired += 1
+                timer.callback(*timer.args)
+        return fired
+
+
+class TurnClock(object):
+    """Deadlines of the active seats of the tables, see the module."""
+
+    def __init__(self, timeout=30.0, bid_timeout=None, tick=0.1, slots=256,
+                 levels=3, clock=time.time):
+        self.timeout = timeout
+        self.bid_timeout = timeout if bid_timeout is None else bid_timeout
+        self.clock = clock
+        self.wheel = TimerWheel(tick, slots, levels, clock())
+        self.timers = {}
+        self.expired = 0
+        self.greenlet = None
+
+    def restart(self, table):
+        """Gives the active seat of ``table`` a new deadline."""
+        self.cancel(table.id)
+        game = table.game
+        if game.state == 'end':
+            return
+        timeout = self.bid_timeout if game.state == 'auction' else \
+            self.timeout
+        self.timers[table.id] = self.wheel.schedule(
+            self.clock() + timeout, self._expire, table, table.version)
+
+    def cancel(self, table_id):
+        timer = self.timers.pop(table_id, None)
+        if timer is not None:
+            self.wheel.cancel(timer)
+
+    def _expire(self, table, version):
+        self.timers.pop(table.id, None)
+        self.expired += 1
+        table.timeout(version)
+
+    def advance(self, now=None):
+        return self.wheel.advance(self.clock() if now is None else now)
+
+    def start(self):
+        """Advances the clock every tick in a greenlet."""
+        def run():
+            while True:
+                gevent.sleep(self.wheel.tick)
+                self.advance()
+
+        self.greenlet = gevent.spawn(run)
+
+    def stop(self):
+        if self.greenlet is not None:
+            self.greenlet.kill()
+            self.greenlet = None
@@ -0,0 +1,195 @@
+"""Per-seat state deltas for the clients of a running game.
+
+Once it has observers a Game passes them an event for every change:
+
+    ('card', card, source, target, seat)   a card moved between ZONES
+    ('dice', color, value)                 a die changed
+    ('bid', seat, gold)                    a new highest bid
+    ('turn', state, seat, turns_left)      the phase or turn counter changed
+
+DeltaStream collects the events, hides the cards a seat may not see and
+encodes what is left as short lists of ints. GameView rebuilds the view of
+one seat from a full state followed by the deltas, in order.
+"""
+from copy import deepcopy
+
+from libros.game import Card, CARDS, CARDS_BY_KEY, COLORS, STATES
+
+
+ZONES = ('deck', 'drawn', 'pile', 'public', 'auction', 'hand', 'discarded')
+PUBLIC_ZONES = frozenset(['public', 'auction', 'discarded'])
+EVENTS = ('card', 'dice', 'bid', 'turn')
+
+NO_CARD = -1
+
+
+def card_index(card):
+    if card is None:
+        return NO_CARD
+    # equal cards can't be told apart, so they all go by the first one
+    return CARDS_BY_KEY[Card.from_dict(card).key].index
+
+
+def view_event(event, seat):
+    """Returns ``event`` as ``seat`` sees it.
+
+    Cards moving only between hidden zones are blanked out unless they
+    belong to ``seat``.
+    """
+    if event[0] != 'card':
+        return event
+    kind, card, source, target, owner = event
+    if owner == seat or source in PUBLIC_ZONES or target in PUBLIC_ZONES:
+        return event
+    return kind, None, source, target, owner
+
+
+def encode(event):
+    kind = event[0]
+    if kind == 'card':
+        _, card, source, target, seat = event
+        return [0, card_index(card), ZONES.index(source),
+                ZONES.index(target), -1 if seat is None else seat]
+    if kind == 'dice':
+        return [1, COLORS.index(event[1]), event[2]]
+    if kind == 'bid':
+        return [2, event[1], event[2]]
+    return [3, STATES.index(event[1]), event[2], event[3]]
+
+
+def decode(data):
+    kind = EVENTS[data[0]]
+    if kind == 'card':
+        _, index, source, target, seat = data
+        return (kind, None if index == NO_CARD else CARDS[index],
+                ZONES[source], ZONES[target], None if seat < 0 else seat)
+    if kind == 'dice':
+        return kind, COLORS[data[1]], data[2]
+    if kind == 'bid':
+        return kind, data[1], data[2]
+    return kind, STATES[data[1]], data[2], data[3]
+
+
+def full_view(game, seat, drawn=None):
+    """Returns everything ``seat`` may know about ``game``.
+
+    ``drawn`` is the ``(card, seat)`` taken from the deck and not played yet.
+    """
+    drawn_card, owner = drawn or (None, None)
+    bidder = game.auction_bidder
+    return {
+        'state': game.state,
+        'active': game.seat,
+        'turns_left': game.turns_left,
+        'deck': game.deck_count,
+        'pile': game.pile_count,
+        'public': [card_index(card) for card in game.public],
+        'discarded': [card_index(card) for card in game.discarded],
+        'auction': card_index(game.auction_card),
+        'bidder': -1 if bidder is None else game.players.index(bidder),
+        'gold': game.auction_gold,
+        'dice': dict(game.dice),
+        'hands': [len(player.cards) for player in game.players],
+        'hand': [card_index(card) for card in game.players[seat].cards],
+        'drawn': card_index(drawn_card) if owner == seat else NO_CARD,
+    }
+
+
+class DeltaStream(object):
+    """Observes a game and turns its events into a message per seat.
+
+    Every ``resync_interval`` flushes the seats get their full view instead
+    of a delta, so a client that lost a message recovers.
+    """
+
+    def __init__(self, game, resync_interval=100):
+        self.game = game
+        self.resync_interval = resync_interval
+        self.version = 0
+        self.events = []
+        self.drawn = None
+        game.observers.append(self.observe)
+
+    def observe(self, event):
+        if event[0] == 'card' and event[3] == 'drawn':
+            self.drawn = event[1], event[4]
+        elif event[0] == 'card' and event[2] == 'drawn':
+            self.drawn = None
+        self.events.append(event)
+
+    def close(self):
+        self.game.observers.remove(self.observe)
+
+    def full_state(self, seat):
+        return {'type': 'state', 'version': self.version,
+                'view': full_view(self.game, seat, self.drawn)}
+
+    def flush(self):
+        """Returns ``{seat: message}`` for the events since the last flush."""
+        if not self.events:
+            return {}
+        self.version += 1
+        events, self.events = self.events, []
+        seats = xrange(self.game.player_count)
+        if self.resync_interval and self.version % self.resync_interval == 0:
+            return {seat: self.full_state(seat) for seat in seats}
+        return {seat: {'type': 'delta', 'version': self.version,
+                       'events': [encode(view_event(event, seat))
+                                  for event in events]}
+                for seat in seats}
+
+
+class GameView(object):
+    """The view of one seat, kept up to date from DeltaStream messages."""
+
+    def __init__(self, seat):
+        self.seat = seat
+        self.version = None
+        self.view = None
+
+    def apply(self, message):
+        if message['type'] == 'state':
+            self.version = message['version']
+            self.view = deepcopy(message['view'])
+            return
+        if self.version is None or message['version'] != self.version + 1:
+            raise ValueError('Missed a delta, a full state is needed.')
+        self.version = message['version']
+        for data in message['events']:
+            self.apply_event(decode(data))
+
+    def apply_event(self, event):
+        view = self.view
+        kind = event[0]
+        if kind == 'dice':
+            view['dice'][event[1]] = event[2]
+        elif kind == 'bid':
+            view['bidder'], view['gold'] = event[1], event[2]
+        elif kind == 'turn':
+            view['state'], view['active'], view['turns_left'] = event[1:]
+        else:
+            _, card, source, target, owner = event
+            index = card_index(card)
+            if source in ('deck', 'pile'):
+                view[source] -= 1
+            elif source == 'public':
+                view['public'].remove(index)
+            elif source in ('drawn', 'auction'):
+                view[source] = NO_CARD
+            else:
+                raise ValueError('Incorrect state.')
+
+            if target == 'pile':
+                view['pile'] += 1
+            elif target in ('public', 'discarded'):
+                view[target].append(index)
+            elif target == 'drawn':
+                view['drawn'] = index
+            elif target == 'auction':
+                view['auction'], view['bidder'], view['gold'] = index, -1, 0
+            elif target == 'hand':
+                view['hands'][owner] += 1
+                if owner == self.seat:
+                    view['hand'].append(index)
+            else:
+                raise ValueError('Incorrect state.')
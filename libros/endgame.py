@@ -0,0 +1,304 @@
+"""Exact solver of the auction that ends the game.
+
+Once the deck and the public cards are gone only the pile is left, so
+what happens next depends on the pile, the gold and color totals of each
+hand, the dice and the auction under way, nothing else. The solver
+searches that game to the end, every player trying to be the winner
+(max^n), and remembers the result of every position in a bounded
+TranspositionTable keyed by that canonical state.
+
+A few shortcuts keep the tree small without changing the result. Gold
+is not spent, so a bid only matters by which players it shuts out: the
+candidate bids are going all in and the highest bid short of each other
+player's gold. Taking a change card scores the same as discarding it. A
+player stops looking as soon as a move lets them win, and one who cannot
+win plays the first move (all in and taking the card come first), which
+bounds on the points still in play often tell without searching.
+
+The pile is searched in the order it is in. The players don't know that
+order, so EndgamePlayer solves a few determinizations of the unseen cards
+(see libros.mcts) and plays the move that wins the most of them. The
+search grows with the pile, about fourfold per card with four players,
+which is why it waits for the last ``max_cards``.
+"""
+from collections import Counter, namedtuple
+
+from libros.auction import bid_limit
+from libros.game import (
+    Card, Player, CARDS, CARDS_BY_KEY, COLORS,
+    ACTION_TAKE_CARD, ACTION_DISCARD_CARD, ACTION_USE_CARD, ACTION_BID_CARD,
+)
+from libros.mcts import change_colors_options, determinize
+from libros.scoring import NO_SCORE, ValueLetter, hands_winner
+from libros.zobrist import TranspositionTable
+
+
+# the totals that score, one ValueLetter each in every solver hand
+KINDS = COLORS + ('gold',)
+GOLD = KINDS.index('gold')
+
+Solution = namedtuple('Solution', ['winner', 'action', 'bid_gold',
+                                   'change_colors'])
+
+# what a card adds to a hand, by CARDS index
+_KIND = tuple(KINDS.index(card.type) if card.type in KINDS else None
+              for card in CARDS)
+_CANONICAL = tuple(CARDS_BY_KEY[card.key].index for card in CARDS)
+
+
+def _index(card):
+    return _CANONICAL[Card.from_dict(card).index]
+
+
+def _hand(scores):
+    return tuple(scores.get(kind, NO_SCORE) for kind in KINDS)
+
+
+def _take(hand, index):
+    kind = _KIND[index]
+    if kind is None:
+        return hand
+    card = CARDS[index]
+    score = hand[kind]
+    if score == NO_SCORE:
+        score = ValueLetter(card.value, card.letter)
+    else:
+        score = ValueLetter(score.value + card.value,
+                            min(score.letter, card.letter))
+    return hand[:kind] + (score,) + hand[kind + 1:]
+
+
+def _use(dice, value, colors):
+    # like Game.use_change_card()
+    if value == 0:
+        value = 1 if colors[0][0] == '+' else -1
+        colors = [colors[0][1:]]
+    dice = list(dice)
+    for color in colors:
+        dice[COLORS.index(color)] += 1 if value > 0 else -1
+    return tuple(dice)
+
+
+def _max_bid(hand):
+    return bid_limit(hand[GOLD].value)
+
+
+def _winner(hands, dice):
+    return hands_winner(
+        [{kind: score for kind, score in zip(KINDS, hand)
+          if score != NO_SCORE} for hand in hands],
+        dict(zip(COLORS, dice)))
+
+
+class EndgameSolver(object):
+    """Solves games in the auction phase, sharing one bounded cache.
+
+    The cache outlives solve() so solving the same game again a move
+    later mostly hits it.
+    """
+
+    def __init__(self, cache_size=1 << 18):
+        self.table = TranspositionTable(cache_size)
+        self.nodes = 0
+
+    def solve(self, game):
+        """Returns the Solution of ``game`` before the active player's
+        turn(): the winner with best play and the move to get there."""
+        if game.state != 'auction':
+            raise ValueError('Incorrect state.')
+        pile = tuple(_index(card) for card in game.pile)
+        bidder, gold = -1, 0
+        if game.auction_card is not None:
+            # the card up for auction is the pile's top in the search
+            pile += (_index(game.auction_card),)
+            if game.auction_bidder is not None:
+                bidder = game.players.index(game.auction_bidder)
+                gold = game.auction_gold
+        if not pile:
+            return Solution(game.players.index(game.winner()), None, None,
+                            None)
+        hands = tuple(_hand(player.scores) for player in game.players)
+        dice = tuple(game.dice[color] for color in COLORS)
+
+        # color values and change cards left in each part of the pile
+        self._left = [(0,) * len(COLORS) + (0,)]
+        for index in pile:
+            card = CARDS[index]
+            left = list(self._left[-1])
+            if card.type in COLORS:
+                left[COLORS.index(card.type)] += card.value
+            elif card.type == 'change':
+                left[-1] += 1
+            self._left.append(tuple(left))
+
+        winner, move = self._search(pile, hands, dice, game.seat, bidder,
+                                    gold)
+        action, value = move
+        if action == ACTION_BID_CARD:
+            return Solution(winner, action, value, None)
+        if action == ACTION_USE_CARD:
+            return Solution(winner, action, None, list(value))
+        return Solution(winner, action, None, None)
+
+    def _search(self, pile, hands, dice, seat, bidder, gold):
+        key = pile, hands, dice, seat, bidder, gold
+        result = self.table.get(key)
+        if result is not None:
+            return result
+        self.nodes += 1
+
+        low, high = self._bounds(pile, hands, dice)
+        moves = self._moves(pile, hands, dice, seat, bidder, gold)
+        result = None
+        for other, points in enumerate(low):
+            if all(points > most for most in high[:other] + high[other + 1:]):
+                # nothing left can change the winner
+                result = other, next(moves)[0]
+        # a player who can't win plays the first move, see the module
+        hopeless = high[seat] < max(low[:seat] + low[seat + 1:])
+        for move, child in moves if result is None else ():
+            if len(child) == 1:
+                winner = child[0]
+            else:
+                winner = self._search(*child)[0]
+            if result is None:
+                result = winner, move
+            if winner == seat or hopeless:
+                result = winner, move
+                break
+        self.table.store(key, result, len(pile))
+        return result
+
+    def _bounds(self, pile, hands, dice):
+        """Returns the fewest points each player is sure to end with and
+        the most they could still get."""
+        left = self._left[len(pile)]
+        changes = left[-1]
+        players = len(hands)
+        low = [0] * players
+        high = [0] * players
+        for color in xrange(len(COLORS)):
+            totals = [hand[color].value for hand in hands]
+            lowest, highest = dice[color] - changes, dice[color] + changes
+            for seat, total in enumerate(totals):
+                others = totals[:seat] + totals[seat + 1:]
+                if total > 0 and total > max(others) + left[color]:
+                    low[seat] += lowest
+                    high[seat] += highest
+                elif total + left[color] > 0 and \
+                        total + left[color] >= max(others):
+                    low[seat] += min(lowest, 0)
+                    high[seat] += max(highest, 0)
+        return low, high
+
+    def _moves(self, pile, hands, dice, seat, bidder, gold):
+        """Yields ``(move, child)``, the child being a state to search or
+        just the winner's seat."""
+        players = len(hands)
+        if seat == bidder:
+            index = pile[-1]
+            card = CARDS[index]
+            rest = pile[:-1]
+
+            def child(hands, dice):
+                if not rest:
+                    return (_winner(hands, dice),)
+                return rest, hands, dice, (seat + 1) % players, -1, 0
+
+            if card.type != 'change':
+                hands = hands[:seat] + (_take(hands[seat], index),) + \
+                    hands[seat + 1:]
+                yield (ACTION_TAKE_CARD, None), child(hands, dice)
+                return
+            yield (ACTION_DISCARD_CARD, None), child(hands, dice)
+            for colors in change_colors_options(card.value):
+                yield ((ACTION_USE_CARD, colors),
+                       child(hands, _use(dice, card.value, colors)))
+            return
+
+        limits = [_max_bid(hand) for hand in hands]
+        limit = limits[seat]
+        # the highest bid shutting out each set of players
+        bids = {limit}
+        bids.update(other - 1 for other in limits
+                    if gold < other - 1 < limit)
+        for bid in sorted(bids, reverse=True):
+            yield ((ACTION_BID_CARD, bid),
+                   self._after_bid(pile, hands, dice, seat, seat, bid,
+                                   limits))
+        if bidder >= 0:
+            yield ((ACTION_BID_CARD, 0),
+                   self._after_bid(pile, hands, dice, seat, bidder, gold,
+                                   limits))
+
+    def _after_bid(self, pile, hands, dice, seat, bidder, gold, limits):
+        # the next player who can outbid, or back to the bidder
+        players = len(hands)
+        seat = (seat + 1) % players
+        while seat != bidder and limits[seat] <= gold:
+            seat = (seat + 1) % players
+        return pile, hands, dice, seat, bidder, gold
+
+    def sample(self, game, rng, samples=8):
+        """Solves ``samples`` determinizations of ``game`` and returns the
+        Solution winning the most of them for the active player, with the
+        number it won."""
+        votes = Counter()
+        solutions = {}
+        for _ in xrange(samples):
+            solution = self.solve(determinize(game, rng))
+            move = solution[1:3] + (solution.change_colors and
+                                    tuple(solution.change_colors),)
+            solutions.setdefault(move, solution)
+            votes[move] += solution.winner == game.seat
+        move = max(solutions, key=lambda move: (votes[move], move))
+        return solutions[move], votes[move]
+
+    def play(self, game):
+        """Plays the rest of ``game`` with every player following the
+        solution and returns the winner."""
+        while game.state != 'end':
+            solution = self.solve(game)
+            player, card, _ = game.turn()
+            player.act(card, solution.action,
+                       change_colors=solution.change_colors,
+                       bid_gold=solution.bid_gold)
+        return game.winner()
+
+
+class EndgamePlayer(Player):
+    """Player solving the auction once at most ``max_cards`` are left.
+
+    Each decision solves ``samples`` guesses of the pile order, see
+    EndgameSolver.sample(). Before that it plays like a Player.
+    """
+
+    def __init__(self, solver=None, samples=8, max_cards=8):
+        super(EndgamePlayer, self).__init__()
+        self.solver = solver or EndgameSolver()
+        self.samples = samples
+        self.max_cards = max_cards
+        self.solution = None
+        self.rng = None
+
+    def choose_action(self, card, actions):
+        game = self.game
+        self.solution = None
+        if game.state == 'auction' and len(game.pile) < self.max_cards:
+            if self.rng is None:
+                self.rng = game.spawn_random('endgame', self.id)
+            self.solution = self.solver.sample(game, self.rng,
+                                               self.samples)[0]
+            if self.solution.action in actions:
+                return self.solution.action
+        return super(EndgamePlayer, self).choose_action(card, actions)
+
+    def choose_bid(self, card, max_gold):
+        if self.solution is None or self.solution.bid_gold is None:
+            return super(EndgamePlayer, self).choose_bid(card, max_gold)
+        return min(self.solution.bid_gold, max_gold)
+
+    def choose_change_colors(self, card):
+        if self.solution is None or self.solution.change_colors is None:
+            return super(EndgamePlayer, self).choose_change_colors(card)
+        return list(self.solution.change_colors)
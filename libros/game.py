@@ -1,9 +1,22 @@
+import hashlib
 import random
 import string
+import struct
 
-from itertools import cycle, repeat
+from array import array
+from itertools import izip, repeat
 from collections import Counter, defaultdict, namedtuple
 
+from libros.auction import max_bid, must_pass, place_bid
+from libros.scoring import (
+    COLORS, TIEBREAK_COLORS, NO_SCORE, ValueLetter, Standing,
+    evaluate, winner_seat,
+)
+from libros.zobrist import (
+    DICE_ZOBRIST, HAND_SLOT, HASH_MASK, ZONE_SLOTS,
+    dice_hash, turn_key, zone_keys,
+)
+
 
 ACTION_TAKE_CARD = 0
 ACTION_PILE_CARD = 1
@@ -18,10 +31,233 @@ ACTIONS = [
     ACTION_USE_CARD, ACTION_BID_CARD,
 ]
 
-COLORS = ('blue', 'brown', 'red', 'orange', 'green')
+# zone a card moves to with each action, bidding leaves it where it is
+ACTION_ZONES = {
+    ACTION_TAKE_CARD: 'hand',
+    ACTION_PILE_CARD: 'pile',
+    ACTION_SHOW_CARD: 'public',
+    ACTION_DISCARD_CARD: 'discarded',
+    ACTION_USE_CARD: 'discarded',
+}
+
+# Game.action_key() flags of what can still be done with a card in the
+# turn phase, plus two keys for the other phases
+TAKE_KEY, PILE_KEY, SHOW_KEY, CHANGE_KEY = 1, 2, 4, 8
+BID_KEY, PUBLIC_CHANGE_KEY = 16, 17
+
+
+def _key_actions(key):
+    actions = []
+    if key & TAKE_KEY:
+        actions.append(ACTION_TAKE_CARD)
+    if key & PILE_KEY:
+        actions.append(ACTION_PILE_CARD)
+    if key & SHOW_KEY:
+        actions.append(ACTION_SHOW_CARD)
+    if key & CHANGE_KEY and key & TAKE_KEY:
+        actions.append(ACTION_DISCARD_CARD)
+        actions.append(ACTION_USE_CARD)
+    return tuple(actions)
+
+
+VALID_ACTIONS = tuple(_key_actions(key) for key in xrange(BID_KEY)) + (
+    (ACTION_BID_CARD,),
+    (ACTION_DISCARD_CARD, ACTION_USE_CARD),
+)
+
+VALID_ACTION_MASKS = tuple(sum(1 << action for action in actions)
+                           for actions in VALID_ACTIONS)
+
+Move = namedtuple('Move', ['seat', 'card', 'action', 'change_colors',
+                           'bid_gold'])
+
+Snapshot = namedtuple('Snapshot', [
+    'moves', 'state', 'seat', 'turns_left', 'deck', 'pile', 'public',
+    'discarded', 'dice', 'actions_taken', 'auction', 'hands', 'random'])
+
+STATES = ('waiting', 'start', 'next_player', 'turn', 'public', 'auction',
+          'end')
+
+# Game.to_bytes() record: this header, the hand sizes, the card indices of
+# the deck, pile, public, discarded and hands, then the optional RNG state
+BYTES_VERSION = 1
+BYTES_HEADER = struct.Struct('<2sBHBQBBbBBbH5b6B4B')
+BYTES_RANDOM = struct.Struct('<625Id')
+NO_CARD_BYTE = 0xff
+COMPACT_FLAG, WON_FLAG, RANDOM_FLAG = 1, 2, 4
+
+
+CARD_KEYS = ('type', 'value', 'letter')
+
+# every card type, the colors first
+TYPES = COLORS + ('gold', 'change')
+
+GOLD_COUNT = 11
+
+CARD_COUNTS = (
+    ('blue',    2, 4),
+    ('blue',    3, 3),
+    ('blue',    4, 2),
+    ('brown',   2, 4),
+    ('brown',   3, 3),
+    ('brown',   4, 2),
+    ('red',     1, 7),
+    ('red',     2, 2),
+    ('orange',  1, 7),
+    ('orange',  2, 2),
+    ('green',   1, 7),
+    ('green',   2, 2),
+    ('change', -2, 2),
+    ('change', -1, 2),
+    ('change',  2, 2),
+    ('change',  1, 2),
+    ('change',  0, 1),  # plus or minus
+    ('gold',    1, GOLD_COUNT),
+    ('gold',    2, GOLD_COUNT),
+    ('gold',    3, GOLD_COUNT))
+
+
+class Card(object):
+    """Immutable card shared by every game, addressed by its index in CARDS.
+
+    Cards can be read like the dicts returned by ``deal()`` (``card['type']``)
+    so code written against the dict API keeps working on compact decks.
+    """
+    __slots__ = ('index', 'type', 'value', 'letter')
+
+    def __init__(self, index, kind, value, letter):
+        object.__setattr__(self, 'index', index)
+        object.__setattr__(self, 'type', kind)
+        object.__setattr__(self, 'value', value)
+        object.__setattr__(self, 'letter', letter)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Cards are immutable.')
+
+    def __delattr__(self, name):
+        raise AttributeError('Cards are immutable.')
+
+    def __reduce__(self):
+        # unpickle to the shared instance instead of a copy
+        return _card, (self.index,)
+
+    def __repr__(self):
+        return 'Card(%r, %d, %r)' % (self.type, self.value, self.letter)
+
+    def __eq__(self, other):
+        if not isinstance(other, Card):
+            return NotImplemented
+        return self.key == other.key
+
+    def __ne__(self, other):
+        if not isinstance(other, Card):
+            return NotImplemented
+        return self.key != other.key
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __getitem__(self, key):
+        if key not in CARD_KEYS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __contains__(self, key):
+        return key in CARD_KEYS
+
+    def get(self, key, default=None):
+        if key not in CARD_KEYS:
+            return default
+        return getattr(self, key)
+
+    def keys(self):
+        return list(CARD_KEYS)
+
+    @property
+    def key(self):
+        return self.type, self.value, self.letter
+
+    def to_dict(self):
+        return {'type': self.type, 'value': self.value, 'letter': self.letter}
+
+    @staticmethod
+    def from_dict(card):
+        """Returns the shared card matching a dict card."""
+        if isinstance(card, Card):
+            return card
+        return CARDS_BY_KEY[card['type'], card['value'], card['letter']]
+
+
+def _card(index):
+    return CARDS[index]
+
+
+def _card_table():
+    letters = defaultdict(lambda: repeat(None), {
+        color: iter(string.ascii_uppercase) for color in COLORS
+    })
+    specs = [(kind, value, next(letters[kind]))
+             for kind, value, count in CARD_COUNTS for _ in xrange(count)]
+    return tuple(Card(index, kind, value, letter)
+                 for index, (kind, value, letter) in enumerate(specs))
+
+
+CARDS = _card_table()
+
+CARDS_BY_KEY = {}
+for _c in CARDS:
+    CARDS_BY_KEY.setdefault(_c.key, _c)
+del _c
+
+# zobrist keys of each card by zone slot, the same for equal cards
+_ZONE_KEYS = zone_keys(len(CARDS))
+CARD_ZOBRIST = tuple(_ZONE_KEYS[CARDS_BY_KEY[card.key].index]
+                     for card in CARDS)
+del _ZONE_KEYS
+
+_FULL_DECKS = {}
+_FULL_DECK_INDICES = {}
+
+
+def full_deck(gold_to_remove=0):
+    """Returns the cards of a complete deck in a fixed order."""
+    try:
+        return _FULL_DECKS[gold_to_remove]
+    except KeyError:
+        pass
+    copies = Counter()
+    cards = []
+    for card in CARDS:
+        copies[card.type, card.value] += 1
+        if (card.type == 'gold' and
+                copies[card.type, card.value] > GOLD_COUNT - gold_to_remove):
+            continue
+        cards.append(card)
+    _FULL_DECKS[gold_to_remove] = tuple(cards)
+    return _FULL_DECKS[gold_to_remove]
+
+
+def split_seed(seed, *keys):
+    """Derives an independent child seed, e.g. one per simulated game."""
+    digest = hashlib.sha1(':'.join(str(key) for key in (seed,) + keys))
+    return struct.unpack('<Q', digest.digest()[:8])[0]
 
 
-def deal(players, cards_to_remove=None, gold_to_remove=None):
+def batch_valid_actions(games, cards):
+    """Returns the valid actions of every game's active player."""
+    return [VALID_ACTIONS[game.action_key(game.player, card)]
+            for game, card in izip(games, cards)]
+
+
+def batch_action_masks(games, cards):
+    """Returns the valid action bitmasks of many games as a bytearray."""
+    return bytearray(VALID_ACTION_MASKS[game.action_key(game.player, card)]
+                     for game, card in izip(games, cards))
+
+
+def removals(players, cards_to_remove=None, gold_to_remove=None):
+    """Returns how many cards and gold cards a deal for ``players`` takes
+    out, the defaults for those given as None."""
     assert players in [2, 3, 4]
 
     if cards_to_remove is None:
@@ -30,44 +266,156 @@ def deal(players, cards_to_remove=None, gold_to_remove=None):
     if gold_to_remove is None:
         gold_to_remove = 4 - players
 
-    cards = (
-        ('blue',    2, 4),
-        ('blue',    3, 3),
-        ('blue',    4, 2),
-        ('brown',   2, 4),
-        ('brown',   3, 3),
-        ('brown',   4, 2),
-        ('red',     1, 7),
-        ('red',     2, 2),
-        ('orange',  1, 7),
-        ('orange',  2, 2),
-        ('green',   1, 7),
-        ('green',   2, 2),
-        ('change', -2, 2),
-        ('change', -1, 2),
-        ('change',  2, 2),
-        ('change',  1, 2),
-        ('change',  0, 1),  # plus or minus
-        ('gold',    1, 11 - gold_to_remove),
-        ('gold',    2, 11 - gold_to_remove),
-        ('gold',    3, 11 - gold_to_remove))
-    letters = defaultdict(lambda: repeat(None), {
-        color: iter(string.ascii_uppercase) for color in COLORS
-    })
-    deck = [{
-        'type': kind,
-        'value': value,
-        'letter': next(letters[kind]),
-    } for kind, value, count in cards for _ in xrange(count)]
-    random.shuffle(deck)
+    return cards_to_remove, gold_to_remove
+
+
+def deal(players, cards_to_remove=None, gold_to_remove=None, compact=False,
+         rng=random):
+    cards_to_remove, gold_to_remove = removals(
+        players, cards_to_remove, gold_to_remove)
+
+    if compact:
+        deck = list(full_deck(gold_to_remove))
+    else:
+        deck = [card.to_dict() for card in full_deck(gold_to_remove)]
+    rng.shuffle(deck)
 
     return deck[cards_to_remove:]
 
 
+class Deck(object):
+    """The cards left to draw, shuffled only as they are drawn.
+
+    Cards are kept as CARDS indices. The top of the deck whose order is
+    already settled is a stack (``settled``, next card last) above a
+    ``pool`` in no particular order. pop() takes the top card, or picks a
+    random pool card with one Fisher-Yates step; only ``pool_draws`` pool
+    cards are ever drawn, the rest are the cards removed unseen. Reading
+    the whole deck settles every draw with the same steps, so the order
+    does not depend on when that happens.
+    """
+
+    def __init__(self, pool=(), settled=(), pool_draws=None, compact=False,
+                 rng=None):
+        self.pool = array('B', pool)
+        self.settled = array('B', settled)
+        self.pool_draws = len(self.pool) if pool_draws is None else pool_draws
+        self.compact = compact
+        self.random = rng
+
+    @classmethod
+    def deal(cls, players, cards_to_remove=None, gold_to_remove=None,
+             compact=False, rng=random):
+        """Returns a Deck drawing like a list from deal()."""
+        cards_to_remove, gold_to_remove = removals(
+            players, cards_to_remove, gold_to_remove)
+        pool = _FULL_DECK_INDICES.get(gold_to_remove)
+        if pool is None:
+            pool = _FULL_DECK_INDICES[gold_to_remove] = array(
+                'B', (card.index for card in full_deck(gold_to_remove)))
+        return cls(pool, pool_draws=len(pool) - cards_to_remove,
+                   compact=compact, rng=rng)
+
+    @classmethod
+    def from_cards(cls, cards, compact=False):
+        """Returns a Deck drawing ``cards`` from the last one."""
+        return cls(settled=(Card.from_dict(card).index for card in cards),
+                   compact=compact)
+
+    def __len__(self):
+        return len(self.settled) + self.pool_draws
+
+    def __iter__(self):
+        self.settle()
+        return (self._card(index) for index in self.settled)
+
+    def __getitem__(self, key):
+        if key == -1 and len(self):
+            self._settle_top()
+            return self._card(self.settled[-1])
+        return list(self)[key]
+
+    def __repr__(self):
+        return 'Deck(%d cards)' % len(self)
+
+    def _card(self, index):
+        return CARDS[index] if self.compact else CARDS[index].to_dict()
+
+    def _draw_pool(self):
+        pool = self.pool
+        # like random.shuffle(), which this replaces
+        i = int(self.random.random() * len(pool))
+        pool[i], pool[-1] = pool[-1], pool[i]
+        self.pool_draws -= 1
+        return pool.pop()
+
+    def _settle_top(self):
+        if not self.settled:
+            self.settled.append(self._draw_pool())
+
+    def pop(self):
+        if self.settled:
+            index = self.settled.pop()
+        elif self.pool_draws:
+            index = self._draw_pool()
+        else:
+            raise IndexError('pop from empty deck')
+        return CARDS[index] if self.compact else CARDS[index].to_dict()
+
+    def append(self, card):
+        """Puts ``card`` back on top."""
+        self.settled.append(Card.from_dict(card).index)
+
+    def settle(self):
+        """Decides the order of every card still to be drawn."""
+        if self.pool_draws:
+            drawn = array('B', (self._draw_pool()
+                                for _ in xrange(self.pool_draws)))
+            drawn.reverse()
+            self.settled = drawn + self.settled
+
+    def copy(self):
+        # settling first leaves no RNG to copy
+        self.settle()
+        return Deck(self.pool, self.settled, 0, self.compact)
+
+    def redeterminize(self, rng, pile=(), known_top=False):
+        """Returns the deck to random order for another guess of it.
+
+        Every card not drawn yet is unseen, including the removed ones and
+        those on ``pile``; a pile of the same size is drawn back from them
+        and returned. With ``known_top`` the top card stays where it is.
+        """
+        top = None
+        if known_top:
+            self._settle_top()
+            top = self.settled.pop()
+        self.random = rng
+        self.pool.extend(self.settled)
+        self.pool_draws += len(self.settled)
+        self.settled = array('B')
+        for card in pile:
+            self.pool.append(Card.from_dict(card).index)
+        pool_draws = self.pool_draws
+        pile = [self._card(self._draw_pool()) for _ in pile]
+        self.pool_draws = pool_draws
+        if top is not None:
+            self.settled.append(top)
+        return pile
+
+
 class Game(object):
-    def __init__(self):
+    def __init__(self, compact=False, seed=None, snapshot_interval=0):
+        if seed is None:
+            seed = random.getrandbits(64)
+        elif not isinstance(seed, (int, long)) or not 0 <= seed < 1 << 64:
+            # the records store the seed as an unsigned 64-bit int
+            seed = split_seed(seed)
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.compact = compact
         self.players = []
-        self.players_cycle = []
+        self.seat = -1
         self.deck = None
         self.state = 'waiting'
         self.player = None
@@ -78,6 +426,19 @@ class Game(object):
         self.actions_taken = Counter()
         self.dice = dict.fromkeys(COLORS, 3)
         self.auction_card = None
+        self.auction_bidder = None
+        self.auction_gold = 0
+        self.auction_won = False
+        self.log = []
+        self.snapshots = []
+        self.snapshot_interval = snapshot_interval
+        self.undo_stack = []
+        self.observers = []
+        self.zobrist = 0
+
+    def spawn_random(self, *keys):
+        """Returns a new RNG seeded from this game's seed and ``keys``."""
+        return random.Random(split_seed(self.seed, *keys))
 
     def join(self, player):
         self.players.append(player)
@@ -88,8 +449,10 @@ class Game(object):
 
         self.state = 'start'
         self.player_turns_left = self.turns_per_player
-        self.deck = deal(self.player_count)
-        self.players_cycle = cycle(self.players)
+        self.deck = Deck.deal(self.player_count, compact=self.compact,
+                              rng=self.spawn_random('deck'))
+        self.seat = -1
+        self.rehash()
 
         self.state = 'next_player'
         self.next_player()
@@ -123,15 +486,15 @@ class Game(object):
         if self.state == 'next_player':
             self.state = 'turn'
             self.reset_actions()
-            self.player = next(self.players_cycle)
             self.player_turns_left = self.turns_per_player
         elif self.state == 'public':
-            self.player = next(self.players_cycle)
+            pass
         elif self.state == 'auction':
             self.reset_actions()
-            self.player = next(self.players_cycle)
         else:
             raise ValueError('Incorrect state.')
+        self.seat = (self.seat + 1) % self.player_count
+        self.player = self.players[self.seat]
 
     @property
     def active_player(self):
@@ -141,7 +504,7 @@ class Game(object):
     def turns_left(self):
         return self.player_turns_left
 
-    def turn(self):
+    def turn(self, public_card=None):
         player = self.active_player
 
         if self.state == 'turn':
@@ -149,20 +512,43 @@ class Game(object):
             assert self.turns_left > 0
             card = self.deck.pop()
             self.player_turns_left -= 1
+            if self.observers:
+                self._emit('card', card, 'deck', 'drawn', self.seat)
+                self._emit('turn', self.state, self.seat, self.turns_left)
         elif self.state == 'public':
-            card = player.choose_public_card(self.public[:])
+            card = public_card
+            if card is None:
+                card = player.choose_public_card(self.public[:])
         elif self.state == 'auction':
             if self.auction_card:
                 card = self.auction_card
             else:
                 card = self.pile.pop()
-                card['bid_player'], card['bid_gold'] = (None, 0)
                 self.auction_card = card
+                self.auction_bidder, self.auction_gold = (None, 0)
+                self.auction_won = False
+                keys = CARD_ZOBRIST[Card.from_dict(card).index]
+                self.zobrist = (self.zobrist - keys[ZONE_SLOTS['pile']] +
+                                keys[ZONE_SLOTS['auction']]) & HASH_MASK
+                if self.observers:
+                    self._emit('card', card, 'pile', 'auction', None)
         else:
             raise ValueError('Incorrect state.')
 
         return player, card, self.valid_actions(player, card)
 
+    def play_turn(self):
+        """Lets the active player choose and play one action."""
+        player, card, actions = self.turn()
+        action = player.act(card, player.choose_action(card, actions))
+        return player, card, action
+
+    def play(self):
+        """Plays the started game to the end and returns the winner."""
+        while self.state != 'end':
+            self.play_turn()
+        return self.winner()
+
     def turn_action(self, player, card, action, change_colors, bid_gold):
         """Handles player action and its influence on the game."""
         action_func = {
@@ -177,17 +563,19 @@ class Game(object):
 
         action_func()
         self.actions_taken[action] += 1
-
-        if self.state == 'auction' and action == ACTION_BID_CARD and bid_gold:
-            # the player placed a bid so if it's higher (and not bidding again)
-            # we update the card with the new highest bidder
-            if bid_gold > card['bid_gold'] and player != card['bid_player']:
-                card['bid_player'], card['bid_gold'] = (player, bid_gold)
-        elif self.state == 'auction' and action == ACTION_BID_CARD:
-            # if current player didn't place the bid, but still is the last
-            # card bidder then this card now belongs to him
-            if player == card['bid_player']:
-                card['bid_won'] = True
+        seat = self.players.index(player)
+        self.log.append(Move(
+            seat, card, action,
+            change_colors if change_colors is None else tuple(change_colors),
+            bid_gold))
+
+        if self.state == 'auction' and action == ACTION_BID_CARD:
+            if player == self.auction_bidder:
+                # the highest bidder didn't bid again so the card is his
+                if not bid_gold:
+                    self.auction_won = True
+            elif place_bid(self, player, bid_gold) and self.observers:
+                self._emit('bid', seat, self.auction_gold)
         elif self.state == 'auction':
             # action isnt ACTION_BID_CARD which means the player that won
             # the card is doing something else with it
@@ -198,6 +586,15 @@ class Game(object):
             self.actions_taken[ACTION_TAKE_CARD] += 1
             self.discarded.append(card)
 
+        if action != ACTION_BID_CARD:
+            self._move_hash(card, ACTION_ZONES[action], seat)
+
+        if self.observers and action != ACTION_BID_CARD:
+            source = 'drawn'
+            if self.state in ('public', 'auction'):
+                source = self.state
+            self._emit('card', card, source, ACTION_ZONES[action], seat)
+
     def use_change_card(self, card, colors):
         value = card['value']
         assert card['type'] == 'change'
@@ -207,13 +604,18 @@ class Game(object):
             return
 
         if value == 0:
-            value = colors[0] == '+' and 1 or -1
+            value = colors[0][0] == '+' and 1 or -1
             colors = [colors[0][1:]]
         for color in colors:
+            keys = DICE_ZOBRIST[color]
+            self.zobrist -= keys[self.dice[color]]
             if value < 0:
                 self.dice[color] -= 1
             else:
                 self.dice[color] += 1
+            self.zobrist = (self.zobrist + keys[self.dice[color]]) & HASH_MASK
+            if self.observers:
+                self._emit('dice', color, self.dice[color])
 
     def turn_complete(self, player, card, action):
         """Handles moving to the next state and advancing player turns."""
@@ -224,8 +626,10 @@ class Game(object):
         if self.deck_count == 0 and not self.public:
             self.state = 'auction'
             # if the player won the card he still needs to use it
-            if 'bid_won' not in card:
+            if not self.auction_won:
                 self.next_player()
+                while must_pass(self, self.player):
+                    self.next_player()
 
         if self.state == 'auction' and not self.pile and not self.auction_card:
             self.state = 'end'
@@ -235,67 +639,417 @@ class Game(object):
             self.state = 'next_player'
             self.next_player()
 
-    def valid_actions(self, player, card):
-        """Returns a list of valid actions for the current turn."""
-        if self.state == 'public':
-            if card['type'] == 'change':
-                return [ACTION_DISCARD_CARD, ACTION_USE_CARD]
-            return [ACTION_TAKE_CARD]
+        if self.observers:
+            self._emit('turn', self.state, self.seat, self.turns_left)
 
-        if self.state == 'auction' and card['bid_player'] != player:
-            return [ACTION_BID_CARD]
+        if (self.snapshot_interval and
+                len(self.log) % self.snapshot_interval == 0):
+            self.snapshots.append(self.snapshot())
 
-        actions = ACTIONS[:]
-        actions.remove(ACTION_DISCARD_CARD)
-        actions.remove(ACTION_USE_CARD)
-        actions.remove(ACTION_BID_CARD)
+    def _move_hash(self, card, target, seat):
+        # the drawn card was never hashed, so only the other sources count
+        keys = CARD_ZOBRIST[Card.from_dict(card).index]
+        if target == 'hand':
+            zobrist = self.zobrist + keys[HAND_SLOT + seat]
+        else:
+            zobrist = self.zobrist + keys[ZONE_SLOTS[target]]
+        if self.state in ('public', 'auction'):
+            zobrist -= keys[ZONE_SLOTS[self.state]]
+        self.zobrist = zobrist & HASH_MASK
+
+    def rehash(self):
+        """Computes the zobrist hash again from the zones and dice.
+
+        Needed after changing them other than by playing, e.g. setting a
+        player's cards or dealing the pile again.
+        """
+        zones = [(ZONE_SLOTS['pile'], self.pile),
+                 (ZONE_SLOTS['public'], self.public),
+                 (ZONE_SLOTS['discarded'], self.discarded)]
+        if self.auction_card is not None:
+            zones.append((ZONE_SLOTS['auction'], [self.auction_card]))
+        zones.extend((HAND_SLOT + seat, player.cards)
+                     for seat, player in enumerate(self.players))
+        zobrist = dice_hash(self.dice)
+        for slot, cards in zones:
+            for card in cards:
+                zobrist += CARD_ZOBRIST[Card.from_dict(card).index][slot]
+        self.zobrist = zobrist & HASH_MASK
+        return self.zobrist
+
+    def position_hash(self, drawn=None):
+        """Returns the zobrist hash with the turn state added, the key of
+        the position in transposition tables.
+
+        ``drawn`` is the card taken from the deck and not played yet.
+        """
+        taken = self.actions_taken
+        bidder = self.auction_bidder
+        key = self.zobrist + turn_key((
+            self.player_count, STATES.index(self.state), self.seat,
+            self.player_turns_left, taken[ACTION_TAKE_CARD],
+            taken[ACTION_PILE_CARD], taken[ACTION_SHOW_CARD],
+            0 if bidder is None else self.players.index(bidder) + 1,
+            self.auction_gold, self.auction_won))
+        if drawn is not None:
+            key += CARD_ZOBRIST[Card.from_dict(drawn).index][
+                ZONE_SLOTS['drawn']]
+        return key & HASH_MASK
+
+    def _emit(self, *event):
+        """Passes a change event to the observers, see libros.delta."""
+        for observer in self.observers:
+            observer(event)
+
+    def snapshot(self):
+        """Returns a Snapshot of the game between two turns."""
+        bidder = self.auction_bidder
+        return Snapshot(
+            len(self.log), self.state, self.seat, self.player_turns_left,
+            tuple(self.deck), tuple(self.pile), tuple(self.public),
+            tuple(self.discarded),
+            tuple(self.dice[color] for color in COLORS),
+            tuple(self.actions_taken[action] for action in ACTIONS),
+            (self.auction_card, bidder and self.players.index(bidder),
+             self.auction_gold, self.auction_won),
+            tuple(tuple(player.cards) for player in self.players),
+            self.random.getstate())
+
+    def load(self, snapshot):
+        """Puts the game in the state recorded by ``snapshot``."""
+        assert len(snapshot.hands) == self.player_count
+        self.state = snapshot.state
+        self.player_turns_left = snapshot.turns_left
+        self.deck = Deck.from_cards(snapshot.deck, self.compact)
+        self.pile = list(snapshot.pile)
+        self.public = list(snapshot.public)
+        self.discarded = list(snapshot.discarded)
+        self.dice = dict(zip(COLORS, snapshot.dice))
+        self.actions_taken = Counter(
+            dict(zip(ACTIONS, snapshot.actions_taken)))
+        card, bidder, self.auction_gold, self.auction_won = snapshot.auction
+        self.auction_card = card
+        self.auction_bidder = None if bidder is None else self.players[bidder]
+        for player, cards in zip(self.players, snapshot.hands):
+            player.cards = cards
+        self.random.setstate(snapshot.random)
+        self.seat = snapshot.seat
+        self.player = self.players[self.seat] if self.seat >= 0 else None
+        del self.log[snapshot.moves:]
+        del self.undo_stack[:]
+        self.rehash()
+
+    def clone(self):
+        """Returns an independent copy of the game for search.
+
+        Zones and the log are copied as flat lists sharing the cards, and
+        the turn order is just the seat index, so this is much cheaper than
+        a deepcopy.
+        """
+        game = object.__new__(self.__class__)
+        game.__dict__.update(self.__dict__)
+        game.deck = self.deck.copy()
+        game.pile = self.pile[:]
+        game.public = self.public[:]
+        game.discarded = self.discarded[:]
+        game.actions_taken = self.actions_taken.copy()
+        game.dice = self.dice.copy()
+        game.random = random.Random()
+        game.random.setstate(self.random.getstate())
+        game.log = self.log[:]
+        game.snapshots = self.snapshots[:]
+        game.undo_stack = []
+        game.observers = []
+        game.players = [player.clone(game) for player in self.players]
+        if self.player is not None:
+            game.player = game.players[self.seat]
+        if self.auction_bidder is not None:
+            game.auction_bidder = game.players[
+                self.players.index(self.auction_bidder)]
+        return game
+
+    def apply(self, action, public_card=None, change_colors=None,
+              bid_gold=None):
+        """Plays a whole turn for the active player so undo() can revert it.
+
+        ``public_card`` picks the card in the public phase.
+        """
+        deck_count, pile_count = len(self.deck), len(self.pile)
+        scalars = (self.state, self.seat, self.player_turns_left,
+                   self.actions_taken.copy(), self.auction_card,
+                   self.auction_bidder, self.auction_gold, self.auction_won,
+                   self.zobrist, len(self.snapshots))
+        player, card, _ = self.turn(public_card)
+        public_index = None
+        if self.state == 'public':
+            public_index = self.public.index(card)
+        dice = self.dice.copy() if action == ACTION_USE_CARD else None
+        self.undo_stack.append((
+            scalars, player, card, deck_count, pile_count, public_index,
+            len(self.public), len(self.discarded), len(player.cards), dice))
+        player.act(card, action, change_colors, bid_gold)
+        return player, card
+
+    def undo(self):
+        """Reverts the last turn played with apply()."""
+        (scalars, player, card, deck_count, pile_count, public_index,
+         public_count, discarded_count, hand_count,
+         dice) = self.undo_stack.pop()
+
+        del self.log[-1]
+        if len(player.cards) > hand_count:
+            player.drop_card()
+        del self.discarded[discarded_count:]
+        if public_index is None:
+            del self.public[public_count:]
+        else:
+            self.public.insert(public_index, card)
+        if len(self.pile) > pile_count:
+            del self.pile[pile_count:]
+        elif len(self.pile) < pile_count:
+            self.pile.append(card)
+        if len(self.deck) < deck_count:
+            self.deck.append(card)
+        if dice is not None:
+            self.dice = dice
+
+        (self.state, self.seat, self.player_turns_left, self.actions_taken,
+         self.auction_card, self.auction_bidder, self.auction_gold,
+         self.auction_won, self.zobrist, snapshot_count) = scalars
+        self.player = self.players[self.seat] if self.seat >= 0 else None
+        del self.snapshots[snapshot_count:]
+
+    def replay(self, moves):
+        """Plays logged moves again, e.g. the tail after a snapshot."""
+        for move in moves:
+            public_card = move.card if self.state == 'public' else None
+            player, card, _ = self.turn(public_card)
+            assert self.players.index(player) == move.seat
+            assert card == move.card
+            player.act(card, move.action,
+                       change_colors=move.change_colors,
+                       bid_gold=move.bid_gold)
+
+    @classmethod
+    def new(cls, players, **kwargs):
+        """Returns a started game of ``players`` seated in order, ``kwargs``
+        go to Game()."""
+        game = cls(**kwargs)
+        for player in players:
+            game.join(player)
+        game.start()
+        return game
+
+    @classmethod
+    def restore(cls, players, log, snapshots=(), **kwargs):
+        """Rebuilds a game from its log and the latest usable snapshot.
+
+        ``kwargs`` must match the original game (``seed`` and ``compact``)
+        for the replayed tail to be drawn from the same deck.
+        """
+        game = cls(**kwargs)
+        for player in players:
+            game.join(player)
+
+        snapshots = [snapshot for snapshot in snapshots
+                     if snapshot.moves <= len(log)]
+        if snapshots:
+            game.log = list(log[:snapshots[-1].moves])
+            game.load(snapshots[-1])
+        else:
+            game.start()
+        game.snapshots = snapshots
+        game.replay(log[len(game.log):])
+        return game
+
+    def to_bytes(self, random_state=False):
+        """Packs the game between two turns into a versioned record.
+
+        Cards are stored as their CARDS index, so a game takes a couple of
+        hundred bytes. The log is left out, as is the 2.5 KB state of the
+        game's RNG unless ``random_state`` is set.
+        """
+        if self.deck is None:
+            raise ValueError('Incorrect state.')
+        snapshot = self.snapshot()
+        card, bidder, gold, won = snapshot.auction
+        zones = (snapshot.deck, snapshot.pile, snapshot.public,
+                 snapshot.discarded) + snapshot.hands
+        cards = bytearray(Card.from_dict(card).index
+                          for zone in zones for card in zone)
+        size = BYTES_HEADER.size + self.player_count + len(cards)
+        if random_state:
+            size += BYTES_RANDOM.size
+        flags = ((self.compact and COMPACT_FLAG) | (won and WON_FLAG) |
+                 (random_state and RANDOM_FLAG))
+
+        data = bytearray(size)
+        BYTES_HEADER.pack_into(
+            data, 0, 'LG', BYTES_VERSION, size, flags, self.seed,
+            self.player_count, STATES.index(self.state), self.seat,
+            self.player_turns_left,
+            NO_CARD_BYTE if card is None else Card.from_dict(card).index,
+            -1 if bidder is None else bidder, gold,
+            *(snapshot.dice + snapshot.actions_taken +
+              tuple(len(zone) for zone in zones[:4])))
+        offset = BYTES_HEADER.size
+        data[offset:offset + self.player_count] = bytearray(
+            len(hand) for hand in snapshot.hands)
+        offset += self.player_count
+        data[offset:offset + len(cards)] = cards
+        if random_state:
+            _, internal, gauss = snapshot.random
+            BYTES_RANDOM.pack_into(
+                data, offset + len(cards),
+                *(internal + (float('nan') if gauss is None else gauss,)))
+        return bytes(data)
+
+    @classmethod
+    def from_bytes(cls, data, players=None, offset=0):
+        """Rebuilds a game packed by to_bytes() from ``data[offset:]``.
+
+        ``data`` can be any buffer, e.g. a memoryview over a file of records.
+        Without a stored RNG state the game gets one spawned from its seed.
+        """
+        header = BYTES_HEADER.unpack_from(data, offset)
+        (magic, version, size, flags, seed, player_count, state, seat,
+         turns_left, card, bidder, gold) = header[:12]
+        if magic != 'LG' or version != BYTES_VERSION:
+            raise ValueError('Unsupported game data.')
+        dice, actions_taken = header[12:17], header[17:23]
+
+        compact = bool(flags & COMPACT_FLAG)
+        if card != NO_CARD_BYTE:
+            card = CARDS[card] if compact else CARDS[card].to_dict()
+        else:
+            card = None
+
+        offset += BYTES_HEADER.size
+        record = bytearray(data[offset:offset + size - BYTES_HEADER.size])
+        counts = list(header[23:]) + list(record[:player_count])
+        indices = record[player_count:player_count + sum(counts)]
+        if compact:
+            cards = [CARDS[index] for index in indices]
+        else:
+            cards = [CARDS[index].to_dict() for index in indices]
+        zones, start = [], 0
+        for count in counts:
+            zones.append(tuple(cards[start:start + count]))
+            start += count
+
+        game = cls(compact=compact, seed=seed)
+        for player in players or [Player() for _ in xrange(player_count)]:
+            game.join(player)
+        if flags & RANDOM_FLAG:
+            internal = BYTES_RANDOM.unpack_from(
+                data, offset + player_count + start)
+            gauss = internal[-1]
+            game.random.setstate(
+                (3, internal[:-1], None if gauss != gauss else gauss))
+        else:
+            game.random = game.spawn_random('from_bytes')
+
+        game.load(Snapshot(
+            0, STATES[state], seat, turns_left, zones[0], zones[1], zones[2],
+            zones[3], dice, actions_taken,
+            (card, None if bidder < 0 else bidder, gold,
+             bool(flags & WON_FLAG)),
+            tuple(zones[4:]), game.random.getstate()))
+        return game
+
+    @classmethod
+    def iter_bytes(cls, data):
+        """Yields the games of concatenated to_bytes() records."""
+        data = memoryview(data)
+        offset = 0
+        while offset < len(data):
+            size = BYTES_HEADER.unpack_from(data, offset)[2]
+            yield cls.from_bytes(data, offset=offset)
+            offset += size
+
+    def resolve_auction(self, bids):
+        """Plays a round of sealed ``bids`` (gold by seat) on the next card.
+
+        Every player who can still bid does so in turn order until the
+        turn is back to the highest bidder, who still has to play the
+        card. A seat's sealed bid is final: a missing bid is a pass and a
+        seat that bid already passes on its later turns. Returns the seat
+        of the highest bidder.
+        """
+        if self.state != 'auction':
+            raise ValueError('Incorrect state.')
+        # check every bid first so a bad one leaves the round unplayed
+        for seat, gold in bids.iteritems():
+            if not 0 <= seat < self.player_count:
+                raise ValueError('No such seat.')
+            if gold > max_bid(self.players[seat]):
+                raise ValueError('Not enough gold.')
+        bids = dict(bids)
+        while (self.auction_card is None or
+               self.player is not self.auction_bidder):
+            player, card, _ = self.turn()
+            player.act(card, ACTION_BID_CARD, bid_gold=bids.pop(self.seat, 0))
+        return self.players.index(self.auction_bidder)
+
+    def action_key(self, player, card):
+        """Returns the VALID_ACTIONS index of the current turn."""
+        change = card['type'] == 'change'
+        if self.state == 'public':
+            return PUBLIC_CHANGE_KEY if change else TAKE_KEY
+        if self.state == 'auction':
+            if self.auction_bidder != player:
+                return BID_KEY
+            return TAKE_KEY | CHANGE_KEY if change else TAKE_KEY
+
+        taken = self.actions_taken
+        key = 0
+        if not taken[ACTION_TAKE_CARD]:
+            key = TAKE_KEY | CHANGE_KEY if change else TAKE_KEY
+        if not taken[ACTION_PILE_CARD]:
+            key |= PILE_KEY
+        if taken[ACTION_SHOW_CARD] != self.player_count - 1:
+            key |= SHOW_KEY
+        return key
 
-        # if we have shown enough cards remove the action
-        if (self.state == 'auction' or
-                self.actions_taken[ACTION_SHOW_CARD] == self.player_count - 1):
-            actions.remove(ACTION_SHOW_CARD)
+    def valid_actions(self, player, card):
+        """Returns a shared tuple of valid actions for the current turn."""
+        return VALID_ACTIONS[self.action_key(player, card)]
 
-        if (self.state == 'auction' or
-                self.actions_taken[ACTION_PILE_CARD]):
-            actions.remove(ACTION_PILE_CARD)
+    def valid_actions_mask(self, player, card):
+        """Returns the valid actions as a bitmask of ``1 << action``."""
+        return VALID_ACTION_MASKS[self.action_key(player, card)]
 
-        if self.state != 'auction' and self.actions_taken[ACTION_TAKE_CARD]:
-            actions.remove(ACTION_TAKE_CARD)
+    def reset_actions(self):
+        self.actions_taken.clear()
 
-        if card['type'] == 'change' and ACTION_TAKE_CARD in actions:
-            actions.append(ACTION_DISCARD_CARD)
-            actions.append(ACTION_USE_CARD)
+    def majorities(self):
+        """Returns the player holding the majority of each won color."""
+        holders = evaluate(self.players, self.dice).holders
+        return {color: self.players[seat]
+                for color, seat in holders.iteritems()}
 
-        return actions
+    def scores(self):
+        """Returns the Scores of the game, see libros.scoring."""
+        return evaluate(self.players, self.dice)
 
-    def reset_actions(self):
-        self.actions_taken.clear()
+    def standings(self):
+        """Returns the current Standing of every player, leader first.
 
-    def winner(self):
-        score = namedtuple('Score', ['valueletter', 'player'])
-        player_won = defaultdict(dict)
-        player_scores = defaultdict(int)
-        for color in COLORS:
-            winner = max(score(player.score_type(color), player)
-                         for player in self.players)
-            if winner.valueletter.value:
-                player_scores[winner.player] += self.dice[color]
-                player_won[winner.player][color] = True
+        Reads the players' running totals so it is cheap enough to call
+        after every move.
+        """
         # The rules don't say this but the author says "Those involved in the
         # tie for the win will use the Illuminator category as a tie-breaker;
         # hence, whoever has the highest total value wins, then it goes to
         # tie-breaker card. If none of the tied players have an Illuminator,
         # then it moves down the line to Scribes and so on. This way, everyone
         # knows that Illuminators are slightly more valuable to have."
-        return max((score,
-                    player.score_type('gold').value,
-                    'brown' in player_won[player],
-                    'blue' in player_won[player],
-                    'green' in player_won[player],
-                    'orange' in player_won[player],
-                    'red' in player_won[player],
-                    player)
-                   for player, score in player_scores.iteritems())[7]
+        # Anything still tied goes to the earlier seat.
+        return evaluate(self.players, self.dice).standings
+
+    def winner(self):
+        seat = winner_seat(self.players, self.dice)
+        return None if seat is None else self.players[seat]
 
 
 class Player(object):
@@ -304,6 +1058,17 @@ class Player(object):
         self.cards = []
         self.id = None
 
+    @property
+    def cards(self):
+        return self._cards
+
+    @cards.setter
+    def cards(self, cards):
+        self._cards = []
+        self.scores = {}
+        for card in cards:
+            self.take_card(card)
+
     def __repr__(self):
         return u'ID: %d, Cards: %d' % (self.id, len(self.cards))
 
@@ -316,25 +1081,38 @@ class Player(object):
         assert cards
         return cards[0]
 
+    def choose_action(self, card, actions):
+        assert actions
+        return self.game.random.choice(actions)
+
+    def choose_change_colors(self, card):
+        return []
+
+    def choose_bid(self, card, max_gold):
+        """Returns the gold to bid on ``card``, up to ``max_gold``."""
+        return 1
+
     def act(self, card, action=None, change_colors=None, bid_gold=None):
         assert self.game
         assert card
 
         if action is None:
-            action = random.choice(ACTIONS)
+            action = self.game.random.choice(ACTIONS)
 
         assert action in ACTIONS
 
         if action == ACTION_USE_CARD and change_colors is None:
-            change_colors = []
+            change_colors = self.choose_change_colors(card)
 
-        if (bid_gold is None and
-                action == ACTION_BID_CARD and card['bid_player'] != self):
-            # first player bidding will get the card as he will bid the highest
-            bid_gold = 1
+        if action == ACTION_BID_CARD and self.game.auction_bidder != self:
+            limit = max_bid(self)
+            if bid_gold is None:
+                bid_gold = self.choose_bid(card, limit)
+            if bid_gold > limit:
+                raise ValueError('Not enough gold.')
 
         if action == ACTION_TAKE_CARD:
-            self.cards.append(card)
+            self.take_card(card)
 
         self.game.turn_action(
             self, card, action, change_colors=change_colors, bid_gold=bid_gold)
@@ -342,11 +1120,37 @@ class Player(object):
 
         return action
 
+    def clone(self, game):
+        """Returns a copy of the player seated at the cloned ``game``."""
+        player = object.__new__(self.__class__)
+        player.__dict__.update(self.__dict__)
+        player.game = game
+        player._cards = self._cards[:]
+        player.scores = self.scores.copy()
+        return player
+
+    def take_card(self, card):
+        """Adds a card to the hand and updates the running type totals."""
+        self._cards.append(card)
+        kind = card['type']
+        score = self.scores.get(kind)
+        if score is None:
+            self.scores[kind] = ValueLetter(card['value'], card['letter'])
+        else:
+            self.scores[kind] = ValueLetter(score.value + card['value'],
+                                            min(score.letter, card['letter']))
+
+    def drop_card(self):
+        """Removes the last card taken, e.g. when undoing a move."""
+        card = self._cards.pop()
+        kind = card['type']
+        letters = [c['letter'] for c in self._cards if c['type'] == kind]
+        if letters:
+            self.scores[kind] = ValueLetter(
+                self.scores[kind].value - card['value'], min(letters))
+        else:
+            del self.scores[kind]
+        return card
+
     def score_type(self, type):
-        ValueLetter = namedtuple('ValueLetter', ['value', 'letter'])
-        cards = [ValueLetter(card['value'], card['letter'])
-                 for card in self.cards if card['type'] == type]
-        if not cards:
-            return ValueLetter(0, None)
-        return ValueLetter(sum(card.value for card in cards),
-                           min(card.letter for card in cards))
+        return self.scores.get(type, NO_SCORE)
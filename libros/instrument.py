@@ -0,0 +1,176 @@
+"""Opt-in timing of the Game state machine.
+
+    instrumentation = Instrumentation(slow_turn=0.005)
+    instrumentation.enable()
+    ...
+    print(instrumentation.prometheus())
+    instrumentation.disable()
+
+enable() swaps timing wrappers in for the Game methods and disable() puts
+the originals back, so nothing is added to the hot paths while it is off.
+Calls are counted per method and the phase the game was in, and whole
+turns (turn() up to turn_complete()) per state transition. Both go into
+histograms with power of two microsecond buckets. Turns slower than
+``slow_turn`` seconds are kept with the move and the game state after it,
+as Game.to_bytes().
+"""
+import time
+import weakref
+
+from collections import deque
+
+from libros.game import Game
+
+
+METHODS = ('turn', 'valid_actions', 'turn_action', 'turn_complete',
+           'winner', 'standings')
+
+# bucket i counts the calls shorter than 2 ** i microseconds
+BUCKETS = 24
+
+
+class Histogram(object):
+    __slots__ = ('count', 'total', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.buckets = [0] * (BUCKETS + 1)
+
+    def add(self, elapsed):
+        self.count += 1
+        self.total += elapsed
+        self.buckets[min(int(elapsed * 1e6).bit_length(), BUCKETS)] += 1
+
+    def as_dict(self):
+        return {'count': self.count, 'total': self.total,
+                'buckets': list(self.buckets)}
+
+
+def _labels(**labels):
+    return ','.join('%s="%s"' % item for item in sorted(labels.iteritems()))
+
+
+def _histogram_lines(name, histograms):
+    lines = ['# TYPE %s histogram' % name]
+    for labels, histogram in sorted(
+            histograms, key=lambda item: sorted(item[0].items())):
+        cumulative = 0
+        for i, count in enumerate(histogram.buckets):
+            cumulative += count
+            bound = '+Inf' if i == BUCKETS else repr((1 << i) * 1e-6)
+            lines.append('%s_bucket{%s} %d' % (
+                name, _labels(le=bound, **labels), cumulative))
+        lines.append('%s_sum{%s} %r' % (name, _labels(**labels),
+                                        histogram.total))
+        lines.append('%s_count{%s} %d' % (name, _labels(**labels),
+                                          histogram.count))
+    return lines
+
+
+class Instrumentation(object):
+    """Call and turn timings of every Game while enabled."""
+
+    def __init__(self, slow_turn=0.01, samples=100):
+        self.slow_turn = slow_turn
+        self.methods = {}
+        self.transitions = {}
+        self.slow_turns = deque(maxlen=samples)
+        self._originals = {}
+        self._started = weakref.WeakKeyDictionary()
+
+    @property
+    def enabled(self):
+        return bool(self._originals)
+
+    def enable(self, methods=METHODS):
+        if self.enabled:
+            return
+        for name in methods:
+            method = Game.__dict__[name]
+            if hasattr(method, 'instrumented'):
+                raise ValueError('Game is already instrumented.')
+            self._originals[name] = method
+            setattr(Game, name, self._wrap(name, method))
+
+    def disable(self):
+        for name, method in self._originals.iteritems():
+            setattr(Game, name, method)
+        self._originals.clear()
+
+    def reset(self):
+        self.methods.clear()
+        self.transitions.clear()
+        self.slow_turns.clear()
+
+    def _wrap(self, name, method):
+        record = self._record
+        started = self._started
+        turn_done = self._turn_done
+
+        def wrapper(game, *args, **kwargs):
+            state = game.state
+            start = time.time()
+            if name == 'turn':
+                started[game] = start, state, game.seat
+            result = method(game, *args, **kwargs)
+            end = time.time()
+            record(name, state, end - start)
+            if name == 'turn_complete':
+                turn_done(game, end)
+            return result
+
+        wrapper.__name__ = method.__name__
+        wrapper.__doc__ = method.__doc__
+        wrapper.instrumented = True
+        return wrapper
+
+    def _record(self, name, state, elapsed):
+        histogram = self.methods.get((name, state))
+        if histogram is None:
+            histogram = self.methods[name, state] = Histogram()
+        histogram.add(elapsed)
+
+    def _turn_done(self, game, end):
+        turn = self._started.pop(game, None)
+        if turn is None:
+            # the move was played without turn(), e.g. by a test
+            return
+        start, state, seat = turn
+        elapsed = end - start
+        key = state, game.state
+        histogram = self.transitions.get(key)
+        if histogram is None:
+            histogram = self.transitions[key] = Histogram()
+        histogram.add(elapsed)
+        if elapsed >= self.slow_turn:
+            self.slow_turns.append({
+                'elapsed': elapsed, 'state': state, 'seat': seat,
+                'move': game.log[-1] if game.log else None,
+                'game': game.to_bytes(),
+            })
+
+    def snapshot(self):
+        """Returns the collected numbers as plain dicts and lists."""
+        methods = {}
+        for (name, state), histogram in self.methods.iteritems():
+            methods.setdefault(name, {})[state] = histogram.as_dict()
+        return {
+            'methods': methods,
+            'transitions': {
+                '%s->%s' % key: histogram.as_dict()
+                for key, histogram in self.transitions.iteritems()},
+            'slow_turns': list(self.slow_turns),
+        }
+
+    def prometheus(self):
+        """Returns the histograms in the Prometheus text format."""
+        lines = _histogram_lines('libros_method_seconds', [
+            ({'method': name, 'state': state}, histogram)
+            for (name, state), histogram in self.methods.iteritems()])
+        lines += _histogram_lines('libros_turn_seconds', [
+            ({'source': source, 'target': target}, histogram)
+            for (source, target), histogram in self.transitions.iteritems()])
+        lines.append('# TYPE libros_slow_turns gauge')
+        lines.append('libros_slow_turns %d' % len(self.slow_turns))
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,315 @@
+"""Information set Monte Carlo tree search player.
+
+Each iteration deals the unseen cards (``deck``, ``pile`` and the cards
+removed at the start) again to a clone of the game (a determinization),
+walks the shared tree with UCB restricted to the moves legal in that
+sample, and finishes with a random playout. Hands are kept as they are.
+Rollouts can be spread over several processes, which each grow their own
+tree from the same root and add up the visit counts.
+
+Many move orders lead to the same position, so the legal moves are cached
+by Game.position_hash(), and with a ``table`` the wins of every position
+are kept across determinizations, searches and (with a
+SharedTranspositionTable) processes: a node reached again starts from them.
+"""
+import math
+import time
+
+from collections import namedtuple
+from itertools import combinations
+from multiprocessing import Pool
+
+from libros.game import (
+    Player, COLORS,
+    ACTION_USE_CARD, ACTION_BID_CARD,
+)
+from libros.scoring import winner_seat
+from libros.zobrist import MAX_SEATS, TranspositionTable
+
+
+SearchMove = namedtuple('SearchMove', ['card', 'action', 'colors'])
+
+# what a playout adds to the table entry of a position: one visit and a
+# win for the winner's seat
+RESULTS = tuple((1,) + tuple(int(seat == winner) for seat in xrange(MAX_SEATS))
+                for winner in xrange(MAX_SEATS))
+
+# processes of a search Pool share these, see _init_worker()
+_worker_table = None
+_worker_moves = None
+
+
+def card_key(card):
+    return card['type'], card['value'], card['letter']
+
+
+def change_colors_options(value):
+    """Returns every way of playing a change card of ``value``."""
+    if value == 0:
+        return [(sign + color,) for sign in '+-' for color in COLORS]
+    return list(combinations(COLORS, abs(value)))
+
+
+def legal_moves(game):
+    """Returns the SearchMoves of the active player before its turn()."""
+    player = game.active_player
+    if game.state == 'public':
+        cards = {card_key(card): card for card in game.public}.values()
+    elif game.state == 'turn':
+        cards = [game.deck[-1]]
+    elif game.state == 'auction' and game.auction_card is None:
+        # turn() will put the next card of the pile up for auction
+        return [SearchMove(None, ACTION_BID_CARD, None)]
+    elif game.state == 'auction':
+        cards = [game.auction_card]
+    else:
+        return []
+
+    moves = []
+    for card in cards:
+        key = card_key(card) if game.state == 'public' else None
+        for action in game.valid_actions(player, card):
+            if action == ACTION_USE_CARD:
+                options = change_colors_options(card['value'])
+                moves.extend(SearchMove(key, action, colors)
+                             for colors in options)
+            else:
+                moves.append(SearchMove(key, action, None))
+    return moves
+
+
+def cached_legal_moves(game, moves_table):
+    """Returns legal_moves() through a table of move lists."""
+    drawn = game.deck[-1] if game.state == 'turn' else None
+    key = game.position_hash(drawn)
+    moves = moves_table.get(key)
+    if moves is None:
+        moves = legal_moves(game)
+        moves_table.store(key, moves)
+    return moves
+
+
+def play_move(game, move):
+    public_card = None
+    if move.card is not None:
+        public_card = next(card for card in game.public
+                           if card_key(card) == move.card)
+    player, card, _ = game.turn(public_card)
+    colors = move.colors and list(move.colors)
+    player.act(card, move.action, change_colors=colors)
+
+
+def determinize(game, rng, known_top=False):
+    """Returns a clone with the unseen cards dealt again to the deck and
+    pile, the cards removed at the start included."""
+    game = game.clone()
+    game.pile = game.deck.redeterminize(rng, game.pile, known_top)
+    game.rehash()
+    return game
+
+
+def rollout(game, rng):
+    """Plays random moves to the end and returns the winner's seat."""
+    while game.state != 'end':
+        public_card = None
+        if game.state == 'public':
+            public_card = rng.choice(game.public)
+        player, card, actions = game.turn(public_card)
+        action = rng.choice(actions)
+        colors = None
+        if action == ACTION_USE_CARD:
+            colors = list(rng.choice(change_colors_options(card['value'])))
+        player.act(card, action, change_colors=colors)
+    return winner_seat(game.players, game.dice)
+
+
+class Node(object):
+    __slots__ = ('move', 'parent', 'seat', 'children', 'visits', 'wins',
+                 'avails', 'key')
+
+    def __init__(self, move=None, parent=None, seat=None):
+        self.move = move
+        self.parent = parent
+        self.seat = seat
+        self.children = {}
+        self.visits = 0
+        self.wins = 0
+        self.avails = 1
+        self.key = None
+
+    def select(self, moves, exploration):
+        best, best_value = None, None
+        for move in moves:
+            child = self.children[move]
+            child.avails += 1
+            value = (child.wins / float(child.visits) + exploration *
+                     math.sqrt(math.log(child.avails) / child.visits))
+            if best is None or value > best_value:
+                best, best_value = child, value
+        return best
+
+
+def search(game, rng, iterations=None, time_limit=None, exploration=0.7,
+           known_top=False, table=None, moves_table=None):
+    """Runs ISMCTS from ``game`` before the active player's turn().
+
+    ``table`` keeps the visits and wins by seat of positions and
+    ``moves_table`` their legal moves, both by Game.position_hash().
+    Returns the visit count of every root move and the playouts run.
+    """
+    assert iterations or time_limit
+    deadline = time_limit and time.time() + time_limit
+    root = Node()
+    playouts = 0
+    while True:
+        if iterations is not None and playouts >= iterations:
+            break
+        if deadline and time.time() >= deadline:
+            break
+
+        state = determinize(game, rng, known_top)
+        node = root
+        while state.state != 'end':
+            if moves_table is None:
+                moves = legal_moves(state)
+            else:
+                moves = cached_legal_moves(state, moves_table)
+            untried = [move for move in moves if move not in node.children]
+            if untried:
+                move = rng.choice(untried)
+                child = Node(move, node, state.seat)
+                node.children[move] = child
+                play_move(state, move)
+                node = child
+                if table is not None:
+                    child.key = state.position_hash()
+                    stats = table.get(child.key)
+                    if stats is not None:
+                        child.visits = stats[0]
+                        child.wins = stats[1 + child.seat]
+                break
+            node = node.select(moves, exploration)
+            play_move(state, node.move)
+
+        winner = rollout(state, rng)
+        playouts += 1
+        while node is not None:
+            node.visits += 1
+            if node.seat == winner:
+                node.wins += 1
+            if node.key is not None:
+                table.add(node.key, RESULTS[winner], node.visits)
+            node = node.parent
+
+    visits = {move: child.visits for move, child in root.children.iteritems()}
+    return visits, playouts
+
+
+def _init_worker(table):
+    global _worker_table, _worker_moves
+    _worker_table = table
+    _worker_moves = TranspositionTable()
+
+
+def _search_worker(args):
+    game, seed, iterations, time_limit, exploration, known_top = args
+    rng = game.spawn_random('mcts', seed)
+    return search(game, rng, iterations, time_limit, exploration, known_top,
+                  _worker_table, _worker_moves)
+
+
+class MCTSPlayer(Player):
+    """Computer player choosing its moves with ISMCTS.
+
+    The search stops after ``iterations`` playouts or ``time_limit`` seconds,
+    whichever comes first, and is split over ``processes`` workers. With
+    ``table`` the position statistics outlive each search, the workers
+    sharing them if it is a SharedTranspositionTable.
+    """
+
+    def __init__(self, iterations=1000, time_limit=None, processes=1,
+                 exploration=0.7, table=None):
+        super(MCTSPlayer, self).__init__()
+        self.iterations = iterations
+        self.time_limit = time_limit
+        self.processes = processes
+        self.exploration = exploration
+        self.table = table
+        self.moves_table = TranspositionTable()
+        self.move = None
+        self.rng = None
+        self.searches = 0
+        self.playouts = 0
+        self.playouts_per_second = 0.0
+        self._pool = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_pool'] = None
+        # the workers have their own, see _init_worker()
+        state['table'] = state['moves_table'] = None
+        return state
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+    def best_move(self, game, known_top=False):
+        moves = legal_moves(game)
+        if len(moves) == 1:
+            return moves[0]
+
+        if self.rng is None:
+            self.rng = self.game.spawn_random('mcts', self.id)
+        iterations = self.iterations
+        started = time.time()
+        if self.processes > 1:
+            if self._pool is None:
+                self._pool = Pool(self.processes, _init_worker,
+                                  (self.table,))
+            if iterations is not None:
+                iterations = -(-iterations // self.processes)
+            jobs = [(game, self.rng.getrandbits(32), iterations,
+                     self.time_limit, self.exploration, known_top)
+                    for _ in xrange(self.processes)]
+            results = self._pool.map(_search_worker, jobs)
+        else:
+            results = [search(game, self.rng, iterations, self.time_limit,
+                              self.exploration, known_top, self.table,
+                              self.moves_table)]
+        elapsed = time.time() - started
+
+        visits = {}
+        for worker_visits, playouts in results:
+            self.playouts += playouts
+            for move, count in worker_visits.iteritems():
+                visits[move] = visits.get(move, 0) + count
+        self.searches += 1
+        self.playouts_per_second = (
+            sum(playouts for _, playouts in results) / max(elapsed, 1e-9))
+        return max(moves, key=lambda move: visits.get(move, 0))
+
+    def choose_public_card(self, cards):
+        self.move = self.best_move(self.game.clone())
+        return next(card for card in cards if card_key(card) == self.move.card)
+
+    def choose_action(self, card, actions):
+        game = self.game
+        if game.state != 'public':
+            # search from before turn(), putting the drawn card back on top
+            root = game.clone()
+            known_top = root.state == 'turn'
+            if known_top:
+                root.deck.append(card)
+                root.player_turns_left += 1
+            self.move = self.best_move(root, known_top)
+        if self.move.action not in actions:
+            return super(MCTSPlayer, self).choose_action(card, actions)
+        return self.move.action
+
+    def choose_change_colors(self, card):
+        if self.move is not None and self.move.colors:
+            return list(self.move.colors)
+        return []
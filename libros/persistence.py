@@ -0,0 +1,285 @@
+"""Journal of live games in SQLite, to get the tables back after a restart.
+
+A Journal follows each game it is given through its observers and queues
+every finished move; a background thread writes whatever is queued in
+one transaction, so a busy server makes a handful of commits a second
+instead of one per move and a move never waits on the disk. The
+database is in WAL mode with full syncs, so a committed move survives a
+crash. recover() reads every open table and its moves in two queries
+and replays them (see Game.restore()).
+
+A batch that fails to commit is rolled back and its error raised by the
+next flush() or close(). The tables it had rows of are put in ``broken``
+and their later moves are not written, so the journal of a table never
+has a gap: it is recovered as it was before the failed batch.
+
+    journal = Journal('tables.db')
+    journal.open_table(1, game)
+    ...
+    games = Journal('tables.db').recover()
+"""
+import sqlite3
+import threading
+import time
+
+from itertools import groupby
+from Queue import Queue, Empty
+
+import numpy as np
+
+from libros.game import Game, Player, Move, CARDS
+from libros.store import decode_change, decode_moves, encode_change
+from libros.store import encode_move
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tables (
+    id INTEGER PRIMARY KEY,
+    seed INTEGER NOT NULL,
+    compact INTEGER NOT NULL,
+    players INTEGER NOT NULL,
+    ended INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS moves (
+    table_id INTEGER NOT NULL,
+    number INTEGER NOT NULL,
+    move INTEGER NOT NULL,
+    change INTEGER,
+    bid INTEGER,
+    PRIMARY KEY (table_id, number)
+) WITHOUT ROWID;
+"""
+
+# seeds are unsigned 64-bit, SQLite integers signed
+SEED_BIAS = 1 << 63
+
+
+class Journal(object):
+    """Writes the moves of the tables it follows to the database at
+    ``path``, at most ``max_batch`` queued rows per commit."""
+
+    def __init__(self, path, max_batch=4096):
+        self.path = path
+        self.max_batch = max_batch
+        self.moves = 0
+        self.commits = 0
+        self.seconds = 0.0
+        self.error = None
+        self.broken = {}
+        self._tables = {}
+        self._queue = Queue()
+        self._queued = 0
+        self._written = 0
+        self._done = threading.Condition()
+
+        self._connection = sqlite3.connect(
+            path, isolation_level=None, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=FULL')
+        self._connection.executescript(SCHEMA)
+        self._writer = threading.Thread(target=self._write)
+        self._writer.daemon = True
+        self._writer.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def open_table(self, table_id, game, journaled=0):
+        """Journals the moves of the started ``game``, but for the first
+        ``journaled`` ones, e.g. those of a recovered game."""
+        if not 0 <= game.seed < 1 << 64:
+            raise ValueError('Incorrect seed.')
+        self._put(('table', (table_id, game.seed - SEED_BIAS,
+                             int(game.compact), game.player_count)))
+        written = [journaled]
+
+        def observe(event):
+            if event[0] != 'turn':
+                return
+            # turn_complete() ends every move with a turn event
+            log = game.log
+            for number in xrange(written[0], len(log)):
+                move = log[number]
+                change = move.change_colors
+                if change is not None:
+                    change = encode_change(move.card, change)
+                self._put(('move', (table_id, number, encode_move(move),
+                                    change, move.bid_gold)))
+            written[0] = len(log)
+            if event[1] == 'end':
+                # observers can't be removed while the game calls them
+                self._tables.pop(table_id, None)
+                self._put(('end', (table_id,)))
+
+        observe(('turn', game.state))
+        if game.state != 'end':
+            game.observers.append(observe)
+            self._tables[table_id] = game, observe
+
+    def close_table(self, table_id):
+        """Stops following the table, it won't be recovered."""
+        game, observe = self._tables.pop(table_id, (None, None))
+        if game is not None:
+            game.observers.remove(observe)
+        self._put(('end', (table_id,)))
+
+    def _put(self, item):
+        with self._done:
+            self._queued += 1
+        self._queue.put(item)
+
+    def _write(self):
+        connection = self._connection
+        while True:
+            items = [self._queue.get()]
+            while items[-1] is not None and len(items) < self.max_batch:
+                try:
+                    items.append(self._queue.get_nowait())
+                except Empty:
+                    break
+            stop = items[-1] is None
+            if stop:
+                items.pop()
+            rows = {'table': [], 'move': [], 'end': []}
+            tables = set()
+            error = None
+            started = time.time()
+            try:
+                for kind, row in items:
+                    if kind == 'move' and row[0] in self.broken:
+                        continue
+                    rows[kind].append(row)
+                    tables.add(row[0])
+                connection.execute('BEGIN')
+                connection.executemany(
+                    'INSERT OR IGNORE INTO tables (id, seed, compact, '
+                    'players) VALUES (?, ?, ?, ?)', rows['table'])
+                connection.executemany(
+                    'INSERT OR REPLACE INTO moves VALUES (?, ?, ?, ?, ?)',
+                    rows['move'])
+                connection.executemany(
+                    'UPDATE tables SET ended = 1 WHERE id = ?', rows['end'])
+                connection.execute('COMMIT')
+            except Exception as exc:
+                # kept for flush() and close() to raise, the thread goes on
+                try:
+                    connection.execute('ROLLBACK')
+                except sqlite3.Error:
+                    pass
+                error = exc
+            with self._done:
+                if error is not None:
+                    self.error = error
+                    for table_id in tables:
+                        self.broken.setdefault(table_id, error)
+                else:
+                    self.moves += len(rows['move'])
+                    self.commits += 1
+                    self.seconds += time.time() - started
+                self._written += len(items)
+                self._done.notify_all()
+            if stop:
+                return
+
+    def flush(self, timeout=None):
+        """Waits until everything queued so far is committed."""
+        with self._done:
+            queued = self._queued
+            deadline = None if timeout is None else time.time() + timeout
+            while self._written < queued:
+                left = None if deadline is None else deadline - time.time()
+                if left is not None and left <= 0:
+                    break
+                self._done.wait(left)
+        self._raise()
+        return self._written >= queued
+
+    def _raise(self):
+        with self._done:
+            error, self.error = self.error, None
+        if error is not None:
+            raise error
+
+    def close(self):
+        for table_id, (game, observe) in self._tables.items():
+            game.observers.remove(observe)
+        self._tables.clear()
+        if self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join()
+        self._connection.close()
+        self._raise()
+
+    def stats(self):
+        """Returns the moves committed and the commits so far, with the
+        moves per commit and per second spent writing."""
+        with self._done:
+            return {
+                'moves': self.moves,
+                'commits': self.commits,
+                'moves_per_commit': self.moves / float(self.commits or 1),
+                'moves_per_second': (self.moves / self.seconds
+                                     if self.seconds else 0.0),
+            }
+
+    def last_table_id(self):
+        """Returns the highest table id journaled, or 0."""
+        self.flush()
+        connection = sqlite3.connect(self.path)
+        try:
+            return connection.execute(
+                'SELECT COALESCE(MAX(id), 0) FROM tables').fetchone()[0]
+        finally:
+            connection.close()
+
+    def recover(self, player_class=Player):
+        """Returns the games of the open tables by table id, each played up
+        to its last committed move by new ``player_class`` players.
+
+        Tables that can't be replayed are left out and put in ``broken``
+        with the error.
+        """
+        self.flush()
+        connection = sqlite3.connect(self.path)
+        try:
+            tables = connection.execute(
+                'SELECT id, seed, compact, players FROM tables '
+                'WHERE ended = 0 ORDER BY id').fetchall()
+            rows = connection.execute(
+                'SELECT table_id, move, change, bid FROM moves '
+                'JOIN tables ON tables.id = moves.table_id '
+                'WHERE ended = 0 ORDER BY table_id, number').fetchall()
+        finally:
+            connection.close()
+
+        cards, actions, seats = decode_moves(
+            np.array([row[1] for row in rows], np.int64))
+        logs = {}
+        offset = 0
+        for table_id, group in groupby(rows, lambda row: row[0]):
+            logs[table_id] = offset, len(list(group))
+            offset += logs[table_id][1]
+
+        games = {}
+        for table_id, seed, compact, players in tables:
+            start, count = logs.get(table_id, (0, 0))
+            log = []
+            try:
+                for row in xrange(start, start + count):
+                    card = CARDS[cards[row]]
+                    if not compact:
+                        card = card.to_dict()
+                    change, bid = rows[row][2:]
+                    if change is not None:
+                        change = decode_change(card, change)
+                    log.append(Move(int(seats[row]), card,
+                                    int(actions[row]), change, bid))
+                games[table_id] = Game.restore(
+                    [player_class() for _ in xrange(players)], log,
+                    seed=seed + SEED_BIAS, compact=bool(compact))
+            except Exception as error:
+                self.broken[table_id] = error
+        return games
@@ -0,0 +1,209 @@
+"""Batched decisions for model-driven players.
+
+Instead of asking a player for every move, PolicyRunner collects the next
+decision of many games into one batch: a row of FEATURES and the mask of
+valid ACTIONS for every card the active player could play (each distinct
+public card in the public phase). The policy scores all rows in a single
+call, and each game plays its best scoring valid (card, action) pair.
+
+    runner = PolicyRunner(RandomPolicy(seed=1), games)
+    winners = runner.run()
+
+Only the seats taken by a PolicyPlayer are batched, the other players
+play their turns as usual.
+"""
+from collections import namedtuple
+
+import numpy as np
+
+from libros.auction import max_bid
+from libros.game import (
+    Card, Player, CARDS, COLORS, TYPES, ACTIONS,
+    ACTION_TAKE_CARD, ACTION_PILE_CARD, ACTION_SHOW_CARD, ACTION_BID_CARD,
+)
+
+
+FEATURES = (
+    ('turn', 'public', 'auction', 'seat', 'players', 'turns_left', 'deck',
+     'pile', 'public_cards', 'auction_gold', 'leading', 'gold', 'taken_take',
+     'taken_pile', 'taken_show') +
+    tuple('dice_' + color for color in COLORS) +
+    tuple('hand_' + kind for kind in TYPES) +
+    tuple('rival_' + kind for kind in TYPES) +
+    tuple('card_' + kind for kind in TYPES) +
+    ('card_value', 'card_letter'))
+
+# the card features of each card, they come last
+CARD_FEATURES = tuple(
+    tuple(float(card.type == kind) for kind in TYPES) +
+    (card.value, ord(card.letter) - ord('A') + 1 if card.letter else 0)
+    for card in CARDS)
+
+ACTION_BITS = np.array([1 << action for action in ACTIONS], np.uint8)
+
+Decisions = namedtuple('Decisions', ['games', 'rows', 'cards', 'features',
+                                     'masks'])
+
+
+def _game_features(game, player):
+    seat = game.seat
+    taken = game.actions_taken
+    totals = [[scores[kind].value if kind in scores else 0 for kind in TYPES]
+              for scores in [other.scores for other in game.players]]
+    features = [
+        game.state == 'turn', game.state == 'public',
+        game.state == 'auction', seat, game.player_count,
+        game.player_turns_left, game.deck_count, game.pile_count,
+        game.public_count, game.auction_gold,
+        game.auction_card is not None and game.auction_bidder is player,
+        max_bid(player), taken[ACTION_TAKE_CARD],
+        taken[ACTION_PILE_CARD], taken[ACTION_SHOW_CARD],
+    ]
+    features.extend(game.dice[color] for color in COLORS)
+    features.extend(totals[seat])
+    features.extend(map(max, zip(*(totals[:seat] + totals[seat + 1:]))))
+    return features
+
+
+def _candidates(game):
+    """Returns the cards the active player could get from turn()."""
+    if game.state == 'turn':
+        return [game.deck[-1]]
+    if game.state == 'public':
+        cards, seen = [], set()
+        for card in game.public:
+            key = Card.from_dict(card).key
+            if key not in seen:
+                seen.add(key)
+                cards.append(card)
+        return cards
+    if game.auction_card is None:
+        return [game.pile[-1]]
+    return [game.auction_card]
+
+
+def collect(games):
+    """Returns the Decisions of the active players of unfinished ``games``.
+
+    ``rows`` is the index in ``games`` of each row and ``cards`` its card.
+    """
+    games = [game for game in games if game.state != 'end']
+    rows, cards, features, masks = [], [], [], []
+    for index, game in enumerate(games):
+        player = game.active_player
+        shared = _game_features(game, player)
+        fresh = game.state == 'auction' and game.auction_card is None
+        for card in _candidates(game):
+            rows.append(index)
+            cards.append(card)
+            features.append(shared + list(
+                CARD_FEATURES[Card.from_dict(card).index]))
+            # turn() puts a fresh card up for auction without a bidder
+            masks.append(1 << ACTION_BID_CARD if fresh else
+                         game.valid_actions_mask(player, card))
+    masks = np.array(masks, np.uint8)
+    return Decisions(
+        games, np.array(rows, np.intp), cards,
+        np.array(features, np.float32).reshape(len(rows), len(FEATURES)),
+        masks[:, None] & ACTION_BITS != 0)
+
+
+def choose(decisions, scores):
+    """Returns the best row of each game and the best action of each row.
+
+    Invalid actions are never chosen, whatever their score.
+    """
+    scores = np.where(decisions.masks, scores, -np.inf)
+    actions = scores.argmax(axis=1)
+    values = scores[np.arange(len(actions)), actions]
+    # best row first within each game, ties to the earlier row
+    order = np.lexsort((-values, decisions.rows))
+    rows = decisions.rows[order]
+    first = np.ones(len(order), np.bool_)
+    first[1:] = rows[1:] != rows[:-1]
+    return order[first], actions
+
+
+def dispatch(decisions, best_rows, actions, bids=None):
+    """Plays the chosen turn of every game of ``decisions``."""
+    for row in best_rows:
+        game = decisions.games[decisions.rows[row]]
+        public_card = decisions.cards[row] if game.state == 'public' else None
+        player, card, _ = game.turn(public_card)
+        action = int(actions[row])
+        bid_gold = None
+        if action == ACTION_BID_CARD and bids is not None:
+            bid_gold = int(bids[row])
+        player.act(card, action, bid_gold=bid_gold)
+
+
+class Policy(object):
+    """Scores a batch of decisions, see FEATURES for the columns."""
+
+    def scores(self, features, masks):
+        """Returns a score per row and action, the highest valid one is
+        played."""
+        raise NotImplementedError()
+
+    def bids(self, features, max_gold):
+        """Returns the gold bid on each row, from 0 to ``max_gold``."""
+        return np.minimum(1, max_gold)
+
+
+class RandomPolicy(Policy):
+    def __init__(self, seed=None):
+        self.random = np.random.RandomState(seed)
+
+    def scores(self, features, masks):
+        return self.random.random_sample(masks.shape)
+
+    def bids(self, features, max_gold):
+        return (self.random.random_sample(len(max_gold)) *
+                (max_gold + 1)).astype(np.int64)
+
+
+class PolicyPlayer(Player):
+    """A seat whose decisions PolicyRunner makes in batches.
+
+    Played on its own it behaves like a Player.
+    """
+
+
+class PolicyRunner(object):
+    """Plays ``games`` to the end, one batched decision at a time."""
+
+    def __init__(self, policy, games):
+        self.policy = policy
+        self.games = list(games)
+        self.decisions = 0
+        self.batches = 0
+
+    def step(self):
+        """Plays the other seats up to a PolicyPlayer in every game and
+        then one batched decision. Returns the games that decided."""
+        waiting = []
+        for game in self.games:
+            while (game.state != 'end' and
+                   not isinstance(game.active_player, PolicyPlayer)):
+                game.play_turn()
+            if game.state != 'end':
+                waiting.append(game)
+        if not waiting:
+            return 0
+
+        decisions = collect(waiting)
+        features = decisions.features
+        scores = self.policy.scores(features, decisions.masks)
+        best_rows, actions = choose(decisions, scores)
+        max_gold = features[:, FEATURES.index('gold')].astype(np.int64)
+        bids = np.clip(self.policy.bids(features, max_gold), 0, max_gold)
+        dispatch(decisions, best_rows, actions, bids)
+        self.decisions += len(waiting)
+        self.batches += 1
+        return len(waiting)
+
+    def run(self):
+        """Plays every game to the end and returns the winners."""
+        while self.step():
+            pass
+        return [game.winner() for game in self.games]
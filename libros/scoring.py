@@ -0,0 +1,98 @@
+"""Scoring of a game from the players' running hand totals.
+
+Each color goes to the player with the highest ValueLetter total and is
+worth the value of its die. Ties on points go to the highest gold total,
+then to the holder of the first color in TIEBREAK_COLORS, then the next
+one, and anything still tied goes to the earlier seat. All of that is
+packed into one int per player (see rank_key()) so ranking is a plain
+comparison of ints.
+"""
+from collections import namedtuple
+
+
+COLORS = ('blue', 'brown', 'red', 'orange', 'green')
+
+TIEBREAK_COLORS = ('brown', 'blue', 'green', 'orange', 'red')
+
+ValueLetter = namedtuple('ValueLetter', ['value', 'letter'])
+
+NO_SCORE = ValueLetter(0, None)
+
+Standing = namedtuple('Standing', ['player', 'points', 'gold', 'colors'])
+
+Scores = namedtuple('Scores', ['standings', 'holders', 'margins', 'points'])
+
+# the first tiebreak color is the highest bit
+TIEBREAK_BITS = {color: 1 << (len(TIEBREAK_COLORS) - 1 - i)
+                 for i, color in enumerate(TIEBREAK_COLORS)}
+BIT_COLORS = tuple(
+    tuple(color for color in TIEBREAK_COLORS if bits & TIEBREAK_BITS[color])
+    for bits in xrange(1 << len(TIEBREAK_COLORS)))
+
+GOLD_BITS = 10
+SEAT_BITS = 2
+
+
+def rank_key(points, gold, bits, seat):
+    """Returns an int ordering players like the tiebreak rules do."""
+    key = (points << GOLD_BITS | gold) << len(TIEBREAK_COLORS) | bits
+    return key << SEAT_BITS | (1 << SEAT_BITS) - 1 - seat
+
+
+def _tally(hands, dice):
+    """Returns the points, won color bits, holder seats and margins."""
+    points = [0] * len(hands)
+    bits = [0] * len(hands)
+    holders = {}
+    margins = {}
+    for color in COLORS:
+        best = second = NO_SCORE
+        holder = None
+        for seat, scores in enumerate(hands):
+            score = scores.get(color, NO_SCORE)
+            if score > best:
+                best, second, holder = score, best, seat
+            elif score > second:
+                second = score
+        if holder is not None:
+            holders[color] = holder
+            margins[color] = best.value - second.value
+            points[holder] += dice[color]
+            bits[holder] |= TIEBREAK_BITS[color]
+    return points, bits, holders, margins
+
+
+def _keys(hands, points, bits):
+    return [rank_key(points[seat], scores.get('gold', NO_SCORE).value,
+                     bits[seat], seat)
+            for seat, scores in enumerate(hands)]
+
+
+def evaluate(players, dice):
+    """Returns the Scores of ``players``: the Standing of every player,
+    leader first, and the holder seat and winning margin of each color."""
+    hands = [player.scores for player in players]
+    points, bits, holders, margins = _tally(hands, dice)
+    keys = _keys(hands, points, bits)
+    ranking = sorted(xrange(len(players)), key=keys.__getitem__,
+                     reverse=True)
+    standings = [Standing(players[seat], points[seat],
+                          players[seat].scores.get('gold', NO_SCORE).value,
+                          BIT_COLORS[bits[seat]])
+                 for seat in ranking]
+    return Scores(standings, holders, margins, points)
+
+
+def winner_seat(players, dice):
+    """Returns the seat of the winner, or None without players."""
+    return hands_winner([player.scores for player in players], dice)
+
+
+def hands_winner(hands, dice):
+    """Returns the seat of the winner from the ``scores`` dict of every
+    player, or None without players."""
+    if not hands:
+        return None
+    points, bits, _, _ = _tally(hands, dice)
+    keys = _keys(hands, points, bits)
+    return keys.index(max(keys))
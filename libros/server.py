@@ -0,0 +1,300 @@
+"""Game server hosting many tables in one process.
+
+Every table owns a greenlet that takes the moves sent to it one at a time
+from its inbox, so a table never needs a lock and a slow table or client
+never holds up the others. Clients get the per-seat deltas of every move
+(see libros.delta) on bounded queues; a client that falls too far behind
+is sent the full table state instead of the messages it missed. With a
+Journal (see libros.persistence) the tables are journaled as they play
+and recover_tables() hosts the open ones again after a restart. With a
+TurnClock (see libros.clock) a seat that takes too long to move gets a
+default move played for it.
+"""
+import time
+
+from collections import deque, namedtuple
+
+import gevent
+
+from gevent.event import AsyncResult
+from gevent.queue import Queue, Full
+
+from libros.delta import DeltaStream
+from libros.game import (
+    Game, Player, COLORS, ACTION_BID_CARD, ACTION_USE_CARD,
+)
+
+
+Request = namedtuple('Request', [
+    'seat', 'action', 'public_card', 'change_colors', 'bid_gold'])
+
+# the turn clock ran out on the move after table version ``version``
+Timeout = namedtuple('Timeout', ['version'])
+
+
+def card_dict(card):
+    return {'type': card['type'], 'value': card['value'],
+            'letter': card['letter']}
+
+
+def check_change_colors(card, colors):
+    """Raises ValueError unless ``colors`` is a valid use of the change
+    ``card``, see Game.use_change_card()."""
+    if (not isinstance(colors, (list, tuple)) or
+            len(colors) != max(abs(card['value']), 1)):
+        raise ValueError('Wrong number of colors.')
+    for color in colors:
+        if not isinstance(color, basestring):
+            raise ValueError('Unknown color.')
+        if card['value'] == 0:
+            # the plus or minus card names its direction
+            if color[:1] not in ('+', '-'):
+                raise ValueError('Missing + or - before the color.')
+            color = color[1:]
+        if color not in COLORS:
+            raise ValueError('Unknown color.')
+
+
+class Table(object):
+    """A hosted game and the greenlet that plays the moves sent to it."""
+
+    def __init__(self, server, table_id, game, resync_interval=100):
+        self.server = server
+        self.id = table_id
+        self.game = game
+        self.stream = DeltaStream(game, resync_interval)
+        self.pending = None
+        self.clients = {}
+        self.inbox = Queue()
+        self.timeouts = 0
+        self.greenlet = gevent.spawn(self._run)
+
+    def submit(self, request):
+        result = AsyncResult()
+        self.inbox.put((request, result, time.time()))
+        return result
+
+    @property
+    def version(self):
+        return self.stream.version
+
+    def timeout(self, version):
+        """Plays a default move for the active seat, unless the table has
+        moved on from ``version`` by then."""
+        return self.submit(Timeout(version))
+
+    def stop(self):
+        self.inbox.put(None)
+
+    def _run(self):
+        self._prompt()
+        for item in self.inbox:
+            if item is None:
+                break
+            request, result, received = item
+            try:
+                if isinstance(request, Timeout):
+                    self._default_move(request.version)
+                else:
+                    self._play(request)
+            except Exception as error:
+                # a bad request must never take the table down
+                result.set_exception(error)
+            else:
+                result.set(self.version)
+            if not isinstance(request, Timeout):
+                self.server.record_latency(time.time() - received)
+        self.stream.close()
+
+    def _play(self, request):
+        game = self.game
+        if game.state == 'end':
+            raise ValueError('The game is over.')
+        if request.seat != game.seat:
+            raise ValueError('It is not your turn.')
+
+        if self.pending is None:
+            # public phase, the player picks the card with the move
+            if not 0 <= request.public_card < game.public_count:
+                raise ValueError('No such public card.')
+            public_card = game.public[request.public_card]
+            player, card, actions = game.turn(public_card)
+        else:
+            player, card, actions = self.pending
+        if request.action not in actions:
+            raise ValueError('Invalid action.')
+        colors = request.change_colors
+        if request.action == ACTION_USE_CARD and colors:
+            check_change_colors(card, colors)
+
+        player.act(card, request.action, change_colors=colors,
+                   bid_gold=request.bid_gold)
+        self.pending = None
+        self._prompt()
+
+    def _default_move(self, version):
+        game = self.game
+        if version != self.version or game.state == 'end':
+            return
+        public_card = None
+        if self.pending is None:
+            public_card = 0
+            player, card = game.active_player, game.public[0]
+            actions = game.valid_actions(player, card)
+        else:
+            player, card, actions = self.pending
+        # pass on auction bids, otherwise play like a Player
+        colors = bid_gold = None
+        if ACTION_BID_CARD in actions:
+            action, bid_gold = ACTION_BID_CARD, 0
+        else:
+            action = player.choose_action(card, actions)
+            if action == ACTION_USE_CARD:
+                colors = player.choose_change_colors(card)
+        self.timeouts += 1
+        self._play(Request(game.seat, action, public_card, colors, bid_gold))
+
+    def _prompt(self):
+        game = self.game
+        if game.state not in ('end', 'public'):
+            self.pending = game.turn()
+        for seat, message in self.stream.flush().iteritems():
+            self.send(seat, message)
+        if self.server.clock is not None:
+            self.server.clock.restart(self)
+
+        if game.state == 'end':
+            self.broadcast({'type': 'end', 'version': self.version,
+                            'winner': game.players.index(game.winner())})
+            return
+        if game.state == 'public':
+            message = {'public': [card_dict(card) for card in game.public]}
+        else:
+            player, card, actions = self.pending
+            message = {'card': card_dict(card), 'actions': list(actions)}
+        message.update(type='prompt', version=self.version, seat=game.seat)
+        self.send(game.seat, message)
+
+    def full_state(self, seat):
+        state = self.stream.full_state(seat)
+        if seat == self.game.seat and self.pending is not None:
+            player, card, actions = self.pending
+            state.update(card=card_dict(card), actions=list(actions))
+        return state
+
+    def send(self, seat, message):
+        for client in self.clients.get(seat, ()):
+            client.deliver(message)
+
+    def broadcast(self, message):
+        for clients in self.clients.itervalues():
+            for client in clients:
+                client.deliver(message)
+
+
+class Client(object):
+    """In-process connection of one seat at a table.
+
+    A transport (e.g. a socket namespace) forwards ``receive()`` to the
+    remote end and calls ``move()`` with what it sends back.
+    """
+
+    def __init__(self, table, seat, queue_size):
+        self.table = table
+        self.seat = seat
+        self.messages = Queue(queue_size)
+        self.resyncs = 0
+
+    def deliver(self, message):
+        try:
+            self.messages.put_nowait(message)
+        except Full:
+            # too far behind, replace the backlog with the current state
+            while not self.messages.empty():
+                self.messages.get_nowait()
+            self.resyncs += 1
+            self.messages.put_nowait(self.table.full_state(self.seat))
+
+    def receive(self, timeout=None):
+        return self.messages.get(timeout=timeout)
+
+    def move(self, action, public_card=None, change_colors=None,
+             bid_gold=None, timeout=None):
+        """Sends a move and waits for the table version it produced."""
+        result = self.table.submit(Request(
+            self.seat, action, public_card, change_colors, bid_gold))
+        return result.get(timeout=timeout)
+
+
+class GameServer(object):
+    """Owns the tables of one process and tracks their move latency."""
+
+    def __init__(self, queue_size=256, latency_samples=100000, journal=None,
+                 clock=None):
+        self.tables = {}
+        self.queue_size = queue_size
+        self.journal = journal
+        self.clock = clock
+        self.latencies = deque(maxlen=latency_samples)
+        self.moves = 0
+        self._next_id = 0
+        if journal is not None:
+            # never reuse the id of a journaled table
+            self._next_id = journal.last_table_id()
+
+    def create_table(self, players=2, seed=None):
+        self._next_id += 1
+        game = Game.new([Player() for _ in xrange(players)], compact=True,
+                        seed=seed)
+        if self.journal is not None:
+            self.journal.open_table(self._next_id, game)
+        table = self.tables[self._next_id] = Table(self, self._next_id, game)
+        return table
+
+    def recover_tables(self):
+        """Hosts the open tables of the journal again, as they were after
+        their last committed move. Returns the tables."""
+        tables = []
+        for table_id, game in sorted(self.journal.recover().iteritems()):
+            self.journal.open_table(table_id, game, len(game.log))
+            table = self.tables[table_id] = Table(self, table_id, game)
+            tables.append(table)
+        return tables
+
+    def connect(self, table_id, seat):
+        table = self.tables[table_id]
+        assert 0 <= seat < table.game.player_count
+        client = Client(table, seat, self.queue_size)
+        table.clients.setdefault(seat, []).append(client)
+        client.deliver(table.full_state(seat))
+        return client
+
+    def disconnect(self, client):
+        client.table.clients[client.seat].remove(client)
+
+    def close_table(self, table_id):
+        self._stop_table(table_id)
+        if self.journal is not None:
+            self.journal.close_table(table_id)
+
+    def stop(self):
+        """Stops every table, they stay open in the journal."""
+        for table_id in list(self.tables):
+            self._stop_table(table_id)
+
+    def _stop_table(self, table_id):
+        self.tables.pop(table_id).stop()
+        if self.clock is not None:
+            self.clock.cancel(table_id)
+
+    def record_latency(self, latency):
+        self.moves += 1
+        self.latencies.append(latency)
+
+    def latency_percentile(self, percentile):
+        """Returns the move latency in seconds at ``percentile`` (0-100)."""
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        index = min(len(ordered) - 1, int(len(ordered) * percentile / 100.0))
+        return ordered[index]
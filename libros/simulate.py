@@ -0,0 +1,181 @@
+"""Headless self-play: runs many seeded games across a process pool.
+
+    python -m libros.simulate --games 100000 --players 3 --processes 8
+
+With ``--store`` every game is also appended to a libros.store file.
+"""
+import argparse
+import importlib
+import json
+import sys
+import time
+
+from collections import Counter
+from multiprocessing import Pool, cpu_count
+
+from libros.game import Game, Player, COLORS, ACTION_BID_CARD, split_seed
+from libros.store import StoreWriter, game_records
+
+
+class Stats(object):
+    """Aggregate results of a batch of games, mergeable across workers."""
+
+    def __init__(self, players=0):
+        self.players = players
+        self.games = 0
+        self.wins = Counter()
+        self.dice = {color: Counter() for color in COLORS}
+        self.prices = Counter()
+        # RECORD_DTYPE array of the games when the chunk is being stored
+        self.records = None
+
+    def add(self, game, prices):
+        self.games += 1
+        self.wins[game.players.index(game.winner())] += 1
+        for color, value in game.dice.iteritems():
+            self.dice[color][value] += 1
+        self.prices.update(prices)
+
+    def update(self, other):
+        self.players = max(self.players, other.players)
+        self.games += other.games
+        self.wins.update(other.wins)
+        for color in COLORS:
+            self.dice[color].update(other.dice[color])
+        self.prices.update(other.prices)
+
+    @property
+    def win_rates(self):
+        if not self.games:
+            return [0.0] * self.players
+        return [self.wins[seat] / float(self.games)
+                for seat in xrange(self.players)]
+
+    def as_dict(self):
+        return {
+            'games': self.games,
+            'win_rates': self.win_rates,
+            'dice': {color: dict(counts)
+                     for color, counts in self.dice.iteritems()},
+            'prices': dict(self.prices),
+        }
+
+
+def play_game(seed, policies):
+    """Plays one full game, returns it with the auction prices paid."""
+    game = Game.new([policy() for policy in policies], compact=True,
+                    seed=seed)
+
+    prices = []
+    while game.state != 'end':
+        state = game.state
+        player, card, action = game.play_turn()
+        if state == 'auction' and action != ACTION_BID_CARD:
+            # the highest bidder is now doing something with the card
+            prices.append(game.auction_gold)
+    return game, prices
+
+
+def _run_chunk(args):
+    seed, games, policies, records = args
+    stats = Stats(len(policies))
+    results = []
+    for index in games:
+        game, prices = play_game(split_seed(seed, index), policies)
+        stats.add(game, prices)
+        if records:
+            results.append((game, prices))
+    if records:
+        stats.records = game_records(results)
+    return stats
+
+
+def _chunks(games, seed, chunk_size, policies, records):
+    for start in xrange(0, games, chunk_size):
+        yield (seed, xrange(start, min(start + chunk_size, games)), policies,
+               records)
+
+
+def simulate_iter(games, players=2, policies=None, seed=0, processes=None,
+                  chunk_size=200, records=False):
+    """Plays ``games`` games and yields a Stats per finished chunk.
+
+    Game ``i`` is seeded with ``split_seed(seed, i)`` so runs are
+    reproducible whatever the number of processes. ``policies`` holds one
+    Player class per seat. With ``records`` each Stats also carries the
+    store records of its games.
+    """
+    if policies is None:
+        policies = [Player] * players
+    assert len(policies) == players
+
+    chunks = _chunks(games, seed, chunk_size, tuple(policies), records)
+    if processes == 1:
+        for chunk in chunks:
+            yield _run_chunk(chunk)
+        return
+
+    pool = Pool(processes or cpu_count())
+    try:
+        for stats in pool.imap_unordered(_run_chunk, chunks):
+            yield stats
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def simulate(games, players=2, policies=None, seed=0, processes=None,
+             chunk_size=200):
+    """Plays ``games`` games and returns the merged Stats."""
+    total = Stats(players)
+    for stats in simulate_iter(games, players, policies, seed, processes,
+                               chunk_size):
+        total.update(stats)
+    return total
+
+
+def load_policy(spec):
+    """Imports a Player class given as ``package.module:Class``."""
+    module, _, name = spec.partition(':')
+    return getattr(importlib.import_module(module), name)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Libros self-play.')
+    parser.add_argument('-n', '--games', type=int, default=1000)
+    parser.add_argument('-p', '--players', type=int, default=2,
+                        choices=[2, 3, 4])
+    parser.add_argument('-j', '--processes', type=int, default=None)
+    parser.add_argument('-s', '--seed', type=int, default=0)
+    parser.add_argument('--chunk-size', type=int, default=200)
+    parser.add_argument('--policy', action='append', default=[],
+                        help='module:Class per seat, repeated for each seat')
+    parser.add_argument('--store', help='game store file to append to')
+    args = parser.parse_args(argv)
+
+    policies = [load_policy(spec) for spec in args.policy] or None
+    if policies and len(policies) == 1:
+        policies = policies * args.players
+
+    total = Stats(args.players)
+    writer = args.store and StoreWriter(args.store)
+    started = time.time()
+    for stats in simulate_iter(args.games, args.players, policies, args.seed,
+                               args.processes, args.chunk_size,
+                               records=bool(writer)):
+        total.update(stats)
+        if writer:
+            writer.extend(stats.records)
+        elapsed = time.time() - started
+        sys.stderr.write('%d/%d games, %.0f games/s, win rates %s\n' % (
+            total.games, args.games, total.games / max(elapsed, 1e-9),
+            ' '.join('%.3f' % rate for rate in total.win_rates)))
+
+    if writer:
+        writer.close()
+    json.dump(total.as_dict(), sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,286 @@
+"""Append-only on-disk store of finished self-play games.
+
+Every game is one fixed size RECORD_DTYPE record after a short header, so
+a file of millions of games is opened as a single numpy.memmap and every
+field is a column view of it (``store.records['winner']``) that numpy
+queries page in as needed, without building a Python object per game.
+
+    with StoreWriter('games.db') as writer:
+        writer.add(game, prices)
+    GameStore('games.db').win_rates(3)
+"""
+import os
+
+import numpy as np
+
+from libros.game import Card, COLORS, ACTION_USE_CARD
+
+
+STORE_MAGIC = 'LIBROSDB'
+STORE_VERSION = 1
+
+MAX_PLAYERS = 4
+MAX_MOVES = 256
+MAX_AUCTIONS = 32
+MAX_CHANGES = 9
+
+HEADER_DTYPE = np.dtype([
+    ('magic', 'S8'), ('version', '<u4'), ('record_size', '<u4')])
+
+# moves beyond MAX_MOVES (or auctions beyond MAX_AUCTIONS) are not kept,
+# the counts are, so readers clip them with np.minimum()
+RECORD_DTYPE = np.dtype([
+    ('seed', '<u8'),
+    ('players', 'u1'),
+    ('winner', 'u1'),
+    ('move_count', '<u2'),
+    ('auction_count', 'u1'),
+    ('change_count', 'u1'),
+    ('dice', 'i1', (len(COLORS),)),
+    ('points', '<i2', (MAX_PLAYERS,)),
+    ('gold', '<i2', (MAX_PLAYERS,)),
+    ('prices', 'u1', (MAX_AUCTIONS,)),
+    ('changes', 'u1', (MAX_CHANGES,)),
+    ('moves', '<u2', (MAX_MOVES,)),
+])
+
+# a move is card index | action << 7 | seat << 10, a change card use is
+# the mask of COLORS bits it changed, plus MINUS_FLAG when it lowered them
+ACTION_SHIFT, SEAT_SHIFT = 7, 10
+CARD_MASK, ACTION_MASK = 0x7f, 0x7
+MINUS_FLAG = 0x20
+
+SEED_INDEX_DTYPE = np.dtype([('seed', '<u8'), ('record', '<u4')])
+
+
+def encode_move(move):
+    return (Card.from_dict(move.card).index | move.action << ACTION_SHIFT |
+            move.seat << SEAT_SHIFT)
+
+
+def decode_moves(moves):
+    """Returns the card index, action and seat arrays of encoded moves."""
+    moves = np.asarray(moves)
+    return (moves & CARD_MASK, moves >> ACTION_SHIFT & ACTION_MASK,
+            moves >> SEAT_SHIFT)
+
+
+def encode_change(card, colors):
+    value = card['value']
+    if not colors:
+        return 0
+    if value == 0:
+        minus = colors[0][0] == '-'
+        colors = [colors[0][1:]]
+    else:
+        minus = value < 0
+    mask = 0
+    for color in colors:
+        mask |= 1 << COLORS.index(color)
+    return mask | (MINUS_FLAG if minus else 0)
+
+
+def decode_change(card, mask):
+    """Returns the colors of a change card use made by encode_change()."""
+    colors = [color for bit, color in enumerate(COLORS) if mask >> bit & 1]
+    if card['value'] == 0 and colors:
+        return [('-' if mask & MINUS_FLAG else '+') + colors[0]]
+    return colors
+
+
+def fill_record(record, game, prices):
+    """Writes a finished ``game`` and its auction ``prices`` to ``record``."""
+    players = game.players
+    record['seed'] = game.seed
+    record['players'] = len(players)
+    record['winner'] = players.index(game.winner())
+    record['dice'] = [game.dice[color] for color in COLORS]
+    for standing in game.standings():
+        seat = players.index(standing.player)
+        record['points'][seat] = standing.points
+        record['gold'][seat] = standing.gold
+
+    record['auction_count'] = len(prices)
+    prices = [min(price, 0xff) for price in prices[:MAX_AUCTIONS]]
+    record['prices'][:len(prices)] = prices
+
+    log = game.log
+    record['move_count'] = len(log)
+    moves = [encode_move(move) for move in log[:MAX_MOVES]]
+    record['moves'][:len(moves)] = moves
+    changes = [encode_change(move.card, move.change_colors)
+               for move in log if move.action == ACTION_USE_CARD]
+    record['change_count'] = len(changes)
+    record['changes'][:len(changes)] = changes[:MAX_CHANGES]
+
+
+def game_records(results):
+    """Returns a RECORD_DTYPE array of ``(game, prices)`` pairs."""
+    results = list(results)
+    records = np.zeros(len(results), RECORD_DTYPE)
+    for record, (game, prices) in zip(records, results):
+        fill_record(record, game, prices)
+    return records
+
+
+def _header():
+    return np.array([(STORE_MAGIC, STORE_VERSION, RECORD_DTYPE.itemsize)],
+                    HEADER_DTYPE)
+
+
+def _check_header(header):
+    if (header['magic'] != STORE_MAGIC or
+            header['version'] != STORE_VERSION or
+            header['record_size'] != RECORD_DTYPE.itemsize):
+        raise ValueError('Unsupported game store.')
+
+
+class StoreWriter(object):
+    """Appends games to a store, ``buffer_size`` records at a time.
+
+    A record cut short by a crash is dropped when the store is reopened.
+    """
+
+    def __init__(self, path, buffer_size=1024):
+        self.path = path
+        self.file = open(path, 'a+b')
+        self.file.seek(0, os.SEEK_END)
+        size = self.file.tell()
+        if size < HEADER_DTYPE.itemsize:
+            self.file.truncate(0)
+            self.file.write(_header().tobytes())
+        else:
+            self.file.seek(0)
+            _check_header(np.frombuffer(
+                self.file.read(HEADER_DTYPE.itemsize), HEADER_DTYPE)[0])
+            records = ((size - HEADER_DTYPE.itemsize) //
+                       RECORD_DTYPE.itemsize)
+            self.file.truncate(
+                HEADER_DTYPE.itemsize + records * RECORD_DTYPE.itemsize)
+        self.buffer = np.zeros(buffer_size, RECORD_DTYPE)
+        self.count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def add(self, game, prices):
+        if self.count == len(self.buffer):
+            self.flush()
+        fill_record(self.buffer[self.count], game, prices)
+        self.count += 1
+
+    def extend(self, records):
+        """Appends a RECORD_DTYPE array, e.g. from game_records()."""
+        self.flush()
+        self.file.write(np.ascontiguousarray(records, RECORD_DTYPE).tobytes())
+
+    def flush(self):
+        if self.count:
+            self.file.write(self.buffer[:self.count].tobytes())
+            self.buffer[:self.count] = np.zeros((), RECORD_DTYPE)
+            self.count = 0
+        self.file.flush()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+class GameStore(object):
+    """Read-only view of a store with indexes by seed and winner.
+
+    The seed index is kept next to the store in ``<path>.seeds`` when the
+    directory is writable, and is rebuilt whenever the store has changed
+    since it was written.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        _check_header(np.fromfile(path, HEADER_DTYPE, count=1)[0])
+        count = ((os.path.getsize(path) - HEADER_DTYPE.itemsize) //
+                 RECORD_DTYPE.itemsize)
+        if count:
+            self.records = np.memmap(path, RECORD_DTYPE, 'r',
+                                     offset=HEADER_DTYPE.itemsize,
+                                     shape=(count,))
+        else:
+            self.records = np.zeros(0, RECORD_DTYPE)
+        self._seeds = None
+        self._winners = None
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, index):
+        return self.records[index]
+
+    @property
+    def seed_index(self):
+        if self._seeds is None:
+            path = self.path + '.seeds'
+            try:
+                # older than the store means the store changed since
+                if os.path.getmtime(path) < os.path.getmtime(self.path):
+                    index = None
+                else:
+                    index = np.load(path, mmap_mode='r')
+            except (IOError, OSError, ValueError):
+                index = None
+            if index is None or len(index) != len(self):
+                index = np.empty(len(self), SEED_INDEX_DTYPE)
+                order = np.argsort(self.records['seed'], kind='mergesort')
+                index['seed'] = self.records['seed'][order]
+                index['record'] = order
+                try:
+                    with open(path, 'wb') as output:
+                        np.save(output, index)
+                except (IOError, OSError):
+                    # e.g. a read-only mount, keep the index in memory
+                    pass
+            self._seeds = index
+        return self._seeds
+
+    def find(self, seed):
+        """Returns the record numbers of the games played with ``seed``."""
+        index = self.seed_index
+        seed = np.uint64(seed)
+        start = np.searchsorted(index['seed'], seed, 'left')
+        end = np.searchsorted(index['seed'], seed, 'right')
+        return np.array(index['record'][start:end], dtype=np.intp)
+
+    def won_by(self, seat):
+        """Returns the record numbers of the games won by ``seat``."""
+        if self._winners is None:
+            winners = self.records['winner']
+            order = np.argsort(winners, kind='mergesort')
+            bounds = np.searchsorted(winners[order],
+                                     np.arange(MAX_PLAYERS + 1))
+            self._winners = order, bounds
+        order, bounds = self._winners
+        return order[bounds[seat]:bounds[seat + 1]]
+
+    def win_rates(self, players):
+        """Returns the share of ``players`` player games won by each seat."""
+        winners = self.records['winner'][self.records['players'] == players]
+        if not len(winners):
+            return np.zeros(players)
+        return np.bincount(winners, minlength=players) / float(len(winners))
+
+    def auction_prices(self):
+        """Returns the price of every auction of every game."""
+        count = np.minimum(self.records['auction_count'], MAX_AUCTIONS)
+        kept = np.arange(MAX_AUCTIONS) < count[:, None]
+        return self.records['prices'][kept]
+
+    def die_changes(self):
+        """Returns how often change cards raised and lowered each color,
+        as two arrays in COLORS order."""
+        count = np.minimum(self.records['change_count'], MAX_CHANGES)
+        changes = self.records['changes'][
+            np.arange(MAX_CHANGES) < count[:, None]]
+        bits = changes[:, None] >> np.arange(len(COLORS)) & 1
+        minus = (changes & MINUS_FLAG).astype(bool)
+        return bits[~minus].sum(axis=0), bits[minus].sum(axis=0)
@@ -1,14 +1,52 @@
+import math
+import os
+import pickle
 import random
+import shutil
+import sqlite3
+import tempfile
+
+import gevent
+import numpy as np
 
 from mock import patch
 from itertools import repeat
+from multiprocessing import Process
 from unittest import TestCase, skip
 
 from libros.game import (
-    deal, Game, Player,
+    deal, full_deck, Card, Deck, Game, Player, CARDS, CARDS_BY_KEY, COLORS,
+    TIEBREAK_COLORS, TYPES,
     ACTIONS, ACTION_PILE_CARD, ACTION_SHOW_CARD,
-    ACTION_TAKE_CARD, ACTION_DISCARD_CARD,
+    ACTION_TAKE_CARD, ACTION_DISCARD_CARD, ACTION_USE_CARD, ACTION_BID_CARD,
+    VALID_ACTION_MASKS, batch_action_masks, batch_valid_actions, split_seed,
+)
+from libros.auction import bidders, max_bid
+from libros.batch import BatchGame
+from libros.bench import compare, run_benchmarks
+from libros.clock import TimerWheel, TurnClock
+from libros.instrument import Instrumentation
+from libros.delta import DeltaStream, GameView, decode, full_view, view_event
+from libros.endgame import EndgamePlayer, EndgameSolver
+from libros.mcts import MCTSPlayer, legal_moves
+from libros.persistence import Journal
+from libros.policy import (
+    FEATURES, Policy, PolicyPlayer, PolicyRunner, RandomPolicy, collect,
 )
+from libros.server import GameServer
+from libros.simulate import simulate, simulate_iter
+from libros.store import GameStore, StoreWriter, decode_moves, encode_change
+from libros.tournament import (
+    ACCEPT_H0, ACCEPT_H1, SPRT, Tournament, gauntlet, round_robin,
+)
+from libros.tracker import CardTracker
+from libros.zobrist import SharedTranspositionTable, TranspositionTable
+
+
+def start_game(players=2, player_class=Player, **kwargs):
+    """Returns a started Game of ``players`` new ``player_class`` players,
+    ``kwargs`` go to Game()."""
+    return Game.new([player_class() for _ in range(players)], **kwargs)
 
 
 class TestGame(TestCase):
@@ -51,19 +89,12 @@ class TestGame(TestCase):
         self.assertEqual(game.state, 'turn')
 
     def _start_game(self, num_players=2):
-        players = [Player() for i in range(num_players)]
-
-        game = Game()
-
-        for player in players:
-            game.join(player)
-
-        game.start()
+        game = start_game(num_players)
 
         self.assertEqual(game.state, 'turn')
         self.assertEqual(game.player_count, num_players)
 
-        return game, players
+        return game, game.players
 
     def _player_turn(self, game, action=None):
         active_player = game.active_player
@@ -186,6 +217,17 @@ class TestGame(TestCase):
         game.use_change_card(card, ['-blue'])
         self.assertEqual(sum(game.dice.values()), 16)
 
+    def test_plus_minus_change_card(self):
+        game, players = self._start_game()
+        card = {'type': 'change', 'value': 0, 'letter': None}
+        red = game.dice['red']
+
+        game.use_change_card(card, ['+red'])
+        self.assertEqual(game.dice['red'], red + 1)
+
+        game.use_change_card(card, ['-red'])
+        self.assertEqual(game.dice['red'], red)
+
     def test_until_auction_phase_2_players(self):
         game, players = self._start_game(2)
 
@@ -310,3 +352,1426 @@ class TestGame(TestCase):
         # score was too low
         players[2].cards = [{'type': 'brown', 'value': 4, 'letter': 'C'}]
         self.assertEqual(game.winner(), players[1])
+
+    def test_player_score_incremental(self):
+        player = Player()
+        player.cards = [{'type': 'green', 'value': 2, 'letter': 'D'}]
+        player.take_card({'type': 'green', 'value': 1, 'letter': 'A'})
+        player.take_card({'type': 'gold', 'value': 2, 'letter': None})
+        self.assertEqual(player.score_type('green'), (3, 'A'))
+        self.assertEqual(player.score_type('gold'), (2, None))
+        self.assertEqual(len(player.cards), 3)
+
+    def test_standings(self):
+        game, players = self._start_game(3)
+        game.dice = {'green': 2, 'blue': 1, 'red': 4, 'orange': 1, 'brown': 1}
+        players[0].cards = [{'type': 'green', 'value': 2, 'letter': 'D'}]
+        players[1].cards = [{'type': 'red', 'value': 1, 'letter': 'A'},
+                            {'type': 'green', 'value': 1, 'letter': 'A'}]
+        standings = game.standings()
+        self.assertEqual([s.player for s in standings],
+                         [players[1], players[0], players[2]])
+        self.assertEqual([s.points for s in standings], [4, 2, 0])
+        self.assertEqual(standings[0].colors, ('red',))
+
+    def test_scores(self):
+        game, players = self._start_game(3)
+        game.dice = {'green': 2, 'blue': 1, 'red': 4, 'orange': 1, 'brown': 1}
+        players[0].cards = [{'type': 'green', 'value': 2, 'letter': 'D'},
+                            {'type': 'red', 'value': 1, 'letter': 'B'}]
+        players[1].cards = [{'type': 'red', 'value': 1, 'letter': 'A'},
+                            {'type': 'green', 'value': 1, 'letter': 'A'},
+                            {'type': 'gold', 'value': 2, 'letter': None}]
+        scores = game.scores()
+        # equal values go to the later letter
+        self.assertEqual(scores.holders, {'green': 0, 'red': 0})
+        self.assertEqual(scores.margins, {'green': 1, 'red': 0})
+        self.assertEqual(scores.points, [6, 0, 0])
+        self.assertIs(scores.standings[1].player, players[1])
+        self.assertEqual(scores.standings[1].gold, 2)
+
+    def test_ranking_tiebreak(self):
+        def reference(game):
+            won = {player: set() for player in game.players}
+            for color, holder in game.majorities().items():
+                won[holder].add(color)
+            return sorted(
+                game.players, reverse=True, key=lambda player: (
+                    sum(game.dice[color] for color in won[player]),
+                    player.score_type('gold').value,
+                    tuple(c in won[player] for c in TIEBREAK_COLORS),
+                    -game.players.index(player)))
+
+        for seed in range(30):
+            game = start_game(2 + seed % 3, seed=seed, compact=True)
+            game.play()
+            expected = reference(game)
+            self.assertEqual([s.player for s in game.standings()], expected)
+            self.assertIs(game.winner(), expected[0])
+
+    def test_no_players_or_colors(self):
+        game = Game()
+        self.assertIsNone(game.winner())
+        self.assertEqual(game.standings(), [])
+        game, players = self._start_game(2)
+        self.assertIs(game.winner(), players[0])
+        self.assertEqual(game.scores().holders, {})
+
+    def test_seeded_game(self):
+        def play(seed):
+            game = start_game(2, seed=seed)
+            deck = game.deck[:]
+            game.play()
+            return deck, game.dice, [p.cards for p in game.players]
+
+        self.assertEqual(play(42), play(42))
+        self.assertNotEqual(play(42)[0], play(43)[0])
+
+    def test_split_seed(self):
+        self.assertEqual(split_seed(1, 2), split_seed(1, 2))
+        self.assertNotEqual(split_seed(1, 2), split_seed(1, 3))
+        game = Game(seed=7)
+        self.assertEqual(game.spawn_random('bot').random(),
+                         Game(seed=7).spawn_random('bot').random())
+
+    def test_seed_out_of_range(self):
+        for seed in (-1, 1 << 64, 'seven', 1.5):
+            game = start_game(seed=seed)
+            self.assertTrue(0 <= game.seed < 1 << 64)
+            self.assertEqual(game.seed, Game(seed=seed).seed)
+            data = game.to_bytes()
+            self.assertEqual(Game.from_bytes(data).seed, game.seed)
+        self.assertEqual(Game(seed=(1 << 64) - 1).seed, (1 << 64) - 1)
+
+    def _reference_valid_actions(self, game, player, card):
+        if game.state == 'public':
+            if card['type'] == 'change':
+                return [ACTION_DISCARD_CARD, ACTION_USE_CARD]
+            return [ACTION_TAKE_CARD]
+
+        if game.state == 'auction' and game.auction_bidder != player:
+            return [ACTION_BID_CARD]
+
+        actions = [ACTION_TAKE_CARD, ACTION_PILE_CARD, ACTION_SHOW_CARD]
+        if (game.state == 'auction' or
+                game.actions_taken[ACTION_SHOW_CARD] == game.player_count - 1):
+            actions.remove(ACTION_SHOW_CARD)
+        if game.state == 'auction' or game.actions_taken[ACTION_PILE_CARD]:
+            actions.remove(ACTION_PILE_CARD)
+        if game.state != 'auction' and game.actions_taken[ACTION_TAKE_CARD]:
+            actions.remove(ACTION_TAKE_CARD)
+        if card['type'] == 'change' and ACTION_TAKE_CARD in actions:
+            actions.extend([ACTION_DISCARD_CARD, ACTION_USE_CARD])
+        return actions
+
+    def test_valid_actions_table(self):
+        for num_players in (2, 3, 4):
+            game, players = self._start_game(num_players)
+            while game.state != 'end':
+                player, card, actions = game.turn()
+                for kind in ('change', 'gold'):
+                    other = {'type': kind, 'value': 1, 'letter': None}
+                    self.assertEqual(
+                        list(game.valid_actions(player, other)),
+                        self._reference_valid_actions(game, player, other))
+                self.assertIsInstance(actions, tuple)
+                self.assertEqual(
+                    VALID_ACTION_MASKS[game.action_key(player, card)],
+                    sum(1 << action for action in actions))
+                player.act(card, random.choice(actions))
+
+    def test_batch_valid_actions(self):
+        games = [self._start_game(n)[0] for n in (2, 3, 4)]
+        cards = [game.deck[-1] for game in games]
+        actions = batch_valid_actions(games, cards)
+        self.assertEqual(actions, [game.valid_actions(game.player, card)
+                                   for game, card in zip(games, cards)])
+        masks = batch_action_masks(games, cards)
+        self.assertEqual(list(masks), [
+            game.valid_actions_mask(game.player, card)
+            for game, card in zip(games, cards)])
+
+
+class TestReplay(TestCase):
+    def _played_game(self, num_players=3, **kwargs):
+        game = start_game(num_players, seed=11, **kwargs)
+        game.play()
+        return game
+
+    def _assert_same_game(self, game, other):
+        self.assertEqual(other.log, game.log)
+        self.assertEqual(other.state, game.state)
+        self.assertEqual(other.discarded, game.discarded)
+        self.assertEqual(other.dice, game.dice)
+        self.assertEqual([p.cards for p in other.players],
+                         [p.cards for p in game.players])
+
+    def test_log(self):
+        game = self._played_game()
+        self.assertTrue(game.log)
+        self.assertEqual(game.snapshots, [])
+        self.assertEqual({move.seat for move in game.log}, {0, 1, 2})
+
+    def test_restore_from_log(self):
+        game = self._played_game()
+        restored = Game.restore(
+            [Player() for i in range(3)], game.log, seed=11)
+        self._assert_same_game(game, restored)
+
+    def test_restore_from_snapshot(self):
+        game = self._played_game(snapshot_interval=16, compact=True)
+        self.assertEqual(len(game.snapshots), len(game.log) // 16)
+
+        # drop the last moves and continue from the nearest snapshot
+        log = game.log[:len(game.log) - 5]
+        restored = Game.restore([Player() for i in range(3)], log,
+                                game.snapshots, seed=11, compact=True,
+                                snapshot_interval=16)
+        self.assertEqual(restored.log, log)
+        restored.replay(game.log[len(log):])
+        self._assert_same_game(game, restored)
+
+    def test_load_snapshot(self):
+        game = start_game(2, seed=3)
+        for i in range(10):
+            game.play_turn()
+        snapshot = game.snapshot()
+        game.play()
+
+        game.load(snapshot)
+        self.assertEqual(len(game.log), 10)
+        self.assertEqual(game.deck_count, len(snapshot.deck))
+        self.assertEqual(game.play_turn()[1], snapshot.deck[-1])
+
+    def test_bytes_round_trip(self):
+        for compact in (False, True):
+            game = start_game(3, seed=3, compact=compact)
+            for i in range(40):
+                game.play_turn()
+
+            data = game.to_bytes()
+            self.assertLess(len(data), 200)
+            loaded = Game.from_bytes(data)
+            self.assertEqual(loaded.snapshot()[1:-1], game.snapshot()[1:-1])
+            self.assertEqual(loaded.compact, compact)
+            self.assertEqual(loaded.seed, 3)
+
+    def test_bytes_random_state(self):
+        game = start_game(2, seed=9, compact=True)
+        for i in range(20):
+            game.play_turn()
+
+        loaded = Game.from_bytes(game.to_bytes(random_state=True))
+        game.play()
+        loaded.play()
+        self.assertEqual(loaded.log, game.log[20:])
+        self.assertEqual(loaded.dice, game.dice)
+
+    def test_iter_bytes(self):
+        games = [self._played_game(num_players) for num_players in (2, 3, 4)]
+        data = bytearray().join(game.to_bytes() for game in games)
+        loaded = list(Game.iter_bytes(data))
+        self.assertEqual([game.player_count for game in loaded], [2, 3, 4])
+        for game, other in zip(games, loaded):
+            self.assertEqual(other.state, 'end')
+            self.assertEqual(other.players.index(other.winner()),
+                             game.players.index(game.winner()))
+            self.assertEqual([p.cards for p in other.players],
+                             [p.cards for p in game.players])
+        with self.assertRaises(ValueError):
+            Game.from_bytes('XX' + games[0].to_bytes()[2:])
+
+    def _search_game(self, num_players):
+        return start_game(num_players, seed=5, compact=True)
+
+    def test_clone(self):
+        game = self._search_game(2)
+        for i in range(6):
+            game.play_turn()
+        clone = game.clone()
+        self.assertEqual(clone.snapshot(), game.snapshot())
+        self.assertIs(clone.active_player.game, clone)
+
+        clone.play()
+        self.assertEqual(clone.state, 'end')
+        self.assertEqual(len(game.log), 6)
+        self.assertEqual(game.players[0].game, game)
+        self.assertNotEqual(clone.deck_count, game.deck_count)
+
+    def test_apply_undo(self):
+        rng = random.Random(1)
+        for num_players in (2, 3, 4):
+            game = self._search_game(num_players)
+            initial = game.snapshot()
+            snapshots = []
+            while game.state != 'end':
+                snapshots.append(game.snapshot())
+                public_card = None
+                if game.state == 'public':
+                    public_card = rng.choice(game.public)
+                player, card, actions = game.clone().turn(public_card)
+                colors = ['blue', 'red'][:abs(card.value)] or ['+green']
+                game.apply(rng.choice(actions), public_card, colors)
+
+            while game.undo_stack:
+                game.undo()
+                self.assertEqual(game.snapshot(), snapshots.pop())
+            self.assertEqual(game.snapshot(), initial)
+
+
+class TestCard(TestCase):
+    def test_compact_deal(self):
+        deck = deal(2, cards_to_remove=0, gold_to_remove=0, compact=True)
+        self.assertEqual(len(deck), len(CARDS))
+        self.assertTrue(all(isinstance(card, Card) for card in deck))
+        self.assertEqual(
+            sorted(card.to_dict() for card in deck),
+            sorted(deal(2, cards_to_remove=0, gold_to_remove=0)))
+
+    def test_dict_adapter(self):
+        card = Card.from_dict({'type': 'green', 'value': 1, 'letter': 'A'})
+        self.assertIs(card, Card.from_dict(card))
+        self.assertEqual(card['type'], 'green')
+        self.assertEqual(card.get('bid_player'), None)
+        self.assertEqual(card.to_dict(),
+                         {'type': 'green', 'value': 1, 'letter': 'A'})
+        self.assertRaises(KeyError, lambda: card['bid_player'])
+
+    def test_immutable(self):
+        card = CARDS[0]
+        with self.assertRaises(AttributeError):
+            card.value = 5
+        self.assertIs(pickle.loads(pickle.dumps(card, -1)), card)
+
+    def test_compact_game(self):
+        game = start_game(3, compact=True)
+        players = game.players
+
+        while game.state != 'end':
+            player, card, actions = game.turn()
+            self.assertIsInstance(card, Card)
+            player.act(card, random.choice(actions))
+
+        player_cards = sum(len(p.cards) for p in players)
+        self.assertEqual(game.discarded_count + player_cards, 72)
+        for player in players:
+            self.assertEqual(
+                player.score_type('gold').value,
+                sum(card.value for card in player.cards
+                    if card.type == 'gold'))
+
+
+class TestDeck(TestCase):
+    def _deck(self, seed=1, players=3):
+        return Deck.deal(players, compact=True, rng=random.Random(seed))
+
+    def test_lazy_order(self):
+        settled = list(self._deck())
+        deck = self._deck()
+        self.assertEqual(len(deck), 72)
+        self.assertEqual(deck[-1], settled[-1])
+        drawn = [deck.pop() for _ in range(10)]
+        self.assertEqual(drawn, settled[:-11:-1])
+        self.assertEqual(list(deck), settled[:-10])
+        self.assertEqual(len(set(card.index for card in settled)), 72)
+        with self.assertRaises(IndexError):
+            Deck().pop()
+
+    def test_append_copy(self):
+        deck = self._deck()
+        card = deck.pop()
+        deck.append(card)
+        copy = deck.copy()
+        self.assertEqual(len(copy), 72)
+        self.assertIs(copy.pop(), card)
+        self.assertEqual(len(deck), 72)
+        self.assertEqual(list(copy), list(deck)[:-1])
+
+        dicts = Deck.from_cards([card.to_dict() for card in list(deck)])
+        self.assertEqual(dicts.pop(), card.to_dict())
+
+    def test_redeterminize(self):
+        deck = self._deck()
+        pile = [deck.pop() for _ in range(5)]
+        top = deck[-1]
+        pile = deck.redeterminize(random.Random(2), pile, known_top=True)
+        self.assertEqual(len(pile), 5)
+        self.assertEqual(len(deck), 67)
+        self.assertEqual(deck.pop(), top)
+
+        # the cards removed at the start can now be dealt too
+        everything = Deck.deal(3, cards_to_remove=0, compact=True)
+        self.assertEqual(
+            sorted(list(deck.pool) + [card.index for card in pile + [top]]),
+            sorted(card.index for card in everything))
+
+
+class TestAuction(TestCase):
+    GOLD = next(card for card in CARDS
+                if card.type == 'gold' and card.value == 1)
+
+    def _auction(self, golds, player_class=Player):
+        game = start_game(len(golds), player_class, seed=6, compact=True)
+        while game.state != 'auction':
+            game.play_turn()
+        for player, gold in zip(game.players, golds):
+            player.cards = [card for card in player.cards
+                            if card.type != 'gold'] + [self.GOLD] * gold
+        return game
+
+    def test_resolve_sealed_bids(self):
+        game = self._auction([0, 3, 5])
+        moves = len(game.log)
+        self.assertEqual(game.resolve_auction({0: 0, 1: 3, 2: 4}), 2)
+        self.assertEqual(game.auction_gold, 4)
+        self.assertEqual(game.seat, 2)
+        self.assertLessEqual(len(game.log) - moves, 3)
+        player, card, actions = game.turn()
+        self.assertIs(player, game.players[2])
+        self.assertNotIn(ACTION_BID_CARD, actions)
+
+    def test_resolve_outbid_sealed_bids(self):
+        game = self._auction([7, 7, 7])
+        self.assertEqual(game.resolve_auction({0: 2, 1: 3, 2: 5}), 2)
+        self.assertEqual(game.auction_gold, 5)
+        self.assertEqual(game.seat, 2)
+        # seat 0 could still go higher but its sealed bid was final
+        player, card, actions = game.turn()
+        self.assertIs(player, game.players[2])
+        self.assertNotIn(ACTION_BID_CARD, actions)
+
+    def test_resolve_bad_bids(self):
+        game = self._auction([2, 3, 5])
+        before = game.to_bytes(), len(game.log)
+        for bids in ({0: 2, 1: 3, 2: 99}, {3: 1}):
+            with self.assertRaises(ValueError):
+                game.resolve_auction(bids)
+            self.assertEqual((game.to_bytes(), len(game.log)), before)
+        self.assertEqual(game.resolve_auction({0: 2, 1: 3, 2: 5}), 2)
+
+    def test_skip_players_who_cannot_outbid(self):
+        game = self._auction([0, 2, 0])
+        while game.seat != 1:
+            player, card, _ = game.turn()
+            player.act(card, ACTION_BID_CARD, bid_gold=0)
+        self.assertEqual(bidders(game), [1])
+        player, card, _ = game.turn()
+        player.act(card, ACTION_BID_CARD, bid_gold=2)
+        # nobody else has the gold to bid 3
+        self.assertEqual(game.seat, 1)
+        self.assertEqual(bidders(game), [])
+
+    def test_choose_bid(self):
+        class AllIn(Player):
+            def choose_bid(self, card, max_gold):
+                return max_gold
+
+        game = self._auction([1, 4], AllIn)
+        player, card, _ = game.turn()
+        with self.assertRaises(ValueError):
+            player.act(card, ACTION_BID_CARD, bid_gold=max_bid(player) + 1)
+        player, card, actions = game.turn()
+        while ACTION_BID_CARD in actions:
+            player.act(card, ACTION_BID_CARD)
+            player, card, actions = game.turn()
+        self.assertEqual(game.auction_gold, 4)
+        self.assertEqual(game.auction_bidder, game.players[1])
+
+
+class TestSimulate(TestCase):
+    def test_play(self):
+        game = start_game(2)
+        self.assertIn(game.play(), game.players)
+        self.assertEqual(game.state, 'end')
+
+    def test_simulate(self):
+        stats = simulate(20, players=3, processes=1, chunk_size=7)
+        self.assertEqual(stats.games, 20)
+        self.assertEqual(sum(stats.wins.values()), 20)
+        self.assertAlmostEqual(sum(stats.win_rates), 1.0)
+        self.assertEqual(sum(stats.dice['red'].values()), 20)
+        # 18 cards are auctioned in every 3 player game
+        self.assertEqual(sum(stats.prices.values()), 20 * 18)
+
+    def test_simulate_pool_reproducible(self):
+        inline = simulate(10, processes=1, seed=5, chunk_size=3)
+        pooled = simulate(10, processes=2, seed=5, chunk_size=3)
+        self.assertEqual(inline.as_dict(), pooled.as_dict())
+
+
+class TestStore(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'games.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_store_simulated_games(self):
+        total = simulate(12, players=3, processes=1, seed=2)
+        with StoreWriter(self.path, buffer_size=5) as writer:
+            for stats in simulate_iter(12, players=3, processes=1, seed=2,
+                                       chunk_size=5, records=True):
+                writer.extend(stats.records)
+
+        store = GameStore(self.path)
+        self.assertEqual(len(store), 12)
+        self.assertEqual(list(store.records['seed']),
+                         [split_seed(2, i) for i in range(12)])
+        self.assertEqual(list(store.win_rates(3)), total.win_rates)
+        self.assertEqual(len(store.auction_prices()), 12 * 18)
+        self.assertEqual(list(store.find(split_seed(2, 7))), [7])
+        self.assertEqual(sum(len(store.won_by(seat)) for seat in range(3)),
+                         12)
+
+    def test_writer_appends(self):
+        games = []
+        for seed in range(3):
+            game = start_game(2, seed=seed)
+            game.play()
+            games.append(game)
+        for game in games:
+            with StoreWriter(self.path) as writer:
+                writer.add(game, [])
+        with open(self.path, 'ab') as output:
+            output.write('partial record')
+
+        with StoreWriter(self.path) as writer:
+            writer.add(games[0], [1, 2])
+        store = GameStore(self.path)
+        self.assertEqual(list(store.records['seed']), [0, 1, 2, 0])
+        self.assertEqual(list(store.find(0)), [0, 3])
+        cards, actions, seats = decode_moves(store[1]['moves'])
+        count = store[1]['move_count']
+        self.assertEqual(list(actions[:count]),
+                         [move.action for move in games[1].log])
+        self.assertEqual(list(seats[:count]),
+                         [move.seat for move in games[1].log])
+
+    def test_seed_index(self):
+        games = []
+        for seed in range(4):
+            game = start_game(2, seed=seed)
+            game.play()
+            games.append(game)
+        with StoreWriter(self.path) as writer:
+            for game in games[:2]:
+                writer.add(game, [])
+        self.assertEqual(list(GameStore(self.path).find(1)), [1])
+
+        # same number of games, older index
+        os.remove(self.path)
+        with StoreWriter(self.path) as writer:
+            for game in games[2:]:
+                writer.add(game, [])
+        os.utime(self.path + '.seeds', (0, 0))
+        with patch('libros.store.open', side_effect=IOError, create=True):
+            store = GameStore(self.path)
+            self.assertEqual(list(store.find(3)), [1])
+            self.assertEqual(list(store.find(1)), [])
+        self.assertEqual(os.path.getmtime(self.path + '.seeds'), 0)
+
+    def test_encode_change(self):
+        change = {'type': 'change', 'value': -2, 'letter': None}
+        self.assertEqual(encode_change(change, ['blue', 'red']), 0x25)
+        change['value'] = 0
+        self.assertEqual(encode_change(change, ['+brown']), 0x2)
+        self.assertEqual(encode_change(change, []), 0)
+
+
+class TestMCTS(TestCase):
+    def _game(self, bot, seed=9):
+        return Game.new([bot, Player()], compact=True, seed=seed)
+
+    def test_legal_moves(self):
+        game = self._game(Player())
+        while game.state != 'end':
+            moves = legal_moves(game)
+            if game.state == 'turn':
+                card = game.deck[-1]
+                self.assertEqual(
+                    {move.action for move in moves},
+                    set(game.valid_actions(game.active_player, card)))
+            game.play_turn()
+        self.assertEqual(legal_moves(game), [])
+
+    def test_full_game(self):
+        bot = MCTSPlayer(iterations=5)
+        game = self._game(bot)
+        self.assertIn(game.play(), game.players)
+        self.assertTrue(bot.searches)
+        self.assertGreater(bot.playouts, 0)
+        self.assertGreater(bot.playouts_per_second, 0)
+
+    def test_parallel_search(self):
+        bot = MCTSPlayer(iterations=8, time_limit=5, processes=2)
+        game = self._game(bot)
+        try:
+            game.play_turn()
+        finally:
+            bot.close()
+        self.assertEqual(bot.playouts, 8)
+
+
+class TestEndgame(TestCase):
+    def _auction(self, players, seed, cards):
+        game = start_game(players, compact=True, seed=seed)
+        while game.state != 'auction' or len(game.pile) > cards:
+            game.play_turn()
+        return game
+
+    def _game_in_turn(self):
+        return start_game(2, seed=1)
+
+    def test_solution_is_played_out(self):
+        for players, cards in ((2, 8), (3, 6), (4, 3)):
+            for seed in xrange(4):
+                game = self._auction(players, seed, cards)
+                solver = EndgameSolver()
+                winner = solver.solve(game).winner
+                while game.state != 'end':
+                    solution = solver.solve(game)
+                    self.assertEqual(solution.winner, winner)
+                    player, card, _ = game.turn()
+                    player.act(card, solution.action,
+                               change_colors=solution.change_colors,
+                               bid_gold=solution.bid_gold)
+                self.assertIs(game.winner(), game.players[winner])
+
+    def test_auction_under_way(self):
+        solver = EndgameSolver(cache_size=64)
+        game = self._auction(3, 1, 5)
+        with self.assertRaises(ValueError):
+            solver.solve(self._game_in_turn())
+        player, card, _ = game.turn()
+        player.act(card, ACTION_BID_CARD, bid_gold=1)
+        solution = solver.solve(game)
+        self.assertIn(solution.action, game.valid_actions(
+            game.active_player, game.auction_card))
+        if solution.action == ACTION_BID_CARD:
+            self.assertLessEqual(solution.bid_gold,
+                                 max_bid(game.active_player))
+        self.assertEqual(solver.play(game), game.players[solution.winner])
+        self.assertLessEqual(len(solver.table), 64)
+
+    def test_endgame_player(self):
+        bot = EndgamePlayer(samples=3, max_cards=4)
+        game = Game.new([bot, Player()], compact=True, seed=3)
+        self.assertIn(game.play(), game.players)
+        self.assertGreater(bot.solver.nodes, 0)
+
+
+class TakePolicy(Policy):
+    def scores(self, features, masks):
+        scores = np.zeros(masks.shape)
+        scores[:, ACTION_TAKE_CARD] = features[:, FEATURES.index('card_value')]
+        return scores
+
+
+class TestPolicy(TestCase):
+    def _games(self, count, seats=(PolicyPlayer, Player, PolicyPlayer)):
+        return [Game.new([player_class() for player_class in seats],
+                         compact=True, seed=seed)
+                for seed in xrange(count)]
+
+    def test_collect(self):
+        games = self._games(3)
+        while games[1].state != 'public':
+            games[1].play_turn()
+        decisions = collect(games)
+        self.assertEqual(decisions.features.shape,
+                         (len(decisions.rows), len(FEATURES)))
+        self.assertEqual(list(decisions.rows[:1]), [0])
+        public = {card.key for card in games[1].public}
+        self.assertEqual(list(decisions.rows).count(1), len(public))
+        for row, index in enumerate(decisions.rows):
+            game = games[index]
+            actions = game.valid_actions(game.active_player,
+                                         decisions.cards[row])
+            self.assertEqual(
+                [action for action in ACTIONS
+                 if decisions.masks[row, action]], list(actions))
+
+    def test_run(self):
+        games = self._games(20)
+        runner = PolicyRunner(RandomPolicy(seed=1), games)
+        winners = runner.run()
+        self.assertTrue(all(game.state == 'end' for game in games))
+        self.assertEqual(len(winners), 20)
+        moves = sum(1 for game in games for move in game.log
+                    if move.seat != 1)
+        self.assertEqual(runner.decisions, moves)
+        self.assertLess(runner.batches, runner.decisions / 10)
+        other = self._games(20)
+        PolicyRunner(RandomPolicy(seed=1), other).run()
+        self.assertEqual([game.log for game in other],
+                         [game.log for game in games])
+
+    def test_scores_pick_card_and_action(self):
+        games = []
+        for game in self._games(10, seats=[PolicyPlayer] * 4):
+            while game.state != 'end' and (
+                    game.state != 'public' or
+                    len({card.value for card in game.public
+                         if card.type != 'change'}) < 2):
+                game.play_turn()
+            if game.state == 'public':
+                games.append(game)
+        self.assertTrue(games)
+        best = [max(card.value for card in game.public
+                    if card.type != 'change') for game in games]
+        PolicyRunner(TakePolicy(), games).step()
+        self.assertEqual([game.log[-1].card.value for game in games], best)
+        self.assertEqual({game.log[-1].action for game in games},
+                         {ACTION_TAKE_CARD})
+
+
+def _add_to_table(table):
+    table.add(7, (1, 0, 1, 0, 0), 1)
+
+
+class TestZobrist(TestCase):
+    def _play(self, compact):
+        game = start_game(3, seed=12, compact=compact)
+        rng = random.Random(4)
+        hashes = []
+        while game.state != 'end':
+            hashes.append(game.position_hash())
+            self.assertEqual(game.zobrist, game.rehash())
+            move = rng.choice(legal_moves(game))
+            public_card = None
+            if move.card is not None:
+                public_card = next(card for card in game.public
+                                   if Card.from_dict(card).key == move.card)
+            game.apply(move.action, public_card,
+                       move.colors and list(move.colors))
+        return game, hashes
+
+    def test_incremental_hash(self):
+        game, hashes = self._play(compact=True)
+        self.assertEqual(game.zobrist, game.rehash())
+        self.assertNotEqual(game.zobrist, hashes[0])
+        # equal cards hash the same whichever copy it is
+        self.assertEqual(self._play(compact=False)[1], hashes)
+        while game.undo_stack:
+            game.undo()
+            self.assertEqual(game.position_hash(), hashes[len(game.log)])
+        restored = Game.from_bytes(game.to_bytes())
+        self.assertEqual(restored.position_hash(), hashes[0])
+
+    def test_transpositions(self):
+        game = start_game(2, seed=3, compact=True)
+        other = game.clone()
+        plus_two, plus_one = [
+            next(card for card in CARDS if card.key == ('change', value, None))
+            for value in (2, 1)]
+        game.use_change_card(plus_two, ['blue', 'red'])
+        game.use_change_card(plus_one, ['red'])
+        other.use_change_card(plus_one, ['red'])
+        other.use_change_card(plus_two, ['red', 'blue'])
+        self.assertEqual(game.dice, other.dice)
+        self.assertEqual(game.zobrist, other.zobrist)
+        self.assertEqual(game.zobrist, game.rehash())
+        gold = [card for card in CARDS if card.key == ('gold', 1, None)]
+        game.players[0].cards = [gold[0]]
+        other.players[0].cards = [gold[1]]
+        self.assertEqual(game.rehash(), other.rehash())
+        self.assertNotEqual(game.position_hash(),
+                            game.position_hash(drawn=gold[0]))
+
+    def test_tables(self):
+        table = TranspositionTable(size=3, probe=2)
+        table.store(1, 'deep', depth=5)
+        table.store(2, 'shallow')
+        table.store(3, 'recent')
+        table.store(4, 'new')
+        self.assertNotIn(2, table)
+        self.assertEqual(table.get(1), 'deep')
+        table.store(5, 'newer')
+        self.assertNotIn(3, table)
+        table.add(6, (1, 2), 1)
+        table.add(6, (1, 0), 2)
+        self.assertEqual(table.get(6), (2, 2))
+
+        shared = SharedTranspositionTable(size=8)
+        worker = Process(target=_add_to_table, args=(shared,))
+        worker.start()
+        worker.join()
+        _add_to_table(shared)
+        self.assertEqual(shared.get(7), (2, 0, 2, 0, 0))
+        self.assertIsNone(shared.get(15))
+
+        bot = MCTSPlayer(iterations=30, table=TranspositionTable())
+        game = Game.new([bot, Player()], compact=True, seed=9)
+        game.play_turn()
+        self.assertTrue(len(bot.table))
+        self.assertGreater(bot.moves_table.hits, 0)
+
+
+class TestBatch(TestCase):
+    def _games(self, seeds, num_players):
+        games = []
+        for seed in seeds:
+            game = start_game(num_players, compact=True, seed=seed)
+            games.append(game)
+        return games
+
+    def _game_state(self, game):
+        snapshot = game.snapshot()
+        return {
+            'state': snapshot.state,
+            'seat': snapshot.seat,
+            'turns_left': snapshot.turns_left,
+            'deck': [card.index for card in snapshot.deck],
+            'pile': [card.index for card in snapshot.pile],
+            'public': [card.index for card in snapshot.public],
+            'discarded': [card.index for card in snapshot.discarded],
+            'dice': snapshot.dice,
+            'actions_taken': snapshot.actions_taken,
+            'hands': [sorted(card.index for card in hand)
+                      for hand in snapshot.hands],
+        }
+
+    def test_matches_scalar_game(self):
+        self.maxDiff = None
+        rng = random.Random(3)
+        for num_players in (2, 3, 4):
+            seeds = range(12)
+            games = self._games(seeds, num_players)
+            batch = BatchGame.new(seeds, num_players)
+
+            while not batch.done.all():
+                size = len(games)
+                actions, choices = [0] * size, [0] * size
+                colors, signs = [[-1, -1]] * size, [1] * size
+                bids = [0] * size
+                masks = batch.action_masks()
+                for row, game in enumerate(games):
+                    if game.state == 'end':
+                        continue
+                    if game.state == 'public':
+                        choices[row] = rng.randrange(game.public_count)
+                    player, card, valid = game.turn(
+                        game.public[choices[row]]
+                        if game.state == 'public' else None)
+                    if choices[row] == 0:
+                        self.assertEqual(
+                            masks[row], game.valid_actions_mask(player, card))
+                    actions[row] = rng.choice(valid)
+                    change = None
+                    if actions[row] == ACTION_USE_CARD:
+                        colors[row] = rng.sample(range(5), 2)
+                        signs[row] = rng.choice([1, -1])
+                        change = [COLORS[c] for c in colors[row]]
+                        change = change[:abs(card.value)] or [
+                            '+-'[signs[row] < 0] + change[0]]
+                    if actions[row] == ACTION_BID_CARD:
+                        bids[row] = rng.randint(0, max_bid(player))
+                    player.act(card, actions[row], change, bids[row])
+
+                batch.step(actions, choices, colors, signs, bids)
+                for row, game in enumerate(games):
+                    self.assertEqual(batch.game_state(row),
+                                     self._game_state(game))
+
+            self.assertEqual(list(batch.winner()),
+                             [game.players.index(game.winner())
+                              for game in games])
+
+
+class TestBench(TestCase):
+    def test_run_benchmarks(self):
+        results = run_benchmarks(min_time=0.001)
+        for players in (2, 3, 4):
+            self.assertGreater(results['game_%dp' % players]['value'], 0)
+            self.assertGreater(results['game_memory_%dp' % players]['value'],
+                               0)
+        self.assertFalse(results['winner']['higher'])
+        self.assertEqual(compare(results, results), [])
+
+    def test_compare(self):
+        baseline = {'games': {'value': 100.0, 'unit': 'games/s',
+                              'higher': True},
+                    'memory': {'value': 1000, 'unit': 'bytes',
+                               'higher': False}}
+        results = {'games': {'value': 80.0, 'unit': 'games/s',
+                             'higher': True},
+                   'memory': {'value': 1050, 'unit': 'bytes',
+                              'higher': False},
+                   'new': {'value': 1, 'unit': 'calls/s', 'higher': True}}
+        self.assertEqual(compare(results, baseline),
+                         [('games', 100.0, 80.0, -0.2)])
+        self.assertEqual(
+            [name for name, _, _, _ in compare(results, baseline, 0.01)],
+            ['games', 'memory'])
+
+
+class TestDelta(TestCase):
+    def _game(self, players=3, seed=4):
+        return start_game(players, compact=True, seed=seed)
+
+    def _follow(self, game):
+        stream = DeltaStream(game, resync_interval=0)
+        views = [GameView(seat) for seat in range(game.player_count)]
+        for seat, view in enumerate(views):
+            view.apply(stream.full_state(seat))
+
+        def check():
+            for seat, message in stream.flush().items():
+                views[seat].apply(message)
+            for seat, view in enumerate(views):
+                self.assertEqual(
+                    view.view, full_view(game, seat, stream.drawn))
+
+        while game.state != 'end':
+            player, card, actions = game.turn()
+            check()
+            player.act(card, player.choose_action(card, actions))
+            check()
+        self.assertEqual(views[0].version, stream.version)
+
+    def test_views_follow_game(self):
+        self._follow(self._game())
+
+    def test_duplicate_public_cards(self):
+        class LastCard(Player):
+            def choose_public_card(self, cards):
+                return cards[-1]
+
+        game = start_game(3, player_class=LastCard, compact=True, seed=23)
+        while game.state != 'public':
+            game.play_turn()
+        public = game.public
+        self.assertNotEqual(len(set(public)), len(public))
+        self.assertNotEqual([card.index for card in public],
+                            [CARDS_BY_KEY[card.key].index for card in public])
+        self._follow(game)
+
+    def test_hidden_cards(self):
+        game = self._game()
+        stream = DeltaStream(game)
+        player, card, actions = game.turn()
+        player.act(card, ACTION_PILE_CARD)
+        messages = stream.flush()
+
+        moves = [decode(data) for data in messages[0]['events']
+                 if data[0] == 0]
+        self.assertEqual([move[1] for move in moves], [card, card])
+        for seat in (1, 2):
+            moves = [decode(data) for data in messages[seat]['events']
+                     if data[0] == 0]
+            self.assertEqual([move[1:4] for move in moves],
+                             [(None, 'deck', 'drawn'),
+                              (None, 'drawn', 'pile')])
+        self.assertEqual(full_view(game, 1)['hand'], [])
+
+    def test_resync(self):
+        game = self._game()
+        stream = DeltaStream(game, resync_interval=2)
+        view = GameView(1)
+        with self.assertRaises(ValueError):
+            game.play_turn()
+            view.apply(stream.flush()[1])
+        game.play_turn()
+        message = stream.flush()[1]
+        self.assertEqual(message['type'], 'state')
+        view.apply(message)
+        self.assertEqual(view.view, full_view(game, 1))
+        self.assertEqual(game.clone().observers, [])
+
+
+class TestTracker(TestCase):
+    def _game(self, players=3, seed=2):
+        return start_game(players, seed=seed)
+
+    def test_counts_follow_game(self):
+        game = self._game()
+        trackers = [CardTracker(game, seat) for seat in range(3)]
+        self.assertEqual([tracker.removed for tracker in trackers], [12] * 3)
+        # every card dealt is a new dict, so the cards seen are told apart
+        # by identity
+        seen = [{} for _ in range(3)]
+
+        def observe(event):
+            for seat in range(3):
+                card = view_event(event, seat)[1]
+                if event[0] == 'card' and card is not None:
+                    seen[seat][id(event[1])] = card
+
+        game.observers.append(observe)
+        while game.state != 'end':
+            game.play_turn()
+            for seat, tracker in enumerate(trackers):
+                counts = [0] * len(CARDS)
+                for card in full_deck(1):
+                    counts[CARDS_BY_KEY[card.key].index] += 1
+                for card in seen[seat].values():
+                    counts[CARDS_BY_KEY[Card.from_dict(card).key].index] -= 1
+                self.assertEqual(tracker.counts, counts)
+                self.assertEqual(tracker.dice, game.dice)
+                self.assertEqual(tracker.unseen, sum(counts))
+        trackers[0].close()
+        self.assertEqual(len(game.observers), 3)
+
+    def test_chances(self):
+        game = self._game(players=4)
+        tracker = CardTracker(game, 0)
+        for _ in range(20):
+            game.play_turn()
+        self.assertAlmostEqual(sum(tracker.draw_chance(kind)
+                                   for kind in TYPES), 1)
+        cards = set(CARDS_BY_KEY.values())
+        self.assertAlmostEqual(sum(tracker.card_chance(card)
+                                   for card in cards), 1)
+        for color in COLORS:
+            chances = tracker.majority_chances(color)
+            self.assertEqual(len(chances), 4)
+            self.assertAlmostEqual(sum(chances), 1)
+
+    def test_expected_dice_and_majority(self):
+        game = self._game(players=2)
+        tracker = CardTracker(game, 1)
+        self.assertEqual(tracker.majority_chances('red'), [0.5, 0.5])
+        # the change cards sum to 0 at first
+        self.assertEqual(tracker.expected_dice(), game.dice)
+        tracker.known[1]['red'] += 30
+        self.assertGreater(tracker.majority_chances('red')[1], 0.99)
+        tracker.known[1]['red'] -= 30
+
+        game.play()
+        # nothing is left to play once the game ends
+        self.assertEqual(tracker.live_share, 0)
+        self.assertEqual(tracker.expected_dice(), game.dice)
+
+
+class TakerPlayer(Player):
+    def choose_action(self, card, actions):
+        if ACTION_TAKE_CARD in actions and card['type'] != 'change':
+            return ACTION_TAKE_CARD
+        return super(TakerPlayer, self).choose_action(card, actions)
+
+
+class TestTournament(TestCase):
+    def test_schedules(self):
+        self.assertEqual(len(round_robin(4, 2)), 6)
+        self.assertEqual(gauntlet(4, 3), [(0, 1, 2), (0, 1, 3), (0, 2, 3)])
+        with self.assertRaises(ValueError):
+            Tournament([Player, Player], seats=3)
+        with self.assertRaises(ValueError):
+            Tournament([Player, Player], schedule='swiss')
+
+    def test_mirrored_deals(self):
+        # the same players on the same deal finish the same by seat
+        tournament = Tournament([Player] * 3, seats=3)
+        self.assertIsNone(tournament.run(max_games=90, seed=1))
+        self.assertEqual(tournament.games, 90)
+        self.assertEqual(tournament.rounds, 30)
+        self.assertEqual(tournament.sprt.wins, tournament.sprt.losses)
+        self.assertAlmostEqual(sum(tournament.ratings), 4500)
+        for rating in tournament.ratings:
+            self.assertLess(abs(rating - 1500), 10)
+        self.assertEqual([sum(places) for places in tournament.places],
+                         [90] * 3)
+
+    def test_sprt_stops_early(self):
+        sprt = SPRT(0, 30)
+        sprt.add(100, 80)
+        self.assertIsNone(sprt.result)
+        sprt.add(200, 100)
+        self.assertEqual(sprt.result, ACCEPT_H1)
+
+        tournament = Tournament([TakerPlayer, Player, Player], seats=2,
+                                schedule='gauntlet', sprt=SPRT(0, 100))
+        self.assertEqual(tournament.run(max_games=2000, processes=2),
+                         ACCEPT_H1)
+        self.assertLess(tournament.games, 2000)
+        self.assertEqual(tournament.games % 4, 0)
+        self.assertGreater(tournament.ratings[0], tournament.ratings[1])
+        tournament = Tournament([Player, TakerPlayer], sprt=SPRT(0, 100))
+        self.assertEqual(tournament.run(), ACCEPT_H0)
+
+
+class TestClock(TestCase):
+    def _server(self, timeout=10):
+        now = [0.0]
+        clock = TurnClock(timeout=timeout, bid_timeout=timeout / 2.0,
+                          tick=1, slots=8, clock=lambda: now[0])
+        return GameServer(clock=clock), now
+
+    def test_timer_wheel(self):
+        for levels in (1, 3):
+            self._check_wheel(TimerWheel(tick=1, slots=4, levels=levels,
+                                         now=0))
+
+    def _check_wheel(self, wheel):
+        rng = random.Random(0)
+        fired = {}
+
+        def fire(number):
+            fired[number] = wheel.current
+
+        deadlines = [rng.uniform(-2, 150) for _ in range(20000)]
+        timers = [wheel.schedule(deadline, fire, number)
+                  for number, deadline in enumerate(deadlines)]
+        for timer in timers[::2]:
+            wheel.cancel(timer)
+        self.assertEqual(len(wheel), 10000)
+        for now in range(1, 151):
+            wheel.advance(now)
+        self.assertEqual(len(wheel), 0)
+        self.assertEqual(sorted(fired), range(1, 20000, 2))
+        # timers fire on the tick they are due, the past ones on the next
+        for number, tick in fired.items():
+            self.assertEqual(tick, max(math.ceil(deadlines[number]), 1))
+
+        wheel.schedule(1e4, fire, 'late')
+        wheel.schedule(400, fire, 'soon')
+        self.assertEqual(wheel.advance(5e3), 1)
+        self.assertEqual(wheel.advance(2e4), 1)
+        self.assertEqual(fired['late'], 1e4)
+
+    def test_default_moves(self):
+        server, now = self._server()
+        tables = [server.create_table(players=2 + i % 3, seed=i)
+                  for i in range(3)]
+        gevent.sleep(0)
+        while any(table.game.state != 'end' for table in tables):
+            now[0] += 10
+            server.clock.advance()
+            gevent.sleep(0)
+        for table in tables:
+            self.assertEqual(table.timeouts, len(table.game.log))
+        self.assertEqual(server.clock.timers, {})
+        self.assertEqual(len(server.clock.wheel), 0)
+        server.stop()
+
+    def test_moves_restart_deadline(self):
+        server, now = self._server()
+        table = server.create_table(seed=1)
+        client = server.connect(table.id, 0)
+        gevent.sleep(0)
+        version = table.version
+        now[0] = 9
+        server.clock.advance()
+        message = client.receive(timeout=1)
+        while message['type'] != 'prompt':
+            message = client.receive(timeout=1)
+        client.move(message['actions'][0], timeout=1)
+        # the deadline is 10 seconds after the move now
+        now[0] = 18
+        server.clock.advance()
+        gevent.sleep(0)
+        self.assertEqual(table.timeouts, 0)
+        table.timeout(version).get(timeout=1)
+        self.assertEqual(table.timeouts, 0)
+        now[0] = 19
+        server.clock.advance()
+        gevent.sleep(0)
+        self.assertEqual(table.timeouts, 1)
+        self.assertEqual(len(table.game.log), 2)
+        server.stop()
+
+
+class TestInstrument(TestCase):
+    def _play(self, seed=1):
+        game = start_game(3, seed=seed, compact=True)
+        game.play()
+        return game
+
+    def test_enable_disable(self):
+        turn = Game.__dict__['turn']
+        instrumentation = Instrumentation()
+        instrumentation.enable()
+        try:
+            self.assertIsNot(Game.__dict__['turn'], turn)
+            with self.assertRaises(ValueError):
+                Instrumentation().enable()
+            game = self._play()
+        finally:
+            instrumentation.disable()
+        self.assertIs(Game.__dict__['turn'], turn)
+
+        snapshot = instrumentation.snapshot()
+        completes = snapshot['methods']['turn_complete']
+        self.assertEqual(sum(h['count'] for h in completes.values()),
+                         len(game.log))
+        self.assertEqual(sum(h['count'] for h in
+                             snapshot['transitions'].values()),
+                         len(game.log))
+        self.assertIn('public->auction', snapshot['transitions'])
+        self._play(2)
+        self.assertEqual(instrumentation.snapshot(), snapshot)
+
+    def test_prometheus(self):
+        instrumentation = Instrumentation()
+        instrumentation.enable(['turn_action'])
+        try:
+            game = self._play()
+        finally:
+            instrumentation.disable()
+        text = instrumentation.prometheus()
+        self.assertIn('# TYPE libros_method_seconds histogram', text)
+        counts = [line for line in text.splitlines()
+                  if line.startswith('libros_method_seconds_count')]
+        self.assertEqual(sum(int(line.split()[1]) for line in counts),
+                         len(game.log))
+        self.assertIn('le="+Inf",method="turn_action",state="public"', text)
+
+    def test_slow_turns(self):
+        instrumentation = Instrumentation(slow_turn=0, samples=5)
+        instrumentation.enable()
+        try:
+            game = self._play()
+        finally:
+            instrumentation.disable()
+        samples = instrumentation.slow_turns
+        self.assertEqual(len(samples), 5)
+        self.assertEqual(samples[-1]['move'], game.log[-1])
+        self.assertEqual(Game.from_bytes(samples[-1]['game']).state, 'end')
+
+
+class TestPersistence(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'tables.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _game(self, seed, players=3, compact=True):
+        return start_game(players, compact=compact, seed=seed)
+
+    def test_recover_open_tables(self):
+        games = [self._game(0), self._game(1, players=2), self._game(2),
+                 self._game((1 << 64) - 5, players=4, compact=False)]
+        journal = Journal(self.path)
+        for table_id, game in enumerate(games, 1):
+            journal.open_table(table_id, game)
+        games[0].play()
+        for _ in range(10):
+            games[1].play_turn()
+        for _ in range(70):
+            games[3].play_turn()
+        journal.close()
+
+        recovered = Journal(self.path).recover()
+        self.assertEqual(sorted(recovered), [2, 3, 4])
+        for table_id, game in recovered.items():
+            original = games[table_id - 1]
+            self.assertEqual(game.seed, original.seed)
+            self.assertEqual(len(game.log), len(original.log))
+            self.assertEqual(game.to_bytes(), original.to_bytes())
+
+    def test_writer_errors(self):
+        journal = Journal(self.path)
+        game = self._game(1)
+        game.seed = -1
+        with self.assertRaises(ValueError):
+            journal.open_table(1, game)
+        journal._put(('bogus', ()))
+        with self.assertRaises(KeyError):
+            journal.flush(timeout=5)
+        self.assertTrue(journal._writer.is_alive())
+        # the error is raised once and the later commits count again
+        journal.open_table(1, self._game(1))
+        self.assertTrue(journal.flush(timeout=5))
+        self.assertEqual(journal.stats()['commits'], 1)
+        journal._put(('bogus', ()))
+        with self.assertRaises(KeyError):
+            journal.close()
+        self.assertFalse(journal._writer.is_alive())
+
+    def test_broken_tables(self):
+        games = [self._game(seed) for seed in range(3)]
+        journal = Journal(self.path)
+        for table_id, game in enumerate(games, 1):
+            journal.open_table(table_id, game)
+        for game in games:
+            for _ in range(5):
+                game.play_turn()
+        journal.flush()
+        moves = len(games[0].log)
+        # a batch of table 1 fails, its later moves are not written
+        journal._put(('move', (1, moves)))
+        with self.assertRaises(sqlite3.ProgrammingError):
+            journal.flush(timeout=5)
+        self.assertEqual(sorted(journal.broken), [1])
+        for game in games:
+            for _ in range(5):
+                game.play_turn()
+        journal.close()
+
+        connection = sqlite3.connect(self.path)
+        with connection:
+            connection.execute(
+                'DELETE FROM moves WHERE table_id = 2 AND number = 3')
+        connection.close()
+        journal = Journal(self.path)
+        recovered = journal.recover()
+        journal.close()
+        self.assertEqual(sorted(recovered), [1, 3])
+        self.assertEqual(len(recovered[1].log), moves)
+        self.assertEqual(recovered[3].to_bytes(), games[2].to_bytes())
+        self.assertEqual(sorted(journal.broken), [2])
+
+    def test_group_commit(self):
+        games = [self._game(seed) for seed in range(6)]
+        with Journal(self.path) as journal:
+            for table_id, game in enumerate(games):
+                journal.open_table(table_id, game)
+            while any(game.state != 'end' for game in games):
+                for game in games:
+                    if game.state != 'end':
+                        game.play_turn()
+            self.assertTrue(journal.flush(timeout=5))
+            stats = journal.stats()
+            self.assertEqual(stats['moves'],
+                             sum(len(game.log) for game in games))
+            self.assertLess(stats['commits'], stats['moves'])
+            self.assertGreater(stats['moves_per_second'], 0)
+            self.assertEqual(journal.recover(), {})
+            self.assertEqual(journal.last_table_id(), 5)
+
+
+class TestServer(TestCase):
+    def _bot(self, client, rng):
+        while True:
+            message = client.receive(timeout=5)
+            if message['type'] == 'end':
+                return message['winner']
+            if message['type'] == 'prompt':
+                self._move(client, message, rng)
+
+    def _move(self, client, message, rng):
+        if 'public' in message:
+            card = rng.randrange(len(message['public']))
+            kind = message['public'][card]['type']
+            action = ACTION_TAKE_CARD
+            if kind == 'change':
+                action = ACTION_DISCARD_CARD
+            client.move(action, public_card=card, timeout=5)
+        else:
+            client.move(rng.choice(message['actions']), timeout=5)
+
+    def test_tables(self):
+        server = GameServer()
+        rng = random.Random(0)
+        tables = [server.create_table(players=2 + i % 3, seed=i)
+                  for i in range(12)]
+        bots = [gevent.spawn(self._bot, server.connect(table.id, seat), rng)
+                for table in tables
+                for seat in range(table.game.player_count)]
+        gevent.joinall(bots, timeout=30, raise_error=True)
+
+        for table in tables:
+            game = table.game
+            self.assertEqual(game.state, 'end')
+            winner = game.players.index(game.winner())
+            self.assertEqual(
+                [bot.value for bot in bots[:game.player_count]],
+                [winner] * game.player_count)
+            bots = bots[game.player_count:]
+        self.assertEqual(server.moves, sum(len(t.game.log) for t in tables))
+        self.assertGreater(server.latency_percentile(99), 0)
+        server.stop()
+
+    def test_invalid_moves(self):
+        server = GameServer()
+        table = server.create_table(seed=1)
+        active = server.connect(table.id, 0)
+        waiting = server.connect(table.id, 1)
+        self.assertEqual(active.receive(timeout=1)['type'], 'state')
+        self.assertEqual(active.receive(timeout=1)['type'], 'delta')
+        prompt = active.receive(timeout=1)
+        self.assertEqual(prompt['type'], 'prompt')
+
+        with self.assertRaises(ValueError):
+            waiting.move(ACTION_TAKE_CARD, timeout=1)
+        with self.assertRaises(ValueError):
+            active.move(ACTION_BID_CARD, timeout=1)
+        self.assertEqual(active.move(prompt['actions'][0], timeout=1), 2)
+        self.assertEqual(waiting.receive(timeout=1)['type'], 'state')
+        self.assertEqual(waiting.receive(timeout=1)['version'], 1)
+        self.assertEqual(waiting.receive(timeout=1)['version'], 2)
+        server.stop()
+
+    def test_bad_change_colors(self):
+        server = GameServer()
+        tables = [server.create_table(players=4, seed=seed)
+                  for seed in range(4)]
+        rng = random.Random(1)
+        bad = 0
+        clients = [[server.connect(table.id, seat) for seat in range(4)]
+                   for table in tables]
+        for table, clients in zip(tables, clients):
+            while table.game.state != 'end':
+                client = clients[table.game.seat]
+                message = client.receive(timeout=5)
+                if message['type'] != 'prompt':
+                    continue
+                public_card, card = None, message.get('card')
+                if 'public' in message:
+                    public_card = 0
+                    card = message['public'][0]
+                if card['type'] == 'change':
+                    wrong = [['purple'] * max(abs(card['value']), 1)]
+                    if card['value'] == 0:
+                        wrong = [['blue'], ['+purple']]
+                    for colors in wrong:
+                        with self.assertRaises(ValueError):
+                            client.move(ACTION_USE_CARD,
+                                        public_card=public_card,
+                                        change_colors=colors, timeout=5)
+                        bad += 1
+                self._move(client, message, rng)
+        self.assertGreater(bad, 0)
+        table = server.create_table(seed=9)
+        with self.assertRaises(AttributeError):
+            table.submit(None).get(timeout=5)
+        self.assertFalse(table.greenlet.dead)
+        server.stop()
+
+    def test_slow_client_resync(self):
+        server = GameServer(queue_size=2)
+        table = server.create_table(seed=1)
+        slow = server.connect(table.id, 1)
+        for i in range(3):
+            table.broadcast({'type': 'move', 'version': i})
+        self.assertEqual(slow.resyncs, 1)
+        self.assertEqual(slow.receive(timeout=1)['type'], 'state')
+        server.stop()
+
+    def test_recover_tables(self):
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'tables.db')
+        try:
+            server = GameServer(journal=Journal(path))
+            table = server.create_table(seed=3)
+            clients = [server.connect(table.id, seat) for seat in range(2)]
+            rng = random.Random(0)
+            for _ in range(12):
+                client = clients[table.game.seat]
+                message = client.receive(timeout=5)
+                while message['type'] != 'prompt':
+                    message = client.receive(timeout=5)
+                self._move(client, message, rng)
+            server.stop()
+            server.journal.close()
+            played = table.game.to_bytes()
+
+            server = GameServer(journal=Journal(path))
+            [table] = server.recover_tables()
+            clients = [server.connect(table.id, seat) for seat in range(2)]
+            gevent.sleep(0)
+            self.assertEqual(table.id, 1)
+            self.assertEqual(table.game.to_bytes(), played)
+            self.assertEqual(server.create_table().id, 2)
+            bots = [gevent.spawn(self._bot, client, rng)
+                    for client in clients]
+            gevent.joinall(bots, timeout=30, raise_error=True)
+            server.close_table(2)
+            self.assertEqual(server.journal.recover(), {})
+            server.stop()
+            server.journal.close()
+        finally:
+            shutil.rmtree(directory)
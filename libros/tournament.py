@@ -0,0 +1,233 @@
+"""Tournaments between Player classes, stopping once the result is known.
+
+    python -m libros.tournament --entrant bots:New --entrant bots:Old
+
+A match puts a few entrants at one table and plays the same deal once per
+seat rotation, so no entrant is favored by its seat or its cards. Every
+entrant plays every other one (round robin) or only the first entrant,
+the challenger, plays the rest (gauntlet). Each game updates the Elo
+rating of every pair of its players by who finished ahead.
+
+The games the challenger plays also feed a sequential probability ratio
+test of the challenger beating a rival ``elo1`` stronger than ``elo0``:
+a finished ahead of b counts as a win for a, like in the ratings. The
+tournament stops as soon as the test accepts either hypothesis, which
+mostly takes far fewer games than a fixed count would.
+"""
+import argparse
+import json
+import math
+import sys
+
+from itertools import combinations
+from multiprocessing import Pool, cpu_count
+
+from libros.game import split_seed
+from libros.simulate import load_policy, play_game
+
+
+SCHEDULES = ('round_robin', 'gauntlet')
+
+INITIAL_RATING = 1500.0
+
+# the results of a test, while it goes on it is None
+ACCEPT_H0, ACCEPT_H1 = 'H0', 'H1'
+
+
+def round_robin(entrants, seats=2):
+    """Returns the matches, tuples of entrant indexes, of every group of
+    ``seats`` entrants."""
+    return list(combinations(xrange(entrants), seats))
+
+
+def gauntlet(entrants, seats=2):
+    """Returns the matches of the first entrant against every group of
+    ``seats - 1`` others."""
+    return [(0,) + others
+            for others in combinations(xrange(1, entrants), seats - 1)]
+
+
+def elo_score(elo):
+    """Returns the expected score against a rival ``elo`` points weaker."""
+    return 1 / (1 + 10 ** (-elo / 400.0))
+
+
+class SPRT(object):
+    """Sequential probability ratio test of win/loss results.
+
+    H0 is a rating difference of ``elo0``, H1 of ``elo1``, ``alpha`` and
+    ``beta`` the chances of accepting H1 when H0 holds and H0 when H1
+    holds.
+    """
+
+    def __init__(self, elo0=0, elo1=30, alpha=0.05, beta=0.05):
+        self.elo0, self.elo1 = elo0, elo1
+        p0, p1 = elo_score(elo0), elo_score(elo1)
+        self.win_llr = math.log(p1 / p0)
+        self.loss_llr = math.log((1 - p1) / (1 - p0))
+        self.lower = math.log(beta / (1 - alpha))
+        self.upper = math.log((1 - beta) / alpha)
+        self.wins = 0
+        self.losses = 0
+
+    @property
+    def llr(self):
+        """The log likelihood ratio of H1 to H0 of the results so far."""
+        return self.wins * self.win_llr + self.losses * self.loss_llr
+
+    @property
+    def result(self):
+        llr = self.llr
+        if llr >= self.upper:
+            return ACCEPT_H1
+        if llr <= self.lower:
+            return ACCEPT_H0
+        return None
+
+    def add(self, wins, losses):
+        self.wins += wins
+        self.losses += losses
+
+
+def _play_match(args):
+    """Plays a deal in every seat rotation of a match. Returns the finishing
+    order of each game as entrant indexes."""
+    seed, match, policies = args
+    orders = []
+    for rotation in xrange(len(match)):
+        seats = match[rotation:] + match[:rotation]
+        game, _ = play_game(seed, [policies[entrant] for entrant in seats])
+        orders.append([seats[game.players.index(standing.player)]
+                       for standing in game.standings()])
+    return orders
+
+
+class Tournament(object):
+    """Plays matches of the ``entrants`` Player classes at tables of
+    ``seats`` players, in rounds of one deal per match."""
+
+    def __init__(self, entrants, seats=2, schedule='round_robin', k=16.0,
+                 sprt=None):
+        if schedule not in SCHEDULES:
+            raise ValueError('Unknown schedule.')
+        self.entrants = tuple(entrants)
+        if not 2 <= seats <= min(len(self.entrants), 4):
+            raise ValueError('Incorrect number of seats.')
+        self.seats = seats
+        self.schedule = schedule
+        self.matches = (round_robin if schedule == 'round_robin'
+                        else gauntlet)(len(self.entrants), seats)
+        self.k = k
+        self.sprt = sprt or SPRT()
+        self.ratings = [INITIAL_RATING] * len(self.entrants)
+        self.games = 0
+        self.rounds = 0
+        self.places = [[0] * seats for _ in self.entrants]
+
+    def add(self, order):
+        """Records a game's finishing order, entrant indexes first to
+        last."""
+        self.games += 1
+        for place, entrant in enumerate(order):
+            self.places[entrant][place] += 1
+
+        # every pair of players is a game won by the one ahead
+        ratings = self.ratings
+        k = self.k / (len(order) - 1)
+        changes = [0.0] * len(ratings)
+        for place, ahead in enumerate(order):
+            for behind in order[place + 1:]:
+                change = k * (1 - elo_score(ratings[ahead] -
+                                            ratings[behind]))
+                changes[ahead] += change
+                changes[behind] -= change
+        for entrant, change in enumerate(changes):
+            ratings[entrant] += change
+
+        if 0 in order:
+            place = order.index(0)
+            self.sprt.add(len(order) - place - 1, place)
+
+    @property
+    def result(self):
+        return self.sprt.result
+
+    def _tasks(self, seed, max_rounds):
+        round_number = self.rounds
+        while max_rounds is None or round_number < max_rounds:
+            for number, match in enumerate(self.matches):
+                yield (split_seed(seed, round_number, number), match,
+                       self.entrants)
+            round_number += 1
+
+    def run(self, max_games=10000, seed=0, processes=1):
+        """Plays rounds until the test decides or about ``max_games``
+        games are played, and returns the result of the test.
+
+        Results are recorded in the order of the matches whatever the
+        number of processes, so a run is reproducible from its seed.
+        """
+        per_round = len(self.matches) * self.seats
+        max_rounds = self.rounds + max(max_games // per_round, 1)
+        tasks = self._tasks(seed, max_rounds)
+        pool = None
+        if processes == 1:
+            results = (_play_match(task) for task in tasks)
+        else:
+            pool = Pool(processes or cpu_count())
+            results = pool.imap(_play_match, tasks)
+        try:
+            for number, orders in enumerate(results, 1):
+                for order in orders:
+                    self.add(order)
+                if number % len(self.matches) == 0:
+                    self.rounds += 1
+                    if self.result is not None:
+                        break
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+        return self.result
+
+    def as_dict(self):
+        sprt = self.sprt
+        return {
+            'entrants': [entrant.__name__ for entrant in self.entrants],
+            'games': self.games,
+            'rounds': self.rounds,
+            'ratings': self.ratings,
+            'places': self.places,
+            'sprt': {'wins': sprt.wins, 'losses': sprt.losses,
+                     'llr': sprt.llr, 'bounds': [sprt.lower, sprt.upper],
+                     'result': sprt.result},
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Libros tournament.')
+    parser.add_argument('--entrant', action='append', default=[],
+                        help='module:Class, the first one is the challenger')
+    parser.add_argument('--seats', type=int, default=2, choices=[2, 3, 4])
+    parser.add_argument('--schedule', choices=SCHEDULES,
+                        default='round_robin')
+    parser.add_argument('-n', '--max-games', type=int, default=10000)
+    parser.add_argument('-j', '--processes', type=int, default=None)
+    parser.add_argument('-s', '--seed', type=int, default=0)
+    parser.add_argument('--elo0', type=float, default=0)
+    parser.add_argument('--elo1', type=float, default=30)
+    parser.add_argument('--alpha', type=float, default=0.05)
+    parser.add_argument('--beta', type=float, default=0.05)
+    args = parser.parse_args(argv)
+
+    tournament = Tournament(
+        [load_policy(spec) for spec in args.entrant], args.seats,
+        args.schedule,
+        sprt=SPRT(args.elo0, args.elo1, args.alpha, args.beta))
+    tournament.run(args.max_games, args.seed, args.processes)
+    json.dump(tournament.as_dict(), sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
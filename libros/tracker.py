@@ -0,0 +1,175 @@
+"""What one seat can infer about the cards it has not seen.
+
+A CardTracker starts from the composition of the deck (see deal()) and
+takes out every card the seat sees, following the game's events like a
+DeltaStream client does, so the unseen cards (the deck, the other
+players' draws and the cards removed at the start) are always at hand
+as counts. Queries treat every unseen card as equally likely to be
+anywhere unseen and only read running totals, so they don't depend on
+how many cards are left.
+
+    tracker = CardTracker(game, seat=0)
+    tracker.draw_chance('blue')
+    tracker.expected_dice()
+    tracker.majority_chances('red')
+"""
+import math
+
+from libros.delta import full_view, view_event
+from libros.game import (
+    Card, CARDS, CARDS_BY_KEY, COLORS, TYPES, full_deck, removals,
+)
+
+
+def _normal_cdf(x):
+    return 0.5 * (1.0 + math.erf(x / math.sqrt(2.0)))
+
+
+class CardTracker(object):
+    """Unseen card counts of ``seat``, kept up to date from ``game``.
+
+    Attach it between two turns, ideally right after Game.start().
+    """
+
+    def __init__(self, game, seat):
+        self.game = game
+        self.seat = seat
+        players = game.player_count
+        _, gold_to_remove = removals(players)
+        # unseen cards by the index of the first equal card in CARDS
+        self.counts = [0] * len(CARDS)
+        self.unseen = 0
+        self.type_counts = dict.fromkeys(TYPES, 0)
+        self.type_values = dict.fromkeys(TYPES, 0)
+        self.type_squares = dict.fromkeys(TYPES, 0)
+        for card in full_deck(gold_to_remove):
+            self._add(card, 1)
+
+        view = full_view(game, seat)
+        self.dice = dict(view['dice'])
+        self.known = [dict.fromkeys(TYPES, 0) for _ in xrange(players)]
+        self.hidden = list(view['hands'])
+        self.hidden[seat] = 0
+        # the seat that put each pile card there, None when not known
+        self.pile_owners = [None] * view['pile']
+        seen = view['public'] + view['discarded'] + view['hand']
+        if view['auction'] >= 0:
+            seen.append(view['auction'])
+        for index in seen:
+            self._add(CARDS[index], -1)
+        for index in view['hand']:
+            self._know(seat, CARDS[index])
+        self.removed = (self.unseen - view['deck'] - view['pile'] -
+                        sum(self.hidden))
+        game.observers.append(self.observe)
+
+    def close(self):
+        self.game.observers.remove(self.observe)
+
+    def _add(self, card, count):
+        card = Card.from_dict(card)
+        self.counts[CARDS_BY_KEY[card.key].index] += count
+        self.unseen += count
+        self.type_counts[card.type] += count
+        self.type_values[card.type] += count * card.value
+        self.type_squares[card.type] += count * card.value * card.value
+
+    def _know(self, seat, card):
+        self.known[seat][card['type']] += card['value']
+
+    def observe(self, event):
+        event = view_event(event, self.seat)
+        if event[0] == 'dice':
+            self.dice[event[1]] = event[2]
+        if event[0] != 'card':
+            return
+        _, card, source, target, owner = event
+        if source == 'pile':
+            first_seen = self.pile_owners.pop() != self.seat
+        else:
+            # cards leaving the public zones or the seat's own draw were
+            # seen already
+            first_seen = source == 'deck' or (
+                source == 'drawn' and owner != self.seat)
+        if card is not None and first_seen:
+            self._add(card, -1)
+        if target == 'hand':
+            if card is None:
+                self.hidden[owner] += 1
+            else:
+                self._know(owner, card)
+        elif target == 'pile':
+            self.pile_owners.append(owner)
+
+    def card_chance(self, card):
+        """Returns the chance that the next card drawn is like ``card``."""
+        card = Card.from_dict(card)
+        return self.counts[CARDS_BY_KEY[card.key].index] / float(self.unseen)
+
+    def draw_chance(self, kind):
+        """Returns the chance that the next card drawn is of type ``kind``,
+        a color, 'gold' or 'change'."""
+        return self.type_counts[kind] / float(self.unseen)
+
+    @property
+    def live_share(self):
+        """The share of the unseen cards still to be played, as opposed to
+        removed or in a hand."""
+        if not self.unseen:
+            return 0.0
+        live = self.unseen - self.removed - sum(self.hidden)
+        return live / float(self.unseen)
+
+    def expected_dice(self):
+        """Returns the expected final value of each die, supposing every
+        change card still to be played is used on random colors."""
+        # a change card moves each color by its value / len(COLORS) on
+        # average, the plus or minus card by nothing
+        shift = (self.type_values['change'] * self.live_share /
+                 float(len(COLORS)))
+        return {color: value + shift for color, value in self.dice.iteritems()}
+
+    def majority_chances(self, color):
+        """Returns the chance of each seat ending with the majority of
+        ``color``.
+
+        The cards of ``color`` still to be played are shared out evenly
+        on average and the hidden hand cards are drawn from the unseen
+        ones. The totals are taken as normal, independent of each other.
+        """
+        players = len(self.known)
+        count = self.type_counts[color]
+        means, variances = [], []
+        if count:
+            mean = self.type_values[color] / float(count)
+            square = self.type_squares[color] / float(count)
+            live = count * self.live_share
+            held = count / float(self.unseen)
+        for seat in xrange(players):
+            total, variance = float(self.known[seat][color]), 0.0
+            if count:
+                share = 1.0 / players
+                total += live * share * mean
+                variance += live * (share * square - (share * mean) ** 2)
+                hidden = self.hidden[seat]
+                total += hidden * held * mean
+                variance += hidden * (held * square - (held * mean) ** 2)
+            means.append(total)
+            variances.append(variance)
+
+        chances = []
+        for seat in xrange(players):
+            chance = 1.0
+            for other in xrange(players):
+                if other == seat:
+                    continue
+                lead = means[seat] - means[other]
+                spread = math.sqrt(variances[seat] + variances[other])
+                if spread:
+                    chance *= _normal_cdf(lead / spread)
+                else:
+                    chance *= 1.0 if lead > 0 else 0.5 if lead == 0 else 0.0
+            chances.append(chance)
+        total = sum(chances)
+        return [chance / total if total else 1.0 / players
+                for chance in chances]
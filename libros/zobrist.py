@@ -0,0 +1,227 @@
+"""Zobrist hashing of game positions and transposition tables for search.
+
+Every card has a random 64-bit key per zone it can be seen in, and every
+die one per value. Game.zobrist is the sum of the keys of the cards and
+dice as they are (a sum rather than a xor, so two equal cards in a zone
+don't cancel out) and Game updates it on every card move and die change.
+The deck is left out: its cards are whatever has not been seen yet.
+Game.position_hash() adds the turn state, which is what the tables below
+are keyed by.
+
+The keys come from a fixed seed, so hashes agree between processes.
+"""
+import random
+import threading
+
+from collections import OrderedDict
+from itertools import islice, izip
+from multiprocessing import Lock, RawArray
+
+import numpy as np
+
+from libros.scoring import COLORS
+
+
+ZOBRIST_SEED = 0x4c4942524f53
+
+HASH_MASK = (1 << 64) - 1
+
+# zones a card is hashed in, then one hand per seat
+ZONE_SLOTS = {'drawn': 0, 'pile': 1, 'public': 2, 'auction': 3,
+              'discarded': 4}
+HAND_SLOT = 5
+MAX_SEATS = 4
+
+# change cards can't push a die further than this from its start
+DICE_VALUES = xrange(-12, 19)
+
+TURN_VALUES = 10
+
+
+def _random_keys(*keys):
+    return random.Random('%d:%s' % (ZOBRIST_SEED, ':'.join(keys)))
+
+
+def zone_keys(count):
+    """Returns the keys of ``count`` cards, a tuple per card by slot."""
+    rng = _random_keys('cards')
+    return tuple(tuple(rng.getrandbits(64)
+                       for _ in xrange(HAND_SLOT + MAX_SEATS))
+                 for _ in xrange(count))
+
+
+def _dice_keys():
+    rng = _random_keys('dice')
+    return {color: {value: rng.getrandbits(64) for value in DICE_VALUES}
+            for color in COLORS}
+
+
+DICE_ZOBRIST = _dice_keys()
+
+# multiplied by the small ints of the turn state, see turn_key()
+TURN_KEYS = tuple(_random_keys('turn').getrandbits(64) | 1
+                  for _ in xrange(TURN_VALUES))
+
+
+def dice_hash(dice):
+    return sum(DICE_ZOBRIST[color][value] for color, value in dice.iteritems())
+
+
+def turn_key(values):
+    """Returns the key of up to TURN_VALUES small ints."""
+    return sum(key * value for key, value in izip(TURN_KEYS, values))
+
+
+class TranspositionTable(object):
+    """Bounded map of position hashes to search results for one process.
+
+    Entries are kept from least to most recently used. When the table is
+    full the shallowest of the ``probe`` least recently used entries makes
+    room, so a result that took a deep search outlives cheap ones. Threads
+    can share a table.
+    """
+
+    def __init__(self, size=1 << 16, probe=4):
+        self.size = size
+        self.probe = probe
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return default
+            self.entries[key] = entry
+            self.hits += 1
+            return entry[1]
+
+    def store(self, key, value, depth=0):
+        with self._lock:
+            self._store(key, value, depth)
+
+    def add(self, key, values, depth=0):
+        """Adds ``values`` to the ints stored at ``key``, or stores them."""
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                values = [old + new for old, new in izip(entry[1], values)]
+            self._store(key, tuple(values), depth)
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+
+    def _store(self, key, value, depth):
+        entries = self.entries
+        if key in entries:
+            del entries[key]
+        elif len(entries) >= self.size:
+            oldest = islice(entries.iteritems(), self.probe)
+            # min() keeps the least recently used of equal depths
+            del entries[min(oldest, key=lambda item: item[1][0])[0]]
+        entries[key] = depth, value
+
+
+class SharedTranspositionTable(object):
+    """Transposition table of ``width`` ints per entry in shared memory.
+
+    Build it before the worker processes start (e.g. pass it to a Pool
+    initializer) and they all read and add to the same entries. Positions
+    hash to a bucket of two slots: one keeps the deepest entry, the other
+    takes whatever comes next.
+    """
+
+    def __init__(self, size=1 << 16, width=1 + MAX_SEATS):
+        self.buckets = max(size // 2, 1)
+        self.width = width
+        self.hits = 0
+        self.misses = 0
+        self._lock = Lock()
+        # keys, then depths (-1 when empty), then the values
+        slots = self.buckets * 2
+        self._memory = RawArray('B', 8 * slots * (2 + width))
+        self._views()
+        self._depths[:] = -1
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in ('_keys', '_depths', '_values'):
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._views()
+
+    def _views(self):
+        slots = self.buckets * 2
+        memory = np.frombuffer(self._memory, np.uint8)
+        self._keys = memory[:8 * slots].view(np.uint64)
+        self._depths = memory[8 * slots:16 * slots].view(np.int64)
+        self._values = memory[16 * slots:].view(np.int64).reshape(
+            slots, self.width)
+
+    def __len__(self):
+        return int((self._depths >= 0).sum())
+
+    def __contains__(self, key):
+        return self._find(key) is not None
+
+    def _find(self, key):
+        slot = key % self.buckets * 2
+        for slot in (slot, slot + 1):
+            if self._depths[slot] >= 0 and int(self._keys[slot]) == key:
+                return slot
+        return None
+
+    def get(self, key, default=None):
+        with self._lock:
+            slot = self._find(key)
+            if slot is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return tuple(int(value) for value in self._values[slot])
+
+    def store(self, key, value, depth=0):
+        with self._lock:
+            self._store(key, value, depth)
+
+    def add(self, key, values, depth=0):
+        """Adds ``values`` to the ints stored at ``key``, or stores them."""
+        with self._lock:
+            slot = self._find(key)
+            if slot is None:
+                self._store(key, values, depth)
+            else:
+                self._values[slot] += values
+                self._depths[slot] = depth
+
+    def clear(self):
+        with self._lock:
+            self._depths[:] = -1
+
+    def _store(self, key, value, depth):
+        slot = self._find(key)
+        if slot is None:
+            slot = key % self.buckets * 2
+            if depth >= self._depths[slot]:
+                # the deepest entry moves over to the other slot
+                self._keys[slot + 1] = self._keys[slot]
+                self._depths[slot + 1] = self._depths[slot]
+                self._values[slot + 1] = self._values[slot]
+            else:
+                slot += 1
+        self._keys[slot] = key
+        self._depths[slot] = depth
+        self._values[slot] = value